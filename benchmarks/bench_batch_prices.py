@@ -0,0 +1,58 @@
+"""
+对比查询 N 个交易对价格时「逐个调用 query_crypto_price」与「一次 query_batch_crypto_prices
+（全市场价格快照 + 字典查找）」的耗时与上游请求数。
+
+用法：python benchmarks/bench_batch_prices.py --symbols 50 --rounds 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crypto_mcp_server  # noqa: E402
+from mock_binance import MockBinanceServer  # noqa: E402
+from bench_http_pool import report  # noqa: E402
+
+
+async def fan_out(symbols: list[str]) -> None:
+    """旧用法：LLM 为每个交易对各调用一次 query_crypto_price"""
+    await asyncio.gather(*(crypto_mcp_server.query_crypto_price(symbol) for symbol in symbols))
+
+
+async def batch(symbols: list[str]) -> None:
+    await crypto_mcp_server.query_batch_crypto_prices(symbols)
+
+
+async def measure(query, symbols: list[str], rounds: int) -> list[float]:
+    latencies = []
+    for _ in range(rounds):
+        # 每轮清空缓存，模拟快照已过期的最坏情况
+        crypto_mcp_server._response_cache.clear()
+        start = time.perf_counter()
+        await query(symbols)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="批量价格查询基准测试")
+    parser.add_argument("--symbols", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    opts = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    symbols = ["BTCUSDT"] + [f"COIN{i}USDT" for i in range(opts.symbols - 1)]
+    with MockBinanceServer() as server:
+        crypto_mcp_server.BINANCE_PRICE_API = f"{server.base_url}/api/v3/ticker/price"
+        crypto_mcp_server.BINANCE_BATCH_PRICE_API = f"{server.base_url}/api/v3/ticker/price"
+        report(f"per-symbol x{opts.symbols}", await measure(fan_out, symbols, opts.rounds))
+        report(f"batch x{opts.symbols}", await measure(batch, symbols, opts.rounds))
+        await crypto_mcp_server.close_http_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+"""
+对比 deep_search / deep_search_and_summarize 在并发调用下，同步客户端（阻塞事件循环）
+与异步客户端（请求互相重叠）的总耗时；以及单次调用中逐条串行、逐条并发、合并为一次请求
+三种总结方式的耗时；再校验模型返回空内容时各总结方式回退为资料原文；最后对比启用本地缓存后重复调研的耗时。
+
+用法：python benchmarks/bench_deepsearch.py --calls 8 --latency-ms 200 --results 3 --summary-results 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from openai import OpenAI
+from tavily import TavilyClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import deepsearch_mcp_server  # noqa: E402
+from mock_search import MockSearchServer  # noqa: E402
+
+
+async def blocking_deep_search_and_summarize(query: str, max_results: int) -> str:
+    """旧实现：async 工具内部直接调用同步的 TavilyClient 与 OpenAI 客户端"""
+    tavily = TavilyClient(api_key="bench", api_base_url=deepsearch_mcp_server.TAVILY_API_BASE_URL)
+    data = tavily.search(query=query, search_depth="advanced", max_results=max_results).get("results", [])
+    client = OpenAI(base_url=deepsearch_mcp_server.OPENROUTER_BASE_URL, api_key="bench")
+    parts = []
+    for item in data:
+        response = client.chat.completions.create(
+            model="google/gemini-2.0-flash-exp:free",
+            messages=[{"role": "user", "content": item["content"]}]
+        )
+        parts.append(response.choices[0].message.content)
+    return "\n".join(parts)
+
+
+async def measure(tool, calls: int, max_results: int) -> float:
+    """并发发起 calls 次工具调用，返回总耗时（毫秒）"""
+    start = time.perf_counter()
+    await asyncio.gather(*(tool(f"query {i}", max_results) for i in range(calls)))
+    return (time.perf_counter() - start) * 1000
+
+
+async def check_empty_summaries(server: MockSearchServer, max_results: int):
+    """模型返回空内容时，合并总结与逐条总结都应回退为资料原文，而不是输出 None"""
+    server.empty_summaries = True
+    try:
+        for mode in ("one_shot", "per_item"):
+            query = f"empty summary {mode}"
+            report = await deepsearch_mcp_server.deep_search_and_summarize(query, max_results, mode)
+            if "None" in report or f"关于 {query} 的第 0 条资料内容。" not in report:
+                raise SystemExit(f"模型返回空内容时 {mode} 总结没有回退为原文：\n{report}")
+    finally:
+        server.empty_summaries = False
+    print("empty model output falls back to source text (one_shot, per_item)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="deepsearch 并发基准测试")
+    parser.add_argument("--calls", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--results", type=int, default=3)
+    parser.add_argument("--summary-results", type=int, default=20)
+    opts = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    os.environ["TAVILY_API_KEY"] = os.environ["OPENROUTER_API_KEY"] = "bench"
+    # 对比客户端与总结方式时关闭缓存，避免重复查询直接命中
+    search_ttl, summary_ttl = deepsearch_mcp_server.SEARCH_CACHE_TTL, deepsearch_mcp_server.SUMMARY_CACHE_TTL
+    deepsearch_mcp_server.SEARCH_CACHE_TTL = deepsearch_mcp_server.SUMMARY_CACHE_TTL = 0
+    with MockSearchServer(latency_ms=opts.latency_ms) as server:
+        deepsearch_mcp_server.TAVILY_API_BASE_URL = server.base_url
+        deepsearch_mcp_server.OPENROUTER_BASE_URL = server.base_url
+        per_call = (1 + opts.results) * opts.latency_ms
+        print(f"{opts.calls} concurrent calls, {opts.results} results each, "
+              f"{opts.latency_ms:.0f}ms per upstream request ({per_call:.0f}ms per call if serial)")
+
+        for name, tool in (("sync clients", blocking_deep_search_and_summarize),
+                           ("async clients", deepsearch_mcp_server.deep_search_and_summarize)):
+            before = server.requests
+            elapsed = await measure(tool, opts.calls, opts.results)
+            print(f"{name:<16} total={elapsed:9.1f}ms  upstream requests={server.requests - before}")
+
+        print(f"\n1 call, {opts.summary_results} results")
+        concurrency = deepsearch_mcp_server.SUMMARY_CONCURRENCY
+        for name, mode, limit in (("per-item serial", "per_item", 1),
+                                  ("per-item concurrent", "per_item", concurrency),
+                                  ("one-shot", "one_shot", concurrency)):
+            deepsearch_mcp_server.SUMMARY_CONCURRENCY = limit
+            before = server.requests
+            start = time.perf_counter()
+            await deepsearch_mcp_server.deep_search_and_summarize("query", opts.summary_results, mode)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"{name:<20} total={elapsed:9.1f}ms  upstream requests={server.requests - before}")
+        deepsearch_mcp_server.SUMMARY_CONCURRENCY = concurrency
+        await check_empty_summaries(server, opts.results)
+
+        print(f"\ncache ({deepsearch_mcp_server._search_cache.path})")
+        deepsearch_mcp_server.SEARCH_CACHE_TTL, deepsearch_mcp_server.SUMMARY_CACHE_TTL = search_ttl, summary_ttl
+        query = f"cache query {time.time()}"
+        for name in ("first run", "repeat run"):
+            before = server.requests
+            start = time.perf_counter()
+            await deepsearch_mcp_server.deep_search_and_summarize(query, opts.summary_results, "per_item")
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"{name:<20} total={elapsed:9.1f}ms  upstream requests={server.requests - before}")
+        deepsearch_mcp_server._search_cache.close()
+        await deepsearch_mcp_server.close_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
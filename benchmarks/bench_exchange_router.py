@@ -0,0 +1,73 @@
+"""
+多交易所路由基准测试：模拟一个响应较慢的币安与一个较快的 OKX，对比
+1. 只请求币安；
+2. 对冲请求（首选超过 hedge 延迟未返回时并发请求下一个），以及路由按延迟 EWMA 学会首选更快的交易所后；
+3. 币安不可用时回退到 OKX 的耗时。
+
+用法：python benchmarks/bench_exchange_router.py --slow-ms 200 --fast-ms 20 --hedge-ms 50 --rounds 30
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crypto_mcp_server  # noqa: E402
+from mock_binance import MockBinanceServer  # noqa: E402
+from bench_http_pool import report  # noqa: E402
+
+
+async def measure(router, rounds: int) -> list[float]:
+    latencies = []
+    for _ in range(rounds):
+        # 每轮清空缓存，让币安价格请求真正访问（模拟的）上游
+        crypto_mcp_server._response_cache.clear()
+        start = time.perf_counter()
+        venue, data = await router.first("price", "BTCUSDT")
+        assert venue is not None, data
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="多交易所路由基准测试")
+    parser.add_argument("--slow-ms", type=float, default=200)
+    parser.add_argument("--fast-ms", type=float, default=20)
+    parser.add_argument("--hedge-ms", type=float, default=50)
+    parser.add_argument("--rounds", type=int, default=30)
+    opts = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    with MockBinanceServer(latency_ms=opts.slow_ms) as slow, MockBinanceServer(latency_ms=opts.fast_ms) as fast:
+        crypto_mcp_server.BINANCE_PRICE_API = f"{slow.base_url}/api/v3/ticker/price"
+        hedge = opts.hedge_ms / 1000
+
+        binance_only = crypto_mcp_server.ExchangeRouter([crypto_mcp_server.BinanceAdapter()], hedge)
+        report("binance only", await measure(binance_only, opts.rounds))
+
+        router = crypto_mcp_server.ExchangeRouter(
+            [crypto_mcp_server.BinanceAdapter(), crypto_mcp_server.OkxAdapter(fast.base_url)], hedge)
+        report("hedged (first 3)", await measure(router, 3))
+        report("hedged (learned)", await measure(router, opts.rounds))
+        print(f"router stats: {router.stats()}")
+
+        crypto_mcp_server.BINANCE_PRICE_API = f"http://127.0.0.1:{closed_port()}/api/v3/ticker/price"
+        down = crypto_mcp_server.ExchangeRouter(
+            [crypto_mcp_server.BinanceAdapter(), crypto_mcp_server.OkxAdapter(fast.base_url)], hedge)
+        report("binance down", await measure(down, opts.rounds))
+        print(f"router stats: {down.stats()}")
+        await crypto_mcp_server.close_http_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""
+资金费率子系统基准测试：
+1. 全市场资金费率扫描：首次（premiumIndex + fundingInfo）与快照缓存命中时的耗时；
+2. 资金费率历史：本地库为空时按页补齐 N 个合约的长区间历史，与之后直接读库的耗时；
+3. 权重调度器被后台请求占满时，资金费率历史查询（工具调用）仍按交互优先级先执行，不会被饿死。
+
+用法：python benchmarks/bench_funding.py --symbols 20 --limit 3000 --rounds 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crypto_mcp_server  # noqa: E402
+from mock_binance import MockBinanceServer  # noqa: E402
+from bench_http_pool import report  # noqa: E402
+
+
+async def timed(coro_factory, rounds: int, clear_cache: bool = False) -> list[float]:
+    latencies = []
+    for _ in range(rounds):
+        if clear_cache:
+            crypto_mcp_server._response_cache.clear()
+        start = time.perf_counter()
+        await coro_factory()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def history_under_background_load(symbol: str, background: int = 100) -> float:
+    """
+    让模拟服务器所在主机的权重调度器耗尽令牌，并排入 background 个后台请求，
+    再补齐一个新合约的资金费率历史。
+    :return: 查询耗时（毫秒）；查询失败或排在后台请求之后时退出并报错
+    """
+    host = urlsplit(crypto_mcp_server.BINANCE_FUNDING_RATE_API).netloc
+    limiter = crypto_mcp_server.WeightLimiter(600)  # 每秒补充 8 个权重
+    limiter.tokens = 0
+    crypto_mcp_server._weight_limiters[host] = limiter
+    waiters = [asyncio.ensure_future(limiter.acquire(1, crypto_mcp_server.PRIORITY_BACKGROUND))
+               for _ in range(background)]
+    await asyncio.sleep(0)
+    try:
+        start = time.perf_counter()
+        rows = await crypto_mcp_server.fetch_funding_history(symbol, limit=100)
+        elapsed = time.perf_counter() - start
+        still_waiting = sum(1 for w in waiters if not w.done())
+    finally:
+        for w in waiters:
+            w.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        del crypto_mcp_server._weight_limiters[host]
+    max_wait = crypto_mcp_server.RATE_LIMIT_MAX_WAIT[crypto_mcp_server.PRIORITY_INTERACTIVE]
+    if isinstance(rows, dict) or elapsed > max_wait or still_waiting == 0:
+        raise SystemExit(f"后台请求占满权重时资金费率历史查询被饿死: {rows if isinstance(rows, dict) else f'{elapsed:.2f}s'}")
+    return elapsed * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="资金费率子系统基准测试")
+    parser.add_argument("--symbols", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=3000)
+    parser.add_argument("--rounds", type=int, default=20)
+    opts = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    symbols = [f"PERP{i}USDT" for i in range(opts.symbols)]
+    with MockBinanceServer() as server, tempfile.TemporaryDirectory() as tmp:
+        crypto_mcp_server.BINANCE_FUNDING_RATE_API = f"{server.base_url}/fapi/v1/fundingRate"
+        crypto_mcp_server.BINANCE_PREMIUM_INDEX_API = f"{server.base_url}/fapi/v1/premiumIndex"
+        crypto_mcp_server.BINANCE_FUNDING_INFO_API = f"{server.base_url}/fapi/v1/fundingInfo"
+        crypto_mcp_server._funding_store = crypto_mcp_server.FundingStore(os.path.join(tmp, "funding.sqlite3"))
+
+        scan = lambda: crypto_mcp_server.query_funding_scanner("extreme", 20)  # noqa: E731
+        report("funding scan (cold)", await timed(scan, opts.rounds, clear_cache=True))
+        report("funding scan (cached)", await timed(scan, opts.rounds))
+
+        async def history():
+            await asyncio.gather(*(crypto_mcp_server.fetch_funding_history(s, limit=opts.limit) for s in symbols))
+
+        report(f"history x{opts.symbols} (backfill)", await timed(history, 1))
+        report(f"history x{opts.symbols} (local store)", await timed(history, opts.rounds))
+        report("history under 100 background waiters", [await history_under_background_load("STARVEUSDT")])
+        crypto_mcp_server._funding_store.close()
+        await crypto_mcp_server.close_http_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""
+对比「每次调用新建 httpx.AsyncClient」与「共享连接池」两种方式的请求延迟。
+
+用法：python benchmarks/bench_http_pool.py --requests 500 --concurrency 10 --handshake-ms 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crypto_mcp_server  # noqa: E402
+from mock_binance import MockBinanceServer  # noqa: E402
+
+
+async def fetch_with_new_client(symbol: str) -> dict:
+    """旧实现：每次请求都新建客户端（重新建立连接）"""
+    async with httpx.AsyncClient() as client:
+        response = await client.get(crypto_mcp_server.BINANCE_PRICE_API, params={"symbol": symbol},
+                                    headers={"User-Agent": crypto_mcp_server.USER_AGENT}, timeout=30.0)
+        response.raise_for_status()
+        return response.json()
+
+
+async def fetch_with_pooled_client(symbol: str) -> dict:
+    """
+    新实现：通过共享连接池发起同样的请求。
+    直接计时 HTTP 调用，不经过 fetch_crypto_price 的响应缓存与并发请求合并，只比较连接复用的效果。
+    """
+    client = crypto_mcp_server._get_http_client(crypto_mcp_server.BINANCE_PRICE_API)
+    response = await client.get(crypto_mcp_server.BINANCE_PRICE_API, params={"symbol": symbol},
+                                headers={"User-Agent": crypto_mcp_server.USER_AGENT}, timeout=30.0)
+    response.raise_for_status()
+    return response.json()
+
+
+async def run(fetch, total: int, concurrency: int) -> list[float]:
+    """以固定并发执行 total 次请求，返回每次请求的耗时（毫秒）"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await fetch("BTCUSDT")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(total)))
+    return latencies
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name: str, latencies: list[float]):
+    print(f"{name:<16} p50={percentile(latencies, 50):8.2f}ms  p99={percentile(latencies, 99):8.2f}ms  "
+          f"mean={statistics.mean(latencies):8.2f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="HTTP 连接池基准测试")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--handshake-ms", type=float, default=20.0, help="模拟每条新连接的握手延迟")
+    opts = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    with MockBinanceServer(handshake_ms=opts.handshake_ms) as server:
+        crypto_mcp_server.BINANCE_PRICE_API = f"{server.base_url}/api/v3/ticker/price"
+        print(f"mock server: {server.base_url}, requests={opts.requests}, "
+              f"concurrency={opts.concurrency}, handshake={opts.handshake_ms}ms")
+
+        report("new client", await run(fetch_with_new_client, opts.requests, opts.concurrency))
+        report("pooled client", await run(fetch_with_pooled_client, opts.requests, opts.concurrency))
+        await crypto_mcp_server.close_http_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""
+对比 NumPy 向量化指标计算与逐根K线的纯 Python 循环实现（同一份 1000 根K线输入），
+同时校验两者结果一致。
+
+用法：python benchmarks/bench_indicators.py --candles 1000 --rounds 200
+"""
+import argparse
+import logging
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crypto_mcp_server  # noqa: E402
+from mock_binance import _klines  # noqa: E402
+
+
+def python_indicators(data: list) -> dict:
+    """纯 Python 循环版本：逐行 float() 解析并逐根K线递推"""
+    high = [float(row[2]) for row in data]
+    low = [float(row[3]) for row in data]
+    close = [float(row[4]) for row in data]
+    volume = [float(row[5]) for row in data]
+    n = len(close)
+    result = {"count": n, "close": close[-1]}
+
+    for period in (20, 50, 200):
+        result[f"sma{period}"] = sum(close[-period:]) / period if n >= period else None
+
+    def ema(values, alpha):
+        out, previous = [], values[0]
+        for value in values:
+            previous = (1 - alpha) * previous + alpha * value
+            out.append(previous)
+        return out
+
+    def rma(values, period):
+        previous = sum(values[:period]) / period
+        for value in values[period:]:
+            previous = (1 - 1 / period) * previous + value / period
+        return previous
+
+    for span in (12, 26):
+        result[f"ema{span}"] = ema(close, 2 / (span + 1))[-1]
+
+    gains = [max(close[i] - close[i - 1], 0) for i in range(1, n)]
+    losses = [max(close[i - 1] - close[i], 0) for i in range(1, n)]
+    avg_gain, avg_loss = rma(gains, 14), rma(losses, 14)
+    result["rsi14"] = 100.0 if avg_loss == 0 else 100 - 100 / (1 + avg_gain / avg_loss)
+
+    macd = [a - b for a, b in zip(ema(close, 2 / 13), ema(close, 2 / 27))]
+    signal = ema(macd, 2 / 10)
+    result["macd"], result["macd_signal"], result["macd_hist"] = macd[-1], signal[-1], macd[-1] - signal[-1]
+
+    window = close[-20:]
+    mid = sum(window) / 20
+    std = math.sqrt(sum((x - mid) ** 2 for x in window) / 20)
+    result["boll_upper"], result["boll_mid"], result["boll_lower"] = mid + 2 * std, mid, mid - 2 * std
+
+    true_range = [max(high[i] - low[i], abs(high[i] - close[i - 1]), abs(low[i] - close[i - 1])) for i in range(1, n)]
+    result["atr14"] = rma(true_range, 14)
+
+    total_volume = sum(volume)
+    result["vwap"] = sum((h + l + c) / 3 * v for h, l, c, v in zip(high, low, close, volume)) / total_volume
+    return result
+
+
+def numpy_indicators(data: list) -> dict:
+    return crypto_mcp_server.compute_indicators(crypto_mcp_server.parse_klines(data))
+
+
+def timed(func, data, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(data)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="技术指标计算基准测试")
+    parser.add_argument("--candles", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    opts = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    data = _klines({"interval": ["1m"], "limit": [str(opts.candles)]})
+    expected, actual = python_indicators(data), numpy_indicators(data)
+    for key, value in expected.items():
+        if value is not None and not math.isclose(value, actual[key], rel_tol=1e-9, abs_tol=1e-9):
+            raise SystemExit(f"结果不一致: {key} python={value} numpy={actual[key]}")
+
+    python_ms = timed(python_indicators, data, opts.rounds)
+    numpy_ms = timed(numpy_indicators, data, opts.rounds)
+    print(f"candles={opts.candles} rounds={opts.rounds} (results match)")
+    print(f"pure python  {python_ms:8.3f} ms/round")
+    print(f"numpy        {numpy_ms:8.3f} ms/round  ({python_ms / numpy_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+K线解析与格式化的微基准：逐行 int()/float()/strftime() 的旧实现 vs 列式解析。
+同时校验两种实现的格式化输出完全一致。
+
+用法：python benchmarks/bench_kline_parsing.py --candles 1000 --rounds 200
+"""
+import argparse
+import datetime
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crypto_mcp_server  # noqa: E402
+from mock_binance import _klines  # noqa: E402
+
+
+def format_klines_rowwise(data: list) -> str:
+    """旧实现：逐行转换类型并调用 fromtimestamp().strftime()"""
+    result = ["🕰️ K线数据列表（时间从旧到新）：\n"]
+    result.append(f"{'时间':<20} {'开盘':<10} {'最高':<10} {'最低':<10} {'收盘':<10} {'交易量'}")
+    for kline in data:
+        timestamp = int(kline[0])
+        open_price = float(kline[1])
+        high_price = float(kline[2])
+        low_price = float(kline[3])
+        close_price = float(kline[4])
+        volume = float(kline[5])
+        time_str = datetime.datetime.fromtimestamp(timestamp / 1000).strftime('%Y-%m-%d %H:%M:%S')
+        result.append(
+            f"{time_str:<20} {open_price:<10.4f} {high_price:<10.4f} {low_price:<10.4f} {close_price:<10.4f} {volume:.2f}"
+        )
+    return '\n'.join(result)
+
+
+def parse_rowwise(data: list) -> list:
+    """旧实现的解析部分：每行一个 tuple"""
+    return [(int(k[0]), float(k[1]), float(k[2]), float(k[3]), float(k[4]), float(k[5])) for k in data]
+
+
+def timed(func, data, rounds: int, repeat: int = 5) -> float:
+    """重复 repeat 组、每组 rounds 次，取最快一组的单次耗时（毫秒），减少调度抖动的影响"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            func(data)
+        best = min(best, (time.perf_counter() - start) / rounds * 1000)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="K线解析微基准")
+    parser.add_argument("--candles", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    opts = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    data = _klines({"interval": ["1m"], "limit": [str(opts.candles)]})
+    if format_klines_rowwise(data) != crypto_mcp_server.format_crypto_klines(data):
+        raise SystemExit("格式化输出不一致")
+
+    cases = [
+        ("parse", parse_rowwise, crypto_mcp_server.parse_klines),
+        ("time strings", lambda d: [datetime.datetime.fromtimestamp(int(k[0]) / 1000).strftime('%Y-%m-%d %H:%M:%S')
+                                    for k in d],
+         lambda d: crypto_mcp_server.parse_klines(d).time_strings()),
+        ("format", format_klines_rowwise, crypto_mcp_server.format_crypto_klines),
+    ]
+    print(f"candles={opts.candles} rounds={opts.rounds} (outputs match)")
+    for name, before, after in cases:
+        before_ms, after_ms = timed(before, data, opts.rounds), timed(after, data, opts.rounds)
+        print(f"{name:<14} before={before_ms:8.3f}ms  after={after_ms:8.3f}ms  ({before_ms / after_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
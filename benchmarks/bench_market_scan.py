@@ -0,0 +1,61 @@
+"""
+对比回答「今天涨幅最大的币」时「逐个调用 query_crypto_price」与一次 query_market_scanner
+（全市场 24 小时行情快照 + 列式索引 + argpartition）的耗时与上游请求数，
+并测量快照缓存命中时的重复扫描耗时。
+
+用法：python benchmarks/bench_market_scan.py --symbols 50 --rounds 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crypto_mcp_server  # noqa: E402
+from mock_binance import MockBinanceServer  # noqa: E402
+from bench_http_pool import report  # noqa: E402
+
+
+async def fan_out(symbols: list[str]) -> None:
+    """旧用法：LLM 为每个交易对各调用一次 query_crypto_price"""
+    await asyncio.gather(*(crypto_mcp_server.query_crypto_price(symbol) for symbol in symbols))
+
+
+async def scan(symbols: list[str]) -> None:
+    await crypto_mcp_server.query_market_scanner("gainers", 20, "USDT")
+
+
+async def measure(query, symbols: list[str], rounds: int, cold: bool = True) -> list[float]:
+    latencies = []
+    for _ in range(rounds):
+        if cold:
+            # 清空缓存，模拟快照已过期的情况
+            crypto_mcp_server._response_cache.clear()
+        start = time.perf_counter()
+        await query(symbols)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="市场扫描基准测试")
+    parser.add_argument("--symbols", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    opts = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    symbols = [f"COIN{i}USDT" for i in range(opts.symbols)]
+    with MockBinanceServer() as server:
+        crypto_mcp_server.BINANCE_PRICE_API = f"{server.base_url}/api/v3/ticker/price"
+        crypto_mcp_server.BINANCE_TICKER_24HR_API = f"{server.base_url}/api/v3/ticker/24hr"
+        report(f"per-symbol price x{opts.symbols}", await measure(fan_out, symbols, opts.rounds))
+        report("market scan (cold)", await measure(scan, symbols, opts.rounds))
+        report("market scan (cached)", await measure(scan, symbols, opts.rounds, cold=False))
+        await crypto_mcp_server.close_http_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+"""
+对比 query_crypto_price 走 REST（共享连接池）与走 WebSocket 内存状态表的延迟。
+
+用法：python benchmarks/bench_market_stream.py --requests 1000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crypto_mcp_server  # noqa: E402
+from mock_binance import MockBinanceServer, MockBinanceStream  # noqa: E402
+from bench_http_pool import report  # noqa: E402
+
+
+async def measure(total: int) -> list[float]:
+    latencies = []
+    for _ in range(total):
+        start = time.perf_counter()
+        await crypto_mcp_server.query_crypto_price("BTCUSDT")
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="WebSocket 行情流基准测试")
+    parser.add_argument("--requests", type=int, default=1000)
+    opts = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    with MockBinanceServer() as server:
+        crypto_mcp_server.BINANCE_PRICE_API = f"{server.base_url}/api/v3/ticker/price"
+        # 关闭响应缓存的影响：TTL 设为 0，每次都走上游
+        crypto_mcp_server.CACHE_TTL["price"] = 0
+        report("rest", await measure(opts.requests))
+
+        async with MockBinanceStream() as stream:
+            market = crypto_mcp_server.start_market_stream(["BTCUSDT"], url=stream.url)
+            while market.get_price("BTCUSDT") is None:
+                await asyncio.sleep(0.01)
+            report("websocket", await measure(opts.requests))
+            print(f"stream stats: {market.stats()}")
+            await crypto_mcp_server.stop_market_stream()
+        await crypto_mcp_server.close_http_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
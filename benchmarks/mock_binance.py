@@ -0,0 +1,319 @@
+"""
+本地模拟币安 REST API（以及 OKX v5 公共行情接口）与组合行情流，用于基准测试（不访问真实网络）。
+
+REST 支持 HTTP/1.1 keep-alive；通过 handshake_ms 在每条新连接的首个请求上
+注入额外延迟，用来模拟真实环境下 TCP + TLS 握手的往返开销。
+WebSocket 行情流支持 SUBSCRIBE 订阅，可注入深度序号缺口和主动断线。
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+# 全市场价格快照中的交易对数量，与币安现货交易对数量级相当
+ALL_TICKER_COUNT = 2000
+
+
+def _ticker_price(query: dict) -> object:
+    if "symbol" not in query:
+        tickers = [{"symbol": "BTCUSDT", "price": "65000.12000000"}]
+        tickers += [{"symbol": f"COIN{i}USDT", "price": f"{1 + i * 0.01:.8f}"} for i in range(ALL_TICKER_COUNT - 1)]
+        return tickers
+    return {"symbol": query["symbol"][0], "price": "65000.12000000"}
+
+
+def _ticker_24hr(query: dict) -> object:
+    def ticker(symbol: str, i: int) -> dict:
+        price = 1 + i * 0.01
+        return {
+            "symbol": symbol, "priceChange": f"{price * 0.01:.8f}", "priceChangePercent": f"{(i * 37) % 41 - 20:.3f}",
+            "lastPrice": f"{price:.8f}", "bidPrice": f"{price * 0.999:.8f}", "askPrice": f"{price * 1.001:.8f}",
+            "highPrice": f"{price * 1.05:.8f}", "lowPrice": f"{price * 0.95:.8f}",
+            "volume": f"{1000 + i * 13:.2f}", "quoteVolume": f"{(1000 + i * 13) * price:.2f}", "count": i % 500,
+        }
+    if "symbol" not in query:
+        quotes = ("USDT", "BTC", "FDUSD")
+        return [ticker(f"COIN{i}{quotes[i % len(quotes)]}", i) for i in range(ALL_TICKER_COUNT)]
+    return ticker(query["symbol"][0], 1)
+
+
+# 资金费率结算间隔与模拟合约的上线时间（约 2 年前，足够测试多页补齐）
+FUNDING_INTERVAL_MS = 8 * 3_600_000
+FUNDING_LISTED_MS = 730 * 86_400_000
+
+
+def _funding_rate(query: dict) -> object:
+    symbol = query["symbol"][0]
+    limit = int(query.get("limit", ["100"])[0])
+    now = int(time.time() * 1000)
+    last = now - now % FUNDING_INTERVAL_MS
+    first = last - FUNDING_LISTED_MS
+    end = min(int(query.get("endTime", [now])[0]), last)
+    if "startTime" in query:
+        start = max(int(query["startTime"][0]), first)
+        start += (-start) % FUNDING_INTERVAL_MS
+        times = range(start, end + 1, FUNDING_INTERVAL_MS)[:limit]
+    else:
+        end -= end % FUNDING_INTERVAL_MS
+        times = range(max(end - (limit - 1) * FUNDING_INTERVAL_MS, first), end + 1, FUNDING_INTERVAL_MS)
+    return [
+        {"symbol": symbol, "fundingTime": t, "fundingRate": f"{((t // FUNDING_INTERVAL_MS) % 7 - 2) * 0.00005:.8f}",
+         "markPrice": "65000.00000000"}
+        for t in times
+    ]
+
+
+def _premium_index(query: dict) -> object:
+    def item(symbol: str, i: int) -> dict:
+        return {
+            "symbol": symbol, "markPrice": f"{1 + i * 0.01:.8f}", "indexPrice": f"{(1 + i * 0.01) * 0.9995:.8f}",
+            "estimatedSettlePrice": "0", "lastFundingRate": f"{((i * 37) % 41 - 20) * 0.00005:.8f}",
+            "interestRate": "0.00010000", "nextFundingTime": int(time.time() * 1000) // 28_800_000 * 28_800_000 + 28_800_000,
+            "time": int(time.time() * 1000),
+        }
+    if "symbol" not in query:
+        items = [item(f"PERP{i}{'USDC' if i % 4 == 0 else 'USDT'}", i) for i in range(ALL_TICKER_COUNT // 4)]
+        items.append({**item("BTCUSDT_260626", 0), "lastFundingRate": ""})  # 交割合约
+        return items
+    return item(query["symbol"][0], 1)
+
+
+def _funding_info(query: dict) -> object:
+    return [{"symbol": f"PERP{i}USDT", "fundingIntervalHours": 4} for i in range(1, ALL_TICKER_COUNT // 4, 10)]
+
+
+_UNIT_MS = {"m": 60_000, "h": 3_600_000, "d": 86_400_000, "w": 604_800_000, "M": 2_592_000_000}
+
+
+def _klines(query: dict) -> object:
+    interval = query.get("interval", ["1m"])[0]
+    step = int(interval[:-1]) * _UNIT_MS[interval[-1]]
+    limit = int(query.get("limit", ["500"])[0])
+    now = int(time.time() * 1000)
+    last_open = now - now % step
+    if "startTime" in query:
+        start = int(query["startTime"][0])
+        first = start + (-start) % step
+        end = min(int(query.get("endTime", [now])[0]), last_open)
+        opens = range(first, end + 1, step)[:limit]
+    else:
+        end = min(int(query.get("endTime", [now])[0]), last_open)
+        end -= end % step
+        opens = range(end - (limit - 1) * step, end + 1, step)
+    rows = []
+    for open_time in opens:
+        price = 65000 + (open_time // step % 50) * 3.5
+        rows.append([
+            open_time, f"{price:.2f}", f"{price + 10:.2f}", f"{price - 10:.2f}",
+            f"{price + 1.5:.2f}", "12.34500000", open_time + step - 1,
+            "802425.00", 321, "6.1", "396000.0", "0"
+        ])
+    return rows
+
+
+def _depth(query: dict, last_update_id: int = 1027024) -> object:
+    limit = int(query.get("limit", ["100"])[0])
+    return {
+        "lastUpdateId": last_update_id,
+        "bids": [[f"{65000 - i * 0.01:.2f}", "1.00000000"] for i in range(limit)],
+        "asks": [[f"{65000.01 + i * 0.01:.2f}", "1.00000000"] for i in range(limit)],
+    }
+
+
+def _okx(data: list) -> dict:
+    return {"code": "0", "msg": "", "data": data}
+
+
+def _okx_ticker(query: dict) -> object:
+    return _okx([{"instId": query["instId"][0], "last": "65010.5", "bidPx": "65010.4", "askPx": "65010.6",
+                  "ts": str(int(time.time() * 1000))}])
+
+
+def _okx_candles(query: dict) -> object:
+    bar = query.get("bar", ["1m"])[0].replace("utc", "")
+    interval = bar[:-1] + bar[-1].lower() if bar[-1] in "HDW" else bar
+    rows = _klines({"interval": [interval], "limit": query.get("limit", ["100"])})
+    return _okx([[str(r[0]), r[1], r[2], r[3], r[4], r[5], r[5], r[7], "1"] for r in reversed(rows)])
+
+
+def _okx_books(query: dict) -> object:
+    depth = _depth({"limit": query.get("sz", ["1"])})
+    return _okx([{"bids": [b + ["0", "1"] for b in depth["bids"]], "asks": [a + ["0", "1"] for a in depth["asks"]],
+                  "ts": str(int(time.time() * 1000))}])
+
+
+def _okx_funding(query: dict) -> object:
+    rows = _funding_rate({"symbol": ["X"], "limit": query.get("limit", ["100"])})
+    return _okx([{"instId": query["instId"][0], "fundingTime": str(r["fundingTime"]), "fundingRate": r["fundingRate"],
+                  "realizedRate": r["fundingRate"]} for r in reversed(rows)])
+
+
+ROUTES = {
+    "/api/v3/ticker/price": _ticker_price,
+    "/api/v3/ticker/24hr": _ticker_24hr,
+    "/api/v3/klines": _klines,
+    "/api/v3/depth": _depth,
+    "/fapi/v1/fundingRate": _funding_rate,
+    "/fapi/v1/premiumIndex": _premium_index,
+    "/fapi/v1/fundingInfo": _funding_info,
+    "/api/v5/market/ticker": _okx_ticker,
+    "/api/v5/market/candles": _okx_candles,
+    "/api/v5/market/books": _okx_books,
+    "/api/v5/public/funding-rate-history": _okx_funding,
+}
+
+
+class MockBinanceServer:
+    """
+    在后台线程中运行的模拟币安服务器。
+    :param handshake_ms: 每条新连接首个请求的额外延迟（毫秒）
+    :param latency_ms: 每个请求的额外延迟（毫秒），用于模拟响应较慢的交易所
+    :param stream: 可选的 MockBinanceStream，深度快照的 lastUpdateId 与其增量深度序号保持一致
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, handshake_ms: float = 0.0, stream=None,
+                 latency_ms: float = 0.0):
+        handshake = handshake_ms / 1000
+        latency = latency_ms / 1000
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                self._first_request = True
+
+            def do_GET(self):
+                if self._first_request and handshake:
+                    time.sleep(handshake)
+                self._first_request = False
+                if latency:
+                    time.sleep(latency)
+                parts = urlsplit(self.path)
+                route = ROUTES.get(parts.path)
+                query = parse_qs(parts.query)
+                if route is None:
+                    body, status = b'{"code":-1,"msg":"not found"}', 404
+                elif route is _depth and stream is not None:
+                    body, status = json.dumps(_depth(query, stream.last_update_id)).encode(), 200
+                else:
+                    body, status = json.dumps(route(query)).encode(), 200
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class MockBinanceStream:
+    """
+    模拟币安组合行情流（/stream）的本地 WebSocket 服务。
+    :param interval: 推送间隔（秒）
+    :param gap_every: 每推送多少条深度事件注入一次序号缺口（0 表示不注入）
+    :param drop_after: 每条连接推送多少条消息后主动断开（0 表示不断开）
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, interval: float = 0.01,
+                 gap_every: int = 0, drop_after: int = 0):
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.gap_every = gap_every
+        self.drop_after = drop_after
+        self.connections = 0
+        self._server = None
+        self._update_id = 1000
+        self._book_update_id = 1000
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}/stream"
+
+    @property
+    def last_update_id(self) -> int:
+        """当前增量深度的最新序号，用作 REST 深度快照的 lastUpdateId"""
+        return self._update_id
+
+    def _event(self, stream: str) -> dict:
+        symbol = stream.split("@", 1)[0].upper()
+        now = int(time.time() * 1000)
+        if stream.endswith("@miniTicker"):
+            data = {"e": "24hrMiniTicker", "E": now, "s": symbol, "c": "65000.12000000",
+                    "o": "64000.00000000", "h": "66000.00000000", "l": "63000.00000000",
+                    "v": "1000.00000000", "q": "65000000.00000000"}
+        elif stream.endswith("@bookTicker"):
+            self._book_update_id += 1
+            data = {"u": self._book_update_id, "s": symbol, "b": "65000.00000000", "B": "1.00000000",
+                    "a": "65000.01000000", "A": "1.00000000"}
+        else:
+            first = self._update_id + 1
+            self._update_id += 3
+            if self.gap_every and (self._update_id // 3) % self.gap_every == 0:
+                first += 1  # 人为制造序号缺口
+            data = {"e": "depthUpdate", "E": now, "s": symbol, "U": first, "u": self._update_id,
+                    "b": [["65000.00000000", "1.50000000"]], "a": [["65000.01000000", "0.00000000"]]}
+        return {"stream": stream, "data": data}
+
+    async def _handler(self, ws):
+        self.connections += 1
+        streams: list[str] = []
+        sent = 0
+
+        async def reader():
+            async for raw in ws:
+                request = json.loads(raw)
+                if request.get("method") == "SUBSCRIBE":
+                    streams.extend(p for p in request["params"] if p not in streams)
+                    await ws.send(json.dumps({"result": None, "id": request.get("id")}))
+                elif request.get("method") == "UNSUBSCRIBE":
+                    streams[:] = [p for p in streams if p not in request["params"]]
+                    await ws.send(json.dumps({"result": None, "id": request.get("id")}))
+
+        reader_task = asyncio.ensure_future(reader())
+        try:
+            while not reader_task.done():
+                for stream in list(streams):
+                    await ws.send(json.dumps(self._event(stream)))
+                    sent += 1
+                if self.drop_after and sent >= self.drop_after:
+                    await ws.close()
+                    break
+                await asyncio.sleep(self.interval)
+        except Exception:
+            pass
+        finally:
+            reader_task.cancel()
+
+    async def __aenter__(self):
+        import websockets
+        self._server = await websockets.serve(self._handler, self.host, self.port)
+        self.port = next(iter(self._server.sockets)).getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        await self._server.wait_closed()
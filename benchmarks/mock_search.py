@@ -0,0 +1,115 @@
+"""
+本地模拟 Tavily 搜索 API 与 OpenAI 兼容的 chat/completions 接口，用于 deepsearch 基准测试（不访问真实网络）。
+
+每个请求按 latency_ms 固定延迟后返回，模拟真实搜索与 LLM 调用的网络耗时。
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _search(payload: dict) -> dict:
+    query = payload.get("query", "")
+    results = [{
+        "title": f"{query} 结果 {i}",
+        "url": f"https://example.com/{i}",
+        "content": f"关于 {query} 的第 {i} 条资料内容。",
+        "score": 1.0 - i * 0.1,
+    } for i in range(int(payload.get("max_results") or 5))]
+    return {"query": query, "results": results, "response_time": 0.0}
+
+
+def _chat_completion(payload: dict, empty: bool = False) -> dict:
+    content = payload["messages"][-1]["content"]
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": None if empty else f"总结：{content}"},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+    }
+
+
+ROUTES = {
+    "/search": _search,
+    "/chat/completions": _chat_completion,
+}
+
+
+class _Server(ThreadingHTTPServer):
+    # 默认监听队列只有 5，并发新建连接时会因 SYN 重传多出约 1 秒延迟
+    request_queue_size = 128
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # 客户端超时断开时写回响应会报 BrokenPipeError，基准测试中忽略
+
+
+class MockSearchServer:
+    """
+    在后台线程中运行的模拟搜索 / LLM 服务器。
+    :param latency_ms: 每个请求的固定延迟（毫秒）
+    :param empty_summaries: 为 True 时 chat/completions 返回空内容（content 为 null），模拟模型无输出
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 200.0,
+                 empty_summaries: bool = False):
+        latency = latency_ms / 1000
+        self.empty_summaries = empty_summaries
+        mock = self
+        counter = {"requests": 0}
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with lock:
+                    counter["requests"] += 1
+                time.sleep(latency)
+                path = self.path.split("?")[0]
+                route = ROUTES.get(path)
+                if route is None:
+                    body, status = b'{"error":"not found"}', 404
+                elif path == "/chat/completions":
+                    body, status = json.dumps(route(payload, mock.empty_summaries)).encode(), 200
+                else:
+                    body, status = json.dumps(route(payload)).encode(), 200
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._counter = counter
+        self._server = _Server((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self) -> int:
+        return self._counter["requests"]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
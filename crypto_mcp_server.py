@@ -4,13 +4,35 @@ import datetime
 import re
 import os
 import argparse
+import bisect
+import contextvars
+import functools
+import heapq
+import inspect
+import random
+import sqlite3
+import threading
+import time
 
 from typing import Any
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlsplit
 from mcp.server.fastmcp import FastMCP
 import asyncio
 import logging
 from dotenv import load_dotenv
 
+try:
+    import websockets
+except ImportError:  # WebSocket 行情流为可选功能
+    websockets = None
+
+try:
+    import numpy as np
+except ImportError:  # 技术指标等分析工具需要 numpy
+    np = None
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -21,8 +43,34 @@ logging.basicConfig(
     ]
 )
 
+@asynccontextmanager
+async def server_lifespan(server: FastMCP):
+    """
+    MCP 服务器生命周期：退出时关闭共享的 HTTP 连接池。
+    :param server: FastMCP 服务器实例
+    """
+    if BINANCE_WS_ENABLED:
+        start_market_stream()
+    if NEWS_POLL_ENABLED:
+        start_news_poller()
+    try:
+        yield {}
+    finally:
+        await stop_market_stream()
+        await stop_news_poller()
+        _kline_store.close()
+        _funding_store.close()
+        _news_store.close()
+        logging.info(f"响应缓存统计: {_response_cache.stats()}")
+        logging.info(f"请求合并统计: {_single_flight.stats()}")
+        logging.info(f"交易所路由统计: {_exchange_router.stats()}")
+        for host, limiter in _weight_limiters.items():
+            logging.info(f"{host} 请求权重统计: {limiter.stats()}")
+        await close_http_clients()
+
+
 # 初始化 MCP 服务器
-mcp = FastMCP("CryptoServer")
+mcp = FastMCP("CryptoServer", lifespan=server_lifespan)
 
 parser = argparse.ArgumentParser(description="加密货币 MCP 服务器")
 parser.add_argument("--NEWS_API_KEY", type=str, help="NewsAPI 密钥")
@@ -41,40 +89,1168 @@ BINANCE_PRICE_API = "https://api.binance.com/api/v3/ticker/price"
 BINANCE_BATCH_PRICE_API = "https://api.binance.com/api/v3/ticker/price"
 BINANCE_KLINES_API = "https://api.binance.com/api/v3/klines"
 BINANCE_FUNDING_RATE_API = "https://fapi.binance.com/fapi/v1/fundingRate"
+BINANCE_PREMIUM_INDEX_API = "https://fapi.binance.com/fapi/v1/premiumIndex"
+BINANCE_FUNDING_INFO_API = "https://fapi.binance.com/fapi/v1/fundingInfo"
 BINANCE_DEPTH_API = "https://api.binance.com/api/v3/depth"
+BINANCE_TICKER_24HR_API = "https://api.binance.com/api/v3/ticker/24hr"
+# 币安 WebSocket 行情流配置（可选，默认关闭）
+BINANCE_WS_URL = os.environ.get("BINANCE_WS_URL", "wss://stream.binance.com:9443/stream")
+BINANCE_WS_ENABLED = os.environ.get("BINANCE_WS_ENABLED", "false").lower() in ("1", "true", "yes")
+BINANCE_WS_SYMBOLS = [s.strip().upper() for s in os.environ.get("BINANCE_WS_SYMBOLS", "").split(",") if s.strip()]
+BINANCE_WS_RECV_TIMEOUT = float(os.environ.get("BINANCE_WS_RECV_TIMEOUT", "60"))
+# 同时订阅的交易对数量上限，超出时退订最久未查询的交易对（币安单连接最多 1024 个流，每个交易对占 3 个）
+BINANCE_WS_MAX_SYMBOLS = int(os.environ.get("BINANCE_WS_MAX_SYMBOLS", "300"))
+# 同时维护的本地订单簿数量上限（每次同步需拉取 5000 档快照），超出时淘汰最久未查询的订单簿
+BINANCE_WS_MAX_BOOKS = int(os.environ.get("BINANCE_WS_MAX_BOOKS", "20"))
+# 多交易所适配层：按顺序列出启用的交易所（默认只启用币安；没有延迟数据时靠前的优先），
+# 首选交易所超过 EXCHANGE_HEDGE_DELAY 秒未返回时并发请求下一个（对冲请求）；
+# 连续失败 EXCHANGE_FAILURE_THRESHOLD 次的交易所在 EXCHANGE_COOLDOWN 秒内不参与路由
+EXCHANGE_VENUES = [v.strip().lower() for v in os.environ.get("EXCHANGE_VENUES", "binance").split(",") if v.strip()]
+EXCHANGE_HEDGE_DELAY = float(os.environ.get("EXCHANGE_HEDGE_DELAY", "0.3"))
+EXCHANGE_FAILURE_THRESHOLD = 3
+EXCHANGE_COOLDOWN = float(os.environ.get("EXCHANGE_COOLDOWN", "30"))
+EXCHANGE_LATENCY_ALPHA = 0.2  # 延迟 EWMA 的平滑系数
+# 请求本身有问题（交易对不存在、参数无效、4xx 等）的错误不代表交易所不可用，不计入失败次数；429 / 418 限流仍计入
+EXCHANGE_CLIENT_ERROR_PATTERN = re.compile(r"HTTP 错误: 4(?!18|29)\d\d|OKX 错误|无法识别交易对|交易对不存在|不支持|无效")
+OKX_API_BASE = os.environ.get("OKX_API_BASE", "https://www.okx.com")
 # 加密货币新闻 API 配置
 ODAILY_NEWS_API = "https://www.odaily.news/v1/openapi/feeds"
 # NewsAPI 配置
 NEWS_API_URL = "https://newsapi.org/v2/everything"
 USER_AGENT = "crypto-app/1.0"
 
+# HTTP 连接池配置（可通过环境变量调整）
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# 币安请求权重限制（每分钟，按主机分别计数），只使用其中 BINANCE_WEIGHT_SAFETY 的比例留出余量
+BINANCE_WEIGHT_LIMITS = {
+    "api.binance.com": int(os.environ.get("BINANCE_WEIGHT_LIMIT", "6000")),
+    "fapi.binance.com": int(os.environ.get("BINANCE_FUTURES_WEIGHT_LIMIT", "2400")),
+}
+BINANCE_WEIGHT_SAFETY = float(os.environ.get("BINANCE_WEIGHT_SAFETY", "0.8"))
+# 请求优先级：交互式工具调用优先于后台补齐 / 订单簿同步
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+# 各优先级的最长排队时间（秒），预计等待超过该值时直接拒绝请求
+RATE_LIMIT_MAX_WAIT = {
+    PRIORITY_INTERACTIVE: float(os.environ.get("RATE_LIMIT_INTERACTIVE_MAX_WAIT", "5")),
+    PRIORITY_BACKGROUND: float(os.environ.get("RATE_LIMIT_BACKGROUND_MAX_WAIT", "60")),
+}
+# 各接口的请求权重：(带 symbol 参数, 不带 symbol 参数)，未列出的接口按 1 计算
+BINANCE_ENDPOINT_WEIGHTS = {
+    "/api/v3/ticker/price": (2, 4),
+    "/api/v3/ticker/24hr": (2, 80),
+    "/api/v3/klines": (2, 2),
+    "/fapi/v1/fundingRate": (1, 1),
+    "/fapi/v1/premiumIndex": (1, 10),
+    "/fapi/v1/fundingInfo": (1, 1),
+}
+# 深度接口按 limit 分档计算权重：(limit 上限, 权重)
+BINANCE_DEPTH_WEIGHTS = ((100, 5), (500, 25), (1000, 50), (5000, 250))
+
+# 按主机划分的长连接客户端（首次调用时创建）
+_http_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def _http2_available() -> bool:
+    """检查是否安装了 HTTP/2 依赖（h2），未安装时回退到 HTTP/1.1"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _get_http_client(url: str) -> httpx.AsyncClient:
+    """
+    获取目标主机对应的共享 HTTP 客户端，首次调用时惰性创建。
+    同一主机的请求复用连接池（keep-alive / HTTP/2），避免每次重新握手。
+    :param url: 请求地址
+    :return: 该主机的 httpx.AsyncClient
+    """
+    host = urlsplit(url).netloc
+    client = _http_clients.get(host)
+    if client is None or client.is_closed:
+        http2 = HTTP2_ENABLED and _http2_available()
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+        client = httpx.AsyncClient(http2=http2, limits=limits)
+        _http_clients[host] = client
+        logging.info(f"创建 {host} 的 HTTP 连接池，HTTP/2: {http2}, 最大连接数: {HTTP_MAX_CONNECTIONS}")
+    return client
+
+
+async def close_http_clients():
+    """关闭所有共享的 HTTP 客户端"""
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logging.error(f"关闭 HTTP 客户端失败: {str(e)}")
+    if clients:
+        logging.info(f"已关闭 {len(clients)} 个 HTTP 连接池")
+
+
+# 响应缓存配置：各接口数据的有效期（秒），None 表示永不过期
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "512"))
+# 全市场价格快照的刷新间隔（秒），批量价格查询在该间隔内复用同一份快照
+PRICE_SNAPSHOT_TTL = float(os.environ.get("PRICE_SNAPSHOT_TTL", "2"))
+# 全市场永续合约资金费率快照（premiumIndex）的刷新间隔（秒）
+FUNDING_SNAPSHOT_TTL = float(os.environ.get("FUNDING_SNAPSHOT_TTL", "10"))
+# 全市场 24 小时行情快照的刷新间隔（秒），市场扫描在该间隔内复用同一份快照
+MARKET_SNAPSHOT_TTL = float(os.environ.get("MARKET_SNAPSHOT_TTL", "10"))
+# NewsAPI 搜索缓存：超过 NEWS_SEARCH_TTL 的结果仍立即返回并在后台刷新，超过 NEWS_SEARCH_STALE_TTL 才重新请求
+NEWS_SEARCH_TTL = float(os.environ.get("NEWS_SEARCH_TTL", "600"))
+NEWS_SEARCH_STALE_TTL = float(os.environ.get("NEWS_SEARCH_STALE_TTL", "21600"))
+NEWS_SEARCH_OPERATORS = {"AND", "OR", "NOT"}
+NEWS_ARTICLE_FIELDS = ("title", "description", "url", "publishedAt")
+CACHE_TTL = {
+    "price": 1.0,
+    "price_snapshot": PRICE_SNAPSHOT_TTL,
+    "market_snapshot": MARKET_SNAPSHOT_TTL,
+    "depth": 1.0,
+    "funding_rate": 300.0,
+    "funding_snapshot": FUNDING_SNAPSHOT_TTL,
+    "funding_info": 3600.0,  # 各合约的结算间隔很少调整
+    "klines": None,  # 只缓存已收盘的K线，收盘后数据不再变化
+}
+
+# K线周期对应的毫秒数（1M 按 30 天估算，仅用于估计需要补齐的K线数量）
+KLINE_INTERVAL_MS = {
+    '1m': 60_000, '3m': 180_000, '5m': 300_000, '15m': 900_000, '30m': 1_800_000,
+    '1h': 3_600_000, '2h': 7_200_000, '4h': 14_400_000, '6h': 21_600_000, '8h': 28_800_000,
+    '12h': 43_200_000, '1d': 86_400_000, '3d': 259_200_000, '1w': 604_800_000, '1M': 2_592_000_000
+}
+# 月线长度不固定：分页窗口按最短的月份计算，判断是否收盘按最长的月份计算
+KLINE_MONTH_MS_MIN = 28 * 86_400_000
+KLINE_MONTH_MS_MAX = 31 * 86_400_000
+
+# 本地K线库配置（SQLite，按 交易对 + 周期 存储已收盘K线）
+KLINE_STORE_PATH = os.environ.get("KLINE_STORE_PATH", os.path.join("data", "klines.sqlite3"))
+KLINE_BACKFILL_CONCURRENCY = int(os.environ.get("KLINE_BACKFILL_CONCURRENCY", "4"))
+KLINE_RANGE_MAX_ROWS = 10000
+
+# 资金费率历史库配置（SQLite，按交易对存储每次结算）
+FUNDING_STORE_PATH = os.environ.get("FUNDING_STORE_PATH", os.path.join("data", "funding.sqlite3"))
+FUNDING_BACKFILL_CONCURRENCY = int(os.environ.get("FUNDING_BACKFILL_CONCURRENCY", "4"))
+FUNDING_RANGE_MAX_ROWS = 10000
+FUNDING_DEFAULT_INTERVAL_HOURS = 8
+FUNDING_REFRESH_MS = 60_000  # 最近的缺口最多每隔该时长向上游补拉一次
+# 结算记录可能在结算后延迟发布：已拉取区间的终点最多记到当前时间之前这么久，之后的部分下次重新拉取
+FUNDING_SETTLE_GRACE_MS = 300_000
+FUNDING_ROLLING_DAYS = (3, 7, 30)
+
+# Odaily 新闻库配置：后台轮询增量合并到本地库，工具直接从库中读取
+NEWS_STORE_PATH = os.environ.get("NEWS_STORE_PATH", os.path.join("data", "news.sqlite3"))
+NEWS_POLL_ENABLED = os.environ.get("NEWS_POLL_ENABLED", "true").lower() in ("1", "true", "yes")
+NEWS_POLL_INTERVAL = float(os.environ.get("NEWS_POLL_INTERVAL", "60"))
+NEWS_RETENTION_DAYS = float(os.environ.get("NEWS_RETENTION_DAYS", "7"))
+NEWS_TYPES = ("newsflashes", "posts")
+NEWS_MAX_ITEMS = 200
+
+# 市场扫描配置：排序方式 -> (排序列, 是否降序)；计价资产按后缀识别，较长的后缀优先匹配
+SCAN_SORTS = {
+    "gainers": ("change_pct", True),
+    "losers": ("change_pct", False),
+    "volume": ("quote_volume", True),
+    "trades": ("trades", True),
+    "volatility": ("range_pct", True),
+}
+SCAN_MAX_TOP_N = 100
+FUNDING_SORTS = {
+    "highest": ("annualized", True),
+    "lowest": ("annualized", False),
+    "extreme": ("annualized_abs", True),
+    "basis": ("basis_abs", True),
+}
+
+# 多交易对相关性配置：K线并发拉取数、交易对数量上限、beta 的基准交易对、完整输出相关矩阵的交易对数量上限
+CORRELATION_CONCURRENCY = int(os.environ.get("CORRELATION_CONCURRENCY", "8"))
+CORRELATION_MAX_SYMBOLS = 50
+CORRELATION_BENCHMARK = "BTCUSDT"
+CORRELATION_MATRIX_MAX_SYMBOLS = 12
+QUOTE_ASSETS = ("FDUSD", "USDT", "USDC", "TUSD", "BUSD", "DAI", "BTC", "ETH", "BNB",
+                "TRY", "EUR", "BRL", "JPY", "ARS", "MXN", "PLN", "RON", "ZAR", "UAH", "IDR",
+                "COP", "CZK", "TRX", "XRP", "DOGE", "SOL")
+
+# 工具输出配置：输出模式与默认字符预算（控制返回给 LLM 的上下文长度）
+OUTPUT_MODES = ("table", "csv", "summary", "downsampled")
+OUTPUT_MAX_CHARS = int(os.environ.get("OUTPUT_MAX_CHARS", "8000"))
+
+
+class TTLCache:
+    """带过期时间的 LRU 缓存，记录命中/未命中/部分命中次数"""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.partial = 0  # 命中缓存但仍需请求上游补齐的次数（不计入命中率）
+
+    def get(self, key: tuple, count: bool = True) -> Any:
+        """
+        读取缓存。
+        :param key: 缓存键（接口名, 规范化后的参数...）
+        :param count: 是否计入命中统计（由调用方自行判断命中时传 False）
+        :return: 缓存值；不存在或已过期返回 None
+        """
+        entry = self._data.get(key)
+        value = None
+        if entry is not None:
+            expires_at, cached = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                value = cached
+            else:
+                del self._data[key]
+        if count:
+            self.record(value is not None)
+        return value
+
+    def record(self, hit: bool):
+        """记录一次命中或未命中"""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def record_partial(self):
+        """记录一次部分命中：使用了缓存，但仍需请求上游补齐最新数据"""
+        self.partial += 1
+
+    def set(self, key: tuple, value: Any, ttl: float | None):
+        """
+        写入缓存，超出容量时淘汰最久未使用的条目。
+        :param key: 缓存键
+        :param value: 缓存值
+        :param ttl: 有效期（秒），None 表示永不过期
+        """
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: tuple):
+        """删除指定缓存条目"""
+        self._data.pop(key, None)
+
+    def clear(self):
+        """清空缓存与统计"""
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+        self.partial = 0
+
+    def stats(self) -> dict[str, Any]:
+        """返回缓存条目数与命中统计（命中率只统计完全不请求上游的命中）"""
+        total = self.hits + self.misses + self.partial
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "partial": self.partial,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+_response_cache = TTLCache(CACHE_MAX_ENTRIES)
+
+
+class SingleFlight:
+    """
+    请求合并：相同键的并发调用只执行一次，其余调用方等待同一个结果。
+    共享的请求在独立任务中运行，单个调用方被取消不会影响其他调用方。
+    """
+
+    def __init__(self):
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: tuple, func, *args, **kwargs) -> Any:
+        """
+        执行或加入一次请求。
+        :param key: 请求键（相同键的并发调用会被合并）
+        :param func: 实际执行请求的协程函数
+        :return: 请求结果
+        """
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict[str, Any]:
+        """返回调用总数、被合并的调用数和当前进行中的请求数"""
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight)
+        }
+
+
+_single_flight = SingleFlight()
+
+# 不等待结果的后台任务：事件循环只持有任务的弱引用，需要保留引用直到任务结束，避免被垃圾回收
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _spawn_background(coro) -> asyncio.Task:
+    """启动一个不等待结果的后台任务，并在结束前保留其引用"""
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def _freeze(value: Any) -> Any:
+    """将列表/字典参数转换为可哈希的形式，用作请求键"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+def single_flight(func):
+    """
+    装饰 fetch_* 函数，按函数名与调用参数合并并发的相同请求。
+    symbol / symbols 参数先规范化，btcusdt 与 BTCUSDT 等写法合并为同一请求。
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        if isinstance(arguments.get("symbol"), str):
+            arguments["symbol"] = _normalize_symbol(arguments["symbol"])
+        if isinstance(arguments.get("symbols"), (list, tuple)):
+            arguments["symbols"] = [_normalize_symbol(s) if isinstance(s, str) else s for s in arguments["symbols"]]
+        key = (func.__name__, _freeze(arguments))
+        return await _single_flight.do(key, func, *args, **kwargs)
 
+    return wrapper
+
+
+class RateLimitError(Exception):
+    """请求权重不足且预计等待超过上限时抛出（主动降载，避免触发币安 429/418 封禁）"""
+
+
+class WeightLimiter:
+    """
+    币安请求权重的令牌桶调度器（每个主机一个）。
+    令牌按每分钟权重上限匀速补充，并根据响应头 X-MBX-USED-WEIGHT-1M 校准；
+    权重不足时请求按优先级排队，预计等待过长则直接拒绝；收到 429/418 后暂停到 Retry-After 之后。
+    """
+
+    def __init__(self, limit: int, safety: float = BINANCE_WEIGHT_SAFETY):
+        """
+        :param limit: 币安每分钟请求权重上限
+        :param safety: 实际使用的上限比例
+        """
+        self.capacity = limit * safety
+        self.rate = self.capacity / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.used_weight = None
+        self._waiters = []  # (优先级, 序号, 权重, future)
+        self._seq = 0
+        self._timer = None
+        self.granted = 0
+        self.queued = 0
+        self.shed = 0
+        self.bans = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> float:
+        """当前可立即使用的权重（暂停期间为 0）"""
+        self._refill()
+        if time.monotonic() < self.blocked_until:
+            return 0.0
+        return max(0.0, self.tokens)
+
+    def estimated_wait(self, weight: float, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """估算该请求需要排队的秒数（同级及更高优先级的排队请求先执行）"""
+        self._refill()
+        ahead = sum(w for p, _, w, f in self._waiters if p <= priority and not f.done())
+        wait = max(0.0, (ahead + weight - self.tokens) / self.rate)
+        return wait + max(0.0, self.blocked_until - time.monotonic())
+
+    async def acquire(self, weight: float, priority: int = PRIORITY_INTERACTIVE):
+        """
+        获取请求权重，不足时按优先级排队等待。
+        :param weight: 请求权重
+        :param priority: 请求优先级（PRIORITY_INTERACTIVE / PRIORITY_BACKGROUND）
+        :raises RateLimitError: 预计等待超过该优先级的最长排队时间
+        """
+        weight = min(weight, self.capacity)
+        wait = self.estimated_wait(weight, priority)
+        if wait <= 0:
+            self.tokens -= weight
+            self.granted += 1
+            return
+        max_wait = RATE_LIMIT_MAX_WAIT.get(priority, RATE_LIMIT_MAX_WAIT[PRIORITY_BACKGROUND])
+        if wait > max_wait:
+            self.shed += 1
+            raise RateLimitError(f"币安请求权重不足，预计需等待 {wait:.1f} 秒，已拒绝本次请求，请稍后重试")
+
+        self.queued += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, self._seq, weight, future))
+        self._seq += 1
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.tokens += weight  # 已分配但调用方被取消，归还权重
+            raise
+        finally:
+            self._dispatch()
+
+    def _dispatch(self):
+        """按优先级唤醒排队的请求，权重不足时定时重试"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._waiters:
+            _, _, weight, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = max(self.blocked_until - time.monotonic(), (weight - self.tokens) / self.rate)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self.tokens -= weight
+            self.granted += 1
+            future.set_result(None)
+
+    def observe(self, response: httpx.Response):
+        """根据响应头校准已用权重；429/418 时暂停到 Retry-After 之后"""
+        used = response.headers.get("x-mbx-used-weight-1m") or response.headers.get("x-mbx-used-weight")
+        if used and used.isdigit():
+            self.used_weight = int(used)
+            self._refill()
+            self.tokens = min(self.tokens, self.capacity - self.used_weight)
+        if response.status_code in (418, 429):
+            retry_after = response.headers.get("retry-after", "")
+            pause = float(retry_after) if retry_after.isdigit() else 60.0
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+            self.tokens = min(self.tokens, 0.0)
+            self.bans += 1
+            logging.error(f"币安返回 HTTP {response.status_code}，暂停请求 {pause:.0f} 秒")
+
+    def stats(self) -> dict[str, Any]:
+        """返回可用权重、排队数量与各类计数"""
+        return {
+            "available": round(self.available(), 1),
+            "capacity": self.capacity,
+            "used_weight": self.used_weight,
+            "waiting": sum(1 for *_, f in self._waiters if not f.done()),
+            "granted": self.granted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "bans": self.bans
+        }
+
+
+# 按主机划分的权重调度器（只对 BINANCE_WEIGHT_LIMITS 中的主机限流）
+_weight_limiters: dict[str, WeightLimiter] = {}
+# 当前请求的优先级，后台任务通过 background_priority() 设置
+_request_priority = contextvars.ContextVar("request_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def background_priority():
+    """在该上下文（及其创建的任务）中发起的币安请求按后台优先级排队"""
+    token = _request_priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+def _get_weight_limiter(url: str) -> WeightLimiter | None:
+    """获取目标主机的权重调度器，不在限流列表中的主机返回 None"""
+    host = urlsplit(url).netloc
+    limiter = _weight_limiters.get(host)
+    if limiter is None and host in BINANCE_WEIGHT_LIMITS:
+        limiter = _weight_limiters[host] = WeightLimiter(BINANCE_WEIGHT_LIMITS[host])
+    return limiter
+
+
+def _request_weight(url: str, params: dict | None = None) -> int:
+    """
+    计算币安接口的请求权重。
+    :param url: 请求地址
+    :param params: 请求参数
+    :return: 请求权重
+    """
+    params = params or {}
+    path = urlsplit(url).path
+    if path.endswith("/depth"):
+        limit = int(params.get("limit", 100))
+        return next((w for max_limit, w in BINANCE_DEPTH_WEIGHTS if limit <= max_limit), BINANCE_DEPTH_WEIGHTS[-1][1])
+    with_symbol, without_symbol = BINANCE_ENDPOINT_WEIGHTS.get(path, (1, 1))
+    return with_symbol if "symbol" in params else without_symbol
+
+
+def _affordable_depth_limit(url: str, limit: int) -> int:
+    """
+    权重不足时降级深度档位：返回当前可用权重能立即负担的最大 limit（不小于最低一档）。
+    :param url: 深度接口地址
+    :param limit: 请求的档位数量
+    :return: 实际使用的档位数量
+    """
+    limiter = _get_weight_limiter(url)
+    if limiter is None:
+        return limit
+    available = limiter.available()
+    if _request_weight(url, {"limit": limit}) <= available:
+        return limit
+    for max_limit, weight in reversed(BINANCE_DEPTH_WEIGHTS):
+        if max_limit < limit and weight <= available:
+            return max_limit
+    return min(limit, BINANCE_DEPTH_WEIGHTS[0][0])
+
+
+async def _binance_get(url: str, params: dict | None = None, headers: dict | None = None,
+                       timeout: float = 30.0) -> httpx.Response:
+    """
+    经请求权重调度后，通过共享连接池发起 GET 请求，并用响应头校准已用权重。
+    :param url: 请求地址
+    :param params: 请求参数
+    :param headers: 请求头
+    :param timeout: 超时时间（秒）
+    :return: httpx 响应
+    :raises RateLimitError: 权重不足且排队时间超过上限
+    """
+    limiter = _get_weight_limiter(url)
+    if limiter is not None:
+        await limiter.acquire(_request_weight(url, params), _request_priority.get())
+    response = await _get_http_client(url).get(url, params=params, headers=headers, timeout=timeout)
+    if limiter is not None:
+        limiter.observe(response)
+    return response
+
+
+# 币安交易对符号：大写字母与数字（如 BTCUSDT、1000SATSUSDT）
+SYMBOL_PATTERN = re.compile(r'^[A-Z0-9]{2,20}$')
+
+
+def _normalize_symbol(symbol: str) -> str:
+    """规范化交易对符号（去除空白并转为大写）"""
+    return str(symbol).strip().upper()
+
+
+class MarketStream:
+    """
+    币安组合行情流（miniTicker / bookTicker / 增量深度）的后台订阅引擎。
+    在内存中维护每个交易对的最新状态，断线自动重连，并检测增量深度的序号缺口。
+    """
+
+    STREAM_SUFFIXES = ("@miniTicker", "@bookTicker", "@depth@100ms")
+    MAX_STREAMS = 1024  # 币安单个连接最多订阅的流数量
+
+    def __init__(self, url: str = BINANCE_WS_URL, symbols: list | None = None,
+                 recv_timeout: float = BINANCE_WS_RECV_TIMEOUT, max_delay: float = 60.0,
+                 max_symbols: int = BINANCE_WS_MAX_SYMBOLS):
+        self.url = url
+        self.recv_timeout = recv_timeout
+        self.max_delay = max_delay
+        self.max_symbols = max(1, min(max_symbols, self.MAX_STREAMS // len(self.STREAM_SUFFIXES)))
+        # 已订阅的交易对，按最近查询时间排序（最久未查询的在前）
+        self.symbols: OrderedDict[str, None] = OrderedDict.fromkeys(_normalize_symbol(s) for s in symbols or [])
+        self.tickers: dict[str, dict[str, Any]] = {}
+        self.book_tickers: dict[str, dict[str, Any]] = {}
+        self.depth_update_ids: dict[str, int] = {}
+        self.depth_listeners: list = []
+        self.connected = False
+        self.messages = 0
+        self.reconnects = 0
+        self.gaps = 0
+        self.evictions = 0
+        self._ws = None
+        self._task: asyncio.Task | None = None
+        self._request_id = 0
+
+    @staticmethod
+    def _streams(symbols) -> list[str]:
+        """生成交易对对应的组合流名称"""
+        return [f"{s.lower()}{suffix}" for s in symbols for suffix in MarketStream.STREAM_SUFFIXES]
+
+    def start(self):
+        """启动后台订阅任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """停止订阅并关闭连接"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._reset_state()
+
+    def subscribe(self, symbols: list):
+        """
+        按需订阅交易对；连接已建立时立即发送 SUBSCRIBE，否则在下次连接时订阅。
+        订阅数量超出 max_symbols 时先退订最久未查询的交易对。
+        :param symbols: 交易对符号列表
+        """
+        new_symbols = []
+        for symbol in dict.fromkeys(_normalize_symbol(s) for s in symbols):
+            if symbol in self.symbols:
+                self.symbols.move_to_end(symbol)
+            else:
+                new_symbols.append(symbol)
+        new_symbols = new_symbols[-self.max_symbols:]
+        if not new_symbols:
+            return
+        overflow = len(self.symbols) + len(new_symbols) - self.max_symbols
+        if overflow > 0:
+            evicted = list(self.symbols)[:overflow]
+            self.evictions += len(evicted)
+            self.unsubscribe(evicted)
+        self.symbols.update(dict.fromkeys(new_symbols))
+        logging.info(f"WebSocket 行情流新增订阅: {sorted(new_symbols)}")
+        if self.connected and self._ws is not None:
+            _spawn_background(self._send_request("SUBSCRIBE", new_symbols))
+
+    def unsubscribe(self, symbols: list):
+        """
+        退订交易对并清除其状态；连接已建立时立即发送 UNSUBSCRIBE。
+        :param symbols: 交易对符号列表
+        """
+        removed = [s for s in dict.fromkeys(_normalize_symbol(s) for s in symbols) if s in self.symbols]
+        if not removed:
+            return
+        for symbol in removed:
+            del self.symbols[symbol]
+            self.tickers.pop(symbol, None)
+            self.book_tickers.pop(symbol, None)
+            self.depth_update_ids.pop(symbol, None)
+            self._notify_depth(symbol, None, True)
+        logging.info(f"WebSocket 行情流退订: {sorted(removed)}")
+        if self.connected and self._ws is not None:
+            _spawn_background(self._send_request("UNSUBSCRIBE", removed))
+
+    def is_subscribed(self, symbol: str) -> bool:
+        return _normalize_symbol(symbol) in self.symbols
+
+    def get_price(self, symbol: str) -> dict[str, Any] | None:
+        """
+        从内存状态表读取最新成交价。
+        :param symbol: 交易对符号
+        :return: 与 /ticker/price 相同结构的字典；未订阅或尚无数据时返回 None
+        """
+        if not self.connected:
+            return None
+        ticker = self.tickers.get(symbol)
+        if ticker is None:
+            return None
+        self.symbols.move_to_end(symbol)
+        return {"symbol": symbol, "price": ticker["c"]}
+
+    def get_book_ticker(self, symbol: str) -> dict[str, Any] | None:
+        """读取最优买卖价；未订阅或尚无数据时返回 None"""
+        if not self.connected:
+            return None
+        book_ticker = self.book_tickers.get(symbol)
+        if book_ticker is not None:
+            self.symbols.move_to_end(symbol)
+        return book_ticker
+
+    def add_depth_listener(self, callback):
+        """
+        注册增量深度回调。
+        :param callback: callback(symbol, event, gap)，gap 为 True 表示序号出现缺口或连接重建
+        """
+        self.depth_listeners.append(callback)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "connected": self.connected,
+            "symbols": len(self.symbols),
+            "messages": self.messages,
+            "reconnects": self.reconnects,
+            "gaps": self.gaps,
+            "evictions": self.evictions
+        }
+
+    def _reset_state(self):
+        """连接断开时清空状态表，避免对外提供过期数据"""
+        self.connected = False
+        self._ws = None
+        self.tickers.clear()
+        self.book_tickers.clear()
+        for symbol in list(self.depth_update_ids):
+            self._notify_depth(symbol, None, True)
+        self.depth_update_ids.clear()
+
+    async def _send_request(self, method: str, symbols):
+        """发送 SUBSCRIBE / UNSUBSCRIBE 请求"""
+        if self._ws is None:
+            return
+        self._request_id += 1
+        message = {"method": method, "params": self._streams(sorted(symbols)), "id": self._request_id}
+        try:
+            await self._ws.send(json.dumps(message))
+        except Exception as e:
+            logging.error(f"WebSocket {method} 请求发送失败: {str(e)}")
 
+    async def _run(self):
+        """连接、订阅并持续接收消息；断线后按指数退避 + 随机抖动重连"""
+        attempt = 0
+        while True:
+            try:
+                async with websockets.connect(self.url, max_size=None) as ws:
+                    self._ws = ws
+                    self.connected = True
+                    attempt = 0
+                    logging.info(f"WebSocket 行情流已连接: {self.url}")
+                    if self.symbols:
+                        await self._send_request("SUBSCRIBE", self.symbols)
+                    while True:
+                        raw = await asyncio.wait_for(ws.recv(), timeout=self.recv_timeout)
+                        self._handle_message(json.loads(raw))
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                logging.warning(f"WebSocket 行情流 {self.recv_timeout}s 未收到消息，准备重连")
+            except Exception as e:
+                logging.warning(f"WebSocket 行情流断开: {str(e)}")
+            finally:
+                self._reset_state()
+
+            self.reconnects += 1
+            delay = min(2 ** attempt + random.uniform(0, 1), self.max_delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _handle_message(self, message: dict[str, Any]):
+        """按流类型更新状态表"""
+        stream = message.get("stream")
+        data = message.get("data")
+        if not stream or not isinstance(data, dict):
+            return  # SUBSCRIBE 等请求的应答
+        self.messages += 1
+        symbol = data.get("s")
+        if not symbol:
+            return
+        if stream.endswith("@miniTicker"):
+            self.tickers[symbol] = data
+        elif stream.endswith("@bookTicker"):
+            self.book_tickers[symbol] = data
+        elif "@depth" in stream:
+            previous = self.depth_update_ids.get(symbol)
+            gap = previous is not None and data["U"] != previous + 1
+            if gap:
+                self.gaps += 1
+                logging.warning(f"{symbol} 增量深度序号缺口: 上一个 u={previous}, 当前 U={data['U']}")
+            self.depth_update_ids[symbol] = data["u"]
+            self._notify_depth(symbol, data, gap)
+
+    def _notify_depth(self, symbol: str, event: dict[str, Any] | None, gap: bool):
+        for callback in self.depth_listeners:
+            try:
+                callback(symbol, event, gap)
+            except Exception as e:
+                logging.error(f"{symbol} 增量深度回调失败: {str(e)}")
+
+
+class _BookSide:
+    """
+    订单簿单侧的价格档位，使用按最优价排序的并行数组存储。
+    买盘以负价格作为排序键，使两侧都按「最优价在前」升序排列，二分查找定位档位。
+    """
+
+    def __init__(self, is_bid: bool):
+        self.sign = -1.0 if is_bid else 1.0
+        self.keys: list[float] = []
+        self.qtys: list[float] = []
+
+    def clear(self):
+        self.keys.clear()
+        self.qtys.clear()
+
+    def update(self, price: float, qty: float):
+        """设置某一价格档位的数量，数量为 0 时删除该档位"""
+        key = self.sign * price
+        i = bisect.bisect_left(self.keys, key)
+        exists = i < len(self.keys) and self.keys[i] == key
+        if qty == 0:
+            if exists:
+                del self.keys[i]
+                del self.qtys[i]
+        elif exists:
+            self.qtys[i] = qty
+        else:
+            self.keys.insert(i, key)
+            self.qtys.insert(i, qty)
+
+    def best(self) -> float | None:
+        return self.sign * self.keys[0] if self.keys else None
+
+    def top(self, n: int) -> list[list[float]]:
+        return [[self.sign * k, q] for k, q in zip(self.keys[:n], self.qtys[:n])]
+
+    def within(self, limit_price: float) -> tuple[float, float]:
+        """
+        累计从最优价到 limit_price（含）之间的挂单。
+        :return: (数量合计, 名义金额合计)
+        """
+        end = bisect.bisect_right(self.keys, self.sign * limit_price)
+        qty = sum(self.qtys[:end])
+        notional = sum(self.sign * k * q for k, q in zip(self.keys[:end], self.qtys[:end]))
+        return qty, notional
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class OrderBook:
+    """单个交易对的本地订单簿，按 lastUpdateId / U / u 序号应用增量深度"""
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.bids = _BookSide(is_bid=True)
+        self.asks = _BookSide(is_bid=False)
+        self.last_update_id = 0
+        self.synced = False
+
+    @classmethod
+    def from_depth(cls, data: dict[str, Any], symbol: str = "") -> "OrderBook":
+        """由 REST 深度快照构建订单簿"""
+        book = cls(symbol or data.get("symbol", ""))
+        book.apply_snapshot(data)
+        return book
+
+    def apply_snapshot(self, data: dict[str, Any]):
+        """用 REST 深度快照重置订单簿"""
+        self.bids.clear()
+        self.asks.clear()
+        for price, qty in data.get("bids", []):
+            self.bids.update(float(price), float(qty))
+        for price, qty in data.get("asks", []):
+            self.asks.update(float(price), float(qty))
+        self.last_update_id = int(data.get("lastUpdateId", 0))
+
+    def apply_event(self, event: dict[str, Any]) -> bool:
+        """
+        应用一条增量深度事件。
+        :param event: depthUpdate 事件（含 U、u、b、a）
+        :return: 序号连续返回 True；出现缺口返回 False，需要重新同步
+        """
+        if event["u"] <= self.last_update_id:
+            return True  # 快照已包含的旧事件
+        if self.synced:
+            if event["U"] != self.last_update_id + 1:
+                return False
+        elif not event["U"] <= self.last_update_id + 1 <= event["u"]:
+            return False  # 快照后的第一条事件必须覆盖 lastUpdateId + 1
+        for price, qty in event["b"]:
+            self.bids.update(float(price), float(qty))
+        for price, qty in event["a"]:
+            self.asks.update(float(price), float(qty))
+        self.last_update_id = event["u"]
+        return True
+
+    def spread(self) -> float | None:
+        bid, ask = self.bids.best(), self.asks.best()
+        return None if bid is None or ask is None else ask - bid
+
+    def mid_price(self) -> float | None:
+        bid, ask = self.bids.best(), self.asks.best()
+        return None if bid is None or ask is None else (bid + ask) / 2
+
+    def depth_within(self, pct: float) -> dict[str, float] | None:
+        """
+        统计中间价上下 pct% 范围内的累计挂单。
+        :param pct: 价格范围百分比（如 1 表示 ±1%）
+        :return: 买卖两侧的数量与名义金额；订单簿为空时返回 None
+        """
+        mid = self.mid_price()
+        if mid is None:
+            return None
+        bid_qty, bid_notional = self.bids.within(mid * (1 - pct / 100))
+        ask_qty, ask_notional = self.asks.within(mid * (1 + pct / 100))
+        return {
+            "bid_qty": bid_qty,
+            "ask_qty": ask_qty,
+            "bid_notional": bid_notional,
+            "ask_notional": ask_notional
+        }
+
+    def imbalance(self, pct: float) -> float | None:
+        """中间价 ±pct% 内的买卖不平衡度，范围 [-1, 1]，正值表示买盘更强"""
+        depth = self.depth_within(pct)
+        if depth is None:
+            return None
+        total = depth["bid_notional"] + depth["ask_notional"]
+        return (depth["bid_notional"] - depth["ask_notional"]) / total if total else 0.0
+
+    def to_depth(self, limit: int) -> dict[str, Any]:
+        """导出为与 REST /depth 相同结构的字典"""
+        return {
+            "symbol": self.symbol,
+            "lastUpdateId": self.last_update_id,
+            "bids": self.bids.top(limit),
+            "asks": self.asks.top(limit)
+        }
+
+
+class LocalOrderBooks:
+    """
+    基于增量深度流维护本地订单簿，按币安文档的流程同步：
+    缓存事件 -> 拉取 REST 快照 -> 丢弃旧事件 -> 顺序应用，出现缺口时重新同步。
+    """
+
+    SNAPSHOT_LIMIT = 5000
+    MAX_BUFFERED_EVENTS = 10000
+    SYNC_TIMEOUT = 30.0  # 超过该秒数仍未同步完成（如交易对没有深度流）时停止维护
+
+    def __init__(self, stream: MarketStream, max_books: int = BINANCE_WS_MAX_BOOKS):
+        self.stream = stream
+        self.max_books = max_books
+        self.books: OrderedDict[str, OrderBook] = OrderedDict()  # 按最近查询时间排序，最久未查询的在前
+        self.resyncs = 0
+        self.evictions = 0
+        self._buffers: dict[str, list] = {}
+        self._sync_tasks: dict[str, asyncio.Task] = {}
+        stream.add_depth_listener(self._on_depth)
+
+    def track(self, symbol: str):
+        """开始维护某个交易对的本地订单簿（订阅深度流并拉取快照），数量超出上限时淘汰最久未查询的订单簿"""
+        symbol = _normalize_symbol(symbol)
+        if symbol in self.books or not SYMBOL_PATTERN.match(symbol):
+            return
+        while len(self.books) >= self.max_books:
+            evicted = next(iter(self.books))
+            self.untrack(evicted)
+            self.evictions += 1
+            logging.info(f"本地订单簿数量达到上限 {self.max_books}，停止维护 {evicted}")
+        self.books[symbol] = OrderBook(symbol)
+        self._buffers[symbol] = []
+        self.stream.subscribe([symbol])
+        self._start_sync(symbol)
+
+    def untrack(self, symbol: str):
+        """停止维护某个交易对的本地订单簿"""
+        self.books.pop(symbol, None)
+        self._buffers.pop(symbol, None)
+        task = self._sync_tasks.pop(symbol, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    def get(self, symbol: str) -> OrderBook | None:
+        """返回已同步的订单簿；未维护或尚未同步时返回 None"""
+        book = self.books.get(symbol)
+        if book is None or not book.synced or not self.stream.connected:
+            return None
+        self.books.move_to_end(symbol)
+        return book
+
+    async def stop(self):
+        for task in self._sync_tasks.values():
+            task.cancel()
+        self._sync_tasks.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "books": len(self.books),
+            "synced": sum(1 for b in self.books.values() if b.synced),
+            "resyncs": self.resyncs,
+            "evictions": self.evictions
+        }
+
+    def _start_sync(self, symbol: str):
+        task = self._sync_tasks.get(symbol)
+        if task is None or task.done():
+            self._sync_tasks[symbol] = asyncio.ensure_future(self._sync(symbol))
+
+    def _on_depth(self, symbol: str, event: dict[str, Any] | None, gap: bool):
+        book = self.books.get(symbol)
+        if book is None:
+            return
+        if not self.stream.is_subscribed(symbol):
+            self.untrack(symbol)  # 行情流已退订该交易对（订阅数量超出上限）
+            return
+        buffer = self._buffers[symbol]
+        if gap or (book.synced and event is not None and not book.apply_event(event)):
+            logging.warning(f"{symbol} 本地订单簿序号不连续，重新同步")
+            self.resyncs += 1
+            book.synced = False
+            buffer.clear()
+        if event is None:
+            return
+        if not book.synced:
+            buffer.append(event)
+            del buffer[:-self.MAX_BUFFERED_EVENTS]
+            self._start_sync(symbol)
+
+    async def _sync(self, symbol: str):
+        """拉取快照并应用缓存的增量事件，直到订单簿同步完成；超过 SYNC_TIMEOUT 仍未完成时停止维护"""
+        book = self.books.get(symbol)
+        if book is None:
+            return
+        buffer = self._buffers[symbol]
+        deadline = time.monotonic() + self.SYNC_TIMEOUT
+        while not book.synced:
+            if time.monotonic() >= deadline:
+                logging.warning(f"{symbol} {self.SYNC_TIMEOUT:g} 秒内未完成订单簿同步，停止维护")
+                self.untrack(symbol)
+                return
+            if not buffer:
+                await asyncio.sleep(0.1)  # 等待深度流的第一条事件
+                continue
+            # 快照必须晚于已缓存的事件，不能使用响应缓存中的旧快照
+            # 权重不足时快照可能被降级为较小档位，各档位的缓存都需要失效
+            for max_limit, _ in BINANCE_DEPTH_WEIGHTS:
+                _response_cache.invalidate(("depth", symbol, min(max_limit, self.SNAPSHOT_LIMIT)))
+            with background_priority():
+                snapshot = await fetch_order_book(symbol, self.SNAPSHOT_LIMIT, use_local_book=False)
+            if "error" in snapshot:
+                logging.error(f"{symbol} 订单簿快照获取失败: {snapshot['error']}")
+                await asyncio.sleep(1.0)
+                continue
+            if not buffer or int(snapshot["lastUpdateId"]) < buffer[0]["U"]:
+                await asyncio.sleep(0.2)  # 快照早于已缓存的事件，稍后重新拉取
+                continue
+            book.apply_snapshot(snapshot)
+            pending = [e for e in buffer if e["u"] > book.last_update_id]
+            buffer.clear()
+            ok = True
+            for event in pending:
+                if not book.apply_event(event):
+                    ok = False
+                    break
+            if not ok:
+                book.synced = False
+                continue
+            book.synced = True
+            logging.info(f"{symbol} 本地订单簿同步完成，lastUpdateId: {book.last_update_id}")
+
+
+_market_stream: MarketStream | None = None
+_order_books: LocalOrderBooks | None = None
+
+
+def start_market_stream(symbols: list | None = None, url: str | None = None) -> MarketStream | None:
+    """
+    启动 WebSocket 行情流；未安装 websockets 时返回 None 并继续使用 REST。
+    :param symbols: 初始订阅的交易对，默认读取 BINANCE_WS_SYMBOLS
+    :param url: 组合流地址，默认读取 BINANCE_WS_URL
+    :return: 行情流实例
+    """
+    global _market_stream, _order_books
+    if websockets is None:
+        logging.warning("未安装 websockets，WebSocket 行情流不可用，继续使用 REST 接口")
+        return None
+    if _market_stream is None:
+        _market_stream = MarketStream(url or BINANCE_WS_URL, symbols if symbols is not None else BINANCE_WS_SYMBOLS)
+        _order_books = LocalOrderBooks(_market_stream)
+        for symbol in list(_market_stream.symbols):
+            _order_books.track(symbol)
+    _market_stream.start()
+    return _market_stream
+
+
+async def stop_market_stream():
+    """停止 WebSocket 行情流"""
+    global _market_stream, _order_books
+    if _order_books is not None:
+        logging.info(f"本地订单簿统计: {_order_books.stats()}")
+        await _order_books.stop()
+        _order_books = None
+    if _market_stream is not None:
+        logging.info(f"WebSocket 行情流统计: {_market_stream.stats()}")
+        await _market_stream.stop()
+        _market_stream = None
+
+
+def _subscribe_market_stream(symbol: str):
+    """行情流开启时订阅已确认有效的交易对（REST 查询成功后调用，无效交易对不会占用订阅名额）"""
+    if _market_stream is not None:
+        _market_stream.subscribe([symbol])
+
+
+@single_flight
 async def fetch_crypto_price(symbol: str) -> dict[str, Any] | None:
     """
     从币安 API 获取加密货币价格信息。
     :param symbol: 交易对符号（如 BTCUSDT）
     :return: 价格数据字典；若出错返回包含 error 信息的字典
     """
+    symbol = _normalize_symbol(symbol)
+    # 已订阅行情流时直接读取内存状态表；未订阅的交易对本次回退到 REST，确认交易对有效后再按需订阅
+    if _market_stream is not None:
+        streamed = _market_stream.get_price(symbol)
+        if streamed is not None:
+            return streamed
+
+    # 有效期内的全市场价格快照可直接回答单币种查询
+    snapshot = _response_cache.get(("price_snapshot",), count=False)
+    if snapshot is not None and symbol in snapshot:
+        _subscribe_market_stream(symbol)
+        return {"symbol": symbol, "price": snapshot[symbol]}
+
+    cache_key = ("price", symbol)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        logging.info(f"{symbol} 价格命中缓存")
+        _subscribe_market_stream(symbol)
+        return cached
+
     logging.info(f"开始获取 {symbol} 价格数据")
     params = {
         "symbol": symbol
     }
     headers = {"User-Agent": USER_AGENT}
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(BINANCE_PRICE_API, params=params, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            logging.info(f"成功获取 {symbol} 价格数据")
-            return response.json()  # 返回字典类型
-        except httpx.HTTPStatusError as e:
-              logging.error(f"{symbol} 价格获取失败: HTTP {e.response.status_code}")
-              return {"error": f"HTTP 错误: {e.response.status_code}"}
-        except Exception as e:
-              logging.error(f"{symbol} 价格获取失败: {str(e)}")
-              return {"error": f"请求失败: {str(e)}"}
+    try:
+        response = await _binance_get(BINANCE_PRICE_API, params=params, headers=headers, timeout=30.0)
+        response.raise_for_status()
+        logging.info(f"成功获取 {symbol} 价格数据")
+        data = response.json()  # 返回字典类型
+        _response_cache.set(cache_key, data, CACHE_TTL["price"])
+        _subscribe_market_stream(symbol)
+        return data
+    except httpx.HTTPStatusError as e:
+          logging.error(f"{symbol} 价格获取失败: HTTP {e.response.status_code}")
+          return {"error": f"HTTP 错误: {e.response.status_code}"}
+    except Exception as e:
+          logging.error(f"{symbol} 价格获取失败: {str(e)}")
+          return {"error": f"请求失败: {str(e)}"}
 
+@single_flight
 async def fetch_crypto_klines(symbol: str, interval: str, limit: int) -> list | dict[str, Any]:
     """
     从币安 API 获取加密货币K线数据。
@@ -84,12 +1260,12 @@ async def fetch_crypto_klines(symbol: str, interval: str, limit: int) -> list |
     :return: K线数据列表；若出错返回包含 error 信息的字典
     """
     # 验证时间周期是否有效
-    valid_intervals = {'1m', '3m', '5m', '15m', '30m', '1h', '2h', '4h', '6h', '8h', '12h', '1d', '3d', '1w', '1M'}
-    if interval not in valid_intervals:
-        return {"error": f"无效的时间周期，请使用: {', '.join(valid_intervals)}"}
+    if interval not in KLINE_INTERVAL_MS:
+        return {"error": f"无效的时间周期，请使用: {', '.join(KLINE_INTERVAL_MS)}"}
 
     # 限制K线数量在1-1000之间
     limit = max(1, min(limit, 1000))
+    symbol = _normalize_symbol(symbol)
 
     logging.info(f"开始获取 {symbol} 的K线数据，周期: {interval}, 数量: {limit}")
     params = {
@@ -99,17 +1275,274 @@ async def fetch_crypto_klines(symbol: str, interval: str, limit: int) -> list |
     }
     headers = {"User-Agent": USER_AGENT}
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(BINANCE_KLINES_API, params=params, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            logging.info(f"成功获取 {symbol} 的K线数据，周期: {interval}, 数量: {limit}")
-            return response.json()  # 返回K线数据列表
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP 错误: {e.response.status_code}"}
-        except Exception as e:
-            return {"error": f"请求失败: {str(e)}"}
+    # 已收盘的K线永久缓存；缓存足够覆盖请求时只补拉最后一根之后的K线
+    now_ms = int(time.time() * 1000)
+    cache_key = ("klines", symbol, interval)
+    closed = _response_cache.get(cache_key, count=False) or []
+    incremental = False
+    if closed:
+        last_open_time = int(closed[-1][0])
+        expected_new = (now_ms - last_open_time) // KLINE_INTERVAL_MS[interval] + 1
+        if expected_new < 1000 and len(closed) + expected_new >= limit:
+            params = {
+                "symbol": symbol,
+                "interval": interval,
+                "startTime": last_open_time + 1,
+                "limit": 1000
+            }
+            incremental = True
+            logging.info(f"{symbol} K线命中缓存 {len(closed)} 根，仅补拉 {last_open_time} 之后的数据")
+    # 增量补拉仍会请求币安，记为部分命中而不是命中
+    if incremental:
+        _response_cache.record_partial()
+    else:
+        _response_cache.record(False)
+
+    try:
+        response = await _binance_get(BINANCE_KLINES_API, params=params, headers=headers, timeout=30.0)
+        response.raise_for_status()
+        logging.info(f"成功获取 {symbol} 的K线数据，周期: {interval}, 数量: {limit}")
+        rows = response.json()  # 返回K线数据列表
+        if incremental:
+            rows = closed + rows
+        # 收盘时间早于当前时间的K线已经收盘，可以永久缓存
+        closed_rows = [row for row in rows if int(row[6]) < now_ms]
+        if closed_rows:
+            _response_cache.set(cache_key, closed_rows[-1000:], CACHE_TTL["klines"])
+        return rows[-limit:]
+    except httpx.HTTPStatusError as e:
+        return {"error": f"HTTP 错误: {e.response.status_code}"}
+    except Exception as e:
+        return {"error": f"请求失败: {str(e)}"}
+
+class KlineStore:
+    """
+    基于 SQLite 的本地K线库，只保存已收盘的K线。
+    klines 表按 (symbol, interval, open_time) 存储K线；
+    kline_coverage 表记录已经从币安完整拉取过的时间区间，用于计算需要补齐的缺口。
+    """
+
+    def __init__(self, path: str = KLINE_STORE_PATH):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS klines ("
+                "symbol TEXT, interval TEXT, open_time INTEGER, open REAL, high REAL, low REAL, close REAL, "
+                "volume REAL, close_time INTEGER, quote_volume REAL, trades INTEGER, "
+                "taker_base_volume REAL, taker_quote_volume REAL, "
+                "PRIMARY KEY (symbol, interval, open_time)) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kline_coverage ("
+                "symbol TEXT, interval TEXT, start_time INTEGER, end_time INTEGER)"
+            )
+            self._conn = conn
+            logging.info(f"本地K线库已打开: {self.path}")
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _coverage(self, symbol: str, interval: str) -> list[tuple[int, int]]:
+        rows = self._connection().execute(
+            "SELECT start_time, end_time FROM kline_coverage WHERE symbol = ? AND interval = ? ORDER BY start_time",
+            (symbol, interval)
+        ).fetchall()
+        return [(int(a), int(b)) for a, b in rows]
+
+    def missing_spans(self, symbol: str, interval: str, start: int, end: int) -> list[tuple[int, int]]:
+        """
+        计算 [start, end] 内尚未拉取过的时间区间。
+        :return: 缺口区间列表（毫秒，闭区间）
+        """
+        with self._lock:
+            coverage = self._coverage(symbol, interval)
+        spans = []
+        cursor = start
+        for covered_start, covered_end in coverage:
+            if covered_end < cursor:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > cursor:
+                spans.append((cursor, covered_start - 1))
+            cursor = max(cursor, covered_end + 1)
+        if cursor <= end:
+            spans.append((cursor, end))
+        return spans
+
+    def save(self, symbol: str, interval: str, rows: list, span: tuple[int, int]):
+        """
+        写入一页K线并把该页时间区间记为已拉取。
+        :param rows: 币安K线数据（仅包含已收盘K线）
+        :param span: 本页请求的时间区间
+        """
+        records = [
+            (symbol, interval, int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]), float(r[5]),
+             int(r[6]), float(r[7]), int(r[8]), float(r[9]), float(r[10]))
+            for r in rows
+        ]
+        with self._lock:
+            conn = self._connection()
+            spans = self._coverage(symbol, interval) + [span]
+            spans.sort()
+            merged = [spans[0]]
+            for span_start, span_end in spans[1:]:
+                last_start, last_end = merged[-1]
+                if span_start <= last_end + 1:
+                    merged[-1] = (last_start, max(last_end, span_end))
+                else:
+                    merged.append((span_start, span_end))
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO klines VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", records)
+                conn.execute("DELETE FROM kline_coverage WHERE symbol = ? AND interval = ?", (symbol, interval))
+                conn.executemany(
+                    "INSERT INTO kline_coverage VALUES (?,?,?,?)",
+                    [(symbol, interval, a, b) for a, b in merged]
+                )
+
+    def read(self, symbol: str, interval: str, start: int, end: int, limit: int, latest: bool = False) -> list:
+        """
+        读取区间内的K线，返回与币安接口相同的行结构。
+        :param latest: True 时返回区间内最新的 limit 根，否则返回最早的 limit 根
+        """
+        order = "DESC" if latest else "ASC"
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT open_time, open, high, low, close, volume, close_time, quote_volume, trades, "
+                "taker_base_volume, taker_quote_volume FROM klines "
+                f"WHERE symbol = ? AND interval = ? AND open_time BETWEEN ? AND ? ORDER BY open_time {order} LIMIT ?",
+                (symbol, interval, start, end, limit)
+            ).fetchall()
+        if latest:
+            rows.reverse()
+        return [list(r) + ["0"] for r in rows]
+
+    def count(self, symbol: str, interval: str, start: int, end: int) -> int:
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM klines WHERE symbol = ? AND interval = ? AND open_time BETWEEN ? AND ?",
+                (symbol, interval, start, end)
+            ).fetchone()[0]
+
+
+_kline_store = KlineStore()
+
+
+def _parse_time_ms(value: Any) -> int | None:
+    """
+    解析时间参数为毫秒时间戳。
+    :param value: 毫秒/秒级时间戳，或本地时间字符串（如 2024-01-01、2024-01-01 08:00）
+    :return: 毫秒时间戳；无法解析时抛出 ValueError
+    """
+    if value is None or value == "":
+        return None
+    text = str(value).strip()
+    if text.isdigit():
+        number = int(text)
+        return number * 1000 if number < 10_000_000_000 else number
+    return int(datetime.datetime.fromisoformat(text).timestamp() * 1000)
+
+
+async def _fetch_kline_page(symbol: str, interval: str, start: int, end: int) -> list | dict[str, Any]:
+    """按 startTime/endTime 拉取一页K线（最多1000根）"""
+    params = {
+        "symbol": symbol,
+        "interval": interval,
+        "startTime": start,
+        "endTime": end,
+        "limit": 1000
+    }
+    headers = {"User-Agent": USER_AGENT}
+    try:
+        response = await _binance_get(BINANCE_KLINES_API, params=params, headers=headers, timeout=30.0)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        return {"error": f"HTTP 错误: {e.response.status_code}"}
+    except Exception as e:
+        return {"error": f"请求失败: {str(e)}"}
+
+
+@single_flight
+async def fetch_kline_range(symbol: str, interval: str, start_time: Any = None, end_time: Any = None,
+                            limit: int = 1000) -> list | dict[str, Any]:
+    """
+    从本地K线库读取任意时间区间的K线，缺失部分按页并发从币安补齐后落盘。
+    :param symbol: 交易对符号（如 BTCUSDT）
+    :param interval: 时间周期（如 1m, 5m, 1h, 1d）
+    :param start_time: 开始时间（时间戳或本地时间字符串），为空时按 limit 从结束时间向前推算
+    :param end_time: 结束时间（时间戳或本地时间字符串），为空时表示当前时间
+    :param limit: 最多返回的K线数量；只给出结束时间时返回最新的 limit 根
+    :return: K线数据列表（仅包含已收盘K线）；若出错返回包含 error 信息的字典
+    """
+    if interval not in KLINE_INTERVAL_MS:
+        return {"error": f"无效的时间周期，请使用: {', '.join(KLINE_INTERVAL_MS)}"}
+    try:
+        start = _parse_time_ms(start_time)
+        end = _parse_time_ms(end_time)
+    except ValueError as e:
+        return {"error": f"无法解析时间参数: {str(e)}"}
+
+    symbol = _normalize_symbol(symbol)
+    limit = max(1, min(limit, KLINE_RANGE_MAX_ROWS))
+    step = KLINE_INTERVAL_MS[interval]
+    page_step = KLINE_MONTH_MS_MIN if interval == '1M' else step
+    closed_step = KLINE_MONTH_MS_MAX if interval == '1M' else step
+    now_ms = int(time.time() * 1000)
+    end = min(end if end is not None else now_ms, now_ms - closed_step)  # 只处理已收盘的K线
+    latest = start is None
+    if start is None:
+        start = end - limit * step
+    else:
+        # 只返回从开始时间起的 limit 根，不必补齐之后的部分
+        end = min(end, start + limit * closed_step - 1)
+    if start > end:
+        return {"error": "开始时间必须早于结束时间（且区间内需有已收盘的K线）"}
+
+    # 计算缺口并按页并发补齐（工具调用直接等待结果，按交互优先级排队）
+    spans = await asyncio.to_thread(_kline_store.missing_spans, symbol, interval, start, end)
+    pages = []
+    for span_start, span_end in spans:
+        page_start = span_start
+        while page_start <= span_end:
+            page_end = min(page_start + 1000 * page_step - 1, span_end)
+            pages.append((page_start, page_end))
+            page_start = page_end + 1
+    if pages:
+        logging.info(f"{symbol} {interval} K线库缺少 {len(spans)} 个区间，分 {len(pages)} 页补齐")
+    semaphore = asyncio.Semaphore(KLINE_BACKFILL_CONCURRENCY)
+
+    async def backfill(page: tuple[int, int]) -> str | None:
+        async with semaphore:
+            rows = await _fetch_kline_page(symbol, interval, page[0], page[1])
+        if isinstance(rows, dict):
+            return rows["error"]
+        closed_rows = [row for row in rows if int(row[6]) < now_ms]
+        await asyncio.to_thread(_kline_store.save, symbol, interval, closed_rows, page)
+        return None
+
+    errors = [e for e in await asyncio.gather(*(backfill(p) for p in pages)) if e]
+    if errors:
+        logging.error(f"{symbol} {interval} K线补齐失败 {len(errors)} 页: {errors[0]}")
+        return {"error": f"K线补齐失败: {errors[0]}"}
+
+    rows = await asyncio.to_thread(_kline_store.read, symbol, interval, start, end, limit, latest)
+    logging.info(f"从本地K线库读取 {symbol} {interval} K线 {len(rows)} 根")
+    return rows
+
 
+@single_flight
 async def fetch_funding_rate(symbol: str, limit: int = 10) -> list | dict[str, Any]:
     """
     从币安 API 获取加密货币资金费率数据。
@@ -119,6 +1552,12 @@ async def fetch_funding_rate(symbol: str, limit: int = 10) -> list | dict[str, A
     """
     # 限制记录数量在1-1000之间
     limit = max(1, min(limit, 1000))
+    symbol = _normalize_symbol(symbol)
+    cache_key = ("funding_rate", symbol, limit)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        logging.info(f"{symbol} 资金费率命中缓存")
+        return cached
 
     logging.info(f"开始获取 {symbol} 的资金费率数据，数量: {limit}")
     params = {
@@ -127,17 +1566,19 @@ async def fetch_funding_rate(symbol: str, limit: int = 10) -> list | dict[str, A
     }
     headers = {"User-Agent": USER_AGENT}
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(BINANCE_FUNDING_RATE_API, params=params, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            logging.info(f"成功获取 {symbol} 的资金费率数据，数量: {limit}")
-            return response.json()  # 返回资金费率数据列表
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP 错误: {e.response.status_code}"}
-        except Exception as e:
-            return {"error": f"请求失败: {str(e)}"}
+    try:
+        response = await _binance_get(BINANCE_FUNDING_RATE_API, params=params, headers=headers, timeout=30.0)
+        response.raise_for_status()
+        logging.info(f"成功获取 {symbol} 的资金费率数据，数量: {limit}")
+        data = response.json()  # 返回资金费率数据列表
+        _response_cache.set(cache_key, data, CACHE_TTL["funding_rate"])
+        return data
+    except httpx.HTTPStatusError as e:
+        return {"error": f"HTTP 错误: {e.response.status_code}"}
+    except Exception as e:
+        return {"error": f"请求失败: {str(e)}"}
 
+@single_flight
 async def fetch_crypto_news(length: int = 0) -> dict[str, Any]:
     """
     从Odaily API获取加密货币新闻
@@ -157,21 +1598,362 @@ async def fetch_crypto_news(length: int = 0) -> dict[str, Any]:
         "Content-Type": "application/json"
     }
 
-    async with httpx.AsyncClient() as client:
+    client = _get_http_client(ODAILY_NEWS_API)
+    try:
+        response = await client.get(ODAILY_NEWS_API, params=params, headers=headers, timeout=120.0)
+        response.raise_for_status()
+        logging.info(f"成功获取加密货币新闻，length: {length}")
+        return response.json()  # 返回新闻数据
+    except httpx.HTTPStatusError as e:
+        logging.error(f"加密货币新闻获取失败: HTTP {e.response.status_code}")
+        return {"error": f"HTTP错误: {e.response.status_code}"}
+    except Exception as e:
+        return {"error": f"请求失败: {str(e)}"}
+
+class NewsStore:
+    """
+    Odaily 新闻本地库：内存索引 + SQLite 持久化。
+    每条新闻按 类型 + id（没有 id 时用源网址）去重，新拉取的数据增量合并，已有条目直接丢弃；
+    超过保留天数的新闻在合并时清理。
+    """
+
+    def __init__(self, path: str = NEWS_STORE_PATH, retention_days: float = NEWS_RETENTION_DAYS):
+        self.path = path
+        self.retention_ms = int(retention_days * 86_400_000)
+        self.refreshed: dict[int, float] = {}  # length -> 最近一次成功拉取的时间
+        self.merged = 0
+        self.duplicates = 0
+        self._items: dict[str, dict[str, Any]] = {}
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS news ("
+                "key TEXT PRIMARY KEY, type TEXT, published INTEGER, item TEXT) WITHOUT ROWID"
+            )
+            with conn:
+                conn.execute("DELETE FROM news WHERE published < ?", (self._cutoff(),))
+            for key, item in conn.execute("SELECT key, item FROM news"):
+                self._items[key] = json.loads(item)
+            self._conn = conn
+            logging.info(f"本地新闻库已打开: {self.path}，共 {len(self._items)} 条")
+        return self._conn
+
+    def _cutoff(self) -> int:
+        return int(time.time() * 1000) - self.retention_ms
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @staticmethod
+    def normalize(raw: dict) -> dict[str, Any] | None:
+        """
+        把 Odaily 原始条目转换为统一结构。
+        :param raw: arr_news 中的一条新闻
+        :return: 包含 key/type/title/content/url/published_at/published 的字典；无法识别时返回 None
+        """
+        if not isinstance(raw, dict):
+            return None
+        news_type = raw.get("type")
+        if news_type == "newsflashes":
+            url = raw.get("news_url") or ""
+            content = (raw.get("description") or "").replace('Odaily星球日报讯', '').strip()
+        elif news_type == "posts":
+            url = raw.get("link") or ""
+            content = raw.get("summary") or ""
+        else:
+            return None
+        item_id = raw.get("id")
+        key = f"{news_type}:{item_id}" if item_id not in (None, "") else url
+        if not key:
+            return None
         try:
-            response = await client.get(ODAILY_NEWS_API, params=params, headers=headers, timeout=120.0)
-            response.raise_for_status()
-            logging.info(f"成功获取加密货币新闻，length: {length}")
-            return response.json()  # 返回新闻数据
-        except httpx.HTTPStatusError as e:
-            logging.error(f"加密货币新闻获取失败: HTTP {e.response.status_code}")
-            return {"error": f"HTTP错误: {e.response.status_code}"}
+            published = _parse_time_ms(raw.get("published_at"))
+        except (ValueError, TypeError):
+            published = None
+        return {
+            "key": key,
+            "type": news_type,
+            "title": raw.get("title") or "",
+            "content": content,
+            "url": url,
+            "published_at": str(raw.get("published_at") or ""),
+            "published": published if published is not None else int(time.time() * 1000),
+        }
+
+    def merge(self, raw_items: list) -> int:
+        """
+        增量合并一批新闻，跳过已存在的条目。
+        :param raw_items: Odaily arr_news 列表
+        :return: 新增条数
+        """
+        with self._lock:
+            conn = self._connection()
+            new_items = []
+            for raw in raw_items:
+                item = self.normalize(raw)
+                if item is None:
+                    continue
+                if item["key"] in self._items:
+                    self.duplicates += 1
+                    continue
+                self._items[item["key"]] = item
+                new_items.append(item)
+            cutoff = self._cutoff()
+            expired = [key for key, item in self._items.items() if item["published"] < cutoff]
+            for key in expired:
+                del self._items[key]
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO news VALUES (?,?,?,?)",
+                    [(i["key"], i["type"], i["published"], json.dumps(i, ensure_ascii=False)) for i in new_items]
+                )
+                if expired:
+                    conn.execute("DELETE FROM news WHERE published < ?", (cutoff,))
+            self.merged += len(new_items)
+        return len(new_items)
+
+    def mark_refreshed(self, length: int):
+        self.refreshed[length] = time.time()
+
+    def is_fresh(self, length: int, max_age: float = NEWS_POLL_INTERVAL) -> bool:
+        """
+        判断本地库中某一天的新闻是否足够新。
+        今天的新闻在 max_age 秒内拉取过即视为最新；昨天的新闻只要在今天拉取过一次就不再变化。
+        """
+        refreshed = self.refreshed.get(length)
+        if refreshed is None:
+            return False
+        if length == 1:
+            return refreshed >= _local_day_start_ms(0) / 1000
+        return time.time() - refreshed < max_age
+
+    def query(self, news_type: str | None = None, start: int | None = None, end: int | None = None,
+              keyword: str | None = None, limit: int = 50) -> list[dict[str, Any]]:
+        """
+        按条件读取新闻，按发布时间从新到旧排序。
+        :param news_type: newsflashes 或 posts，None 表示全部
+        :param start: 发布时间下限（毫秒，含）
+        :param end: 发布时间上限（毫秒，不含）
+        :param keyword: 标题或内容包含的关键词（不区分大小写）
+        """
+        needle = keyword.lower() if keyword else None
+        with self._lock:
+            self._connection()
+            items = [
+                item for item in self._items.values()
+                if (news_type is None or item["type"] == news_type)
+                and (start is None or item["published"] >= start)
+                and (end is None or item["published"] < end)
+                and (needle is None or needle in item["title"].lower() or needle in item["content"].lower())
+            ]
+        items.sort(key=lambda item: item["published"], reverse=True)
+        return items[:limit]
+
+    def stats(self) -> dict[str, int]:
+        return {"items": len(self._items), "merged": self.merged, "duplicates": self.duplicates}
+
+
+_news_store = NewsStore()
+
+
+def _local_day_start_ms(days_ago: int) -> int:
+    """返回本地时间 days_ago 天前 0 点的毫秒时间戳"""
+    day = datetime.date.today() - datetime.timedelta(days=days_ago)
+    return int(datetime.datetime.combine(day, datetime.time.min).timestamp() * 1000)
+
+
+@single_flight
+async def refresh_news(length: int = 0) -> dict[str, Any]:
+    """
+    拉取一次 Odaily 新闻并增量合并到本地新闻库。
+    :param length: 0表示今天新闻，1表示昨天新闻
+    :return: 新增条数与库中总条数；若出错返回包含error信息的字典
+    """
+    data = await fetch_crypto_news(length)
+    if "error" in data:
+        return data
+    arr_news = data.get("data", {}).get("arr_news") if isinstance(data.get("data"), dict) else None
+    if not isinstance(arr_news, list):
+        return {"error": "无效的新闻数据格式"}
+    new_count = await asyncio.to_thread(_news_store.merge, arr_news)
+    _news_store.mark_refreshed(length)
+    if new_count:
+        logging.info(f"新闻库新增 {new_count} 条，共 {len(_news_store)} 条")
+    return {"new": new_count, "total": len(_news_store)}
+
+
+class NewsPoller:
+    """按固定间隔拉取 Odaily 当日新闻并合并到本地新闻库的后台任务"""
+
+    def __init__(self, interval: float = NEWS_POLL_INTERVAL):
+        self.interval = interval
+        self.polls = 0
+        self.errors = 0
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        """启动后台轮询任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """停止轮询"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _poll(self, length: int):
+        self.polls += 1
+        try:
+            result = await refresh_news(length)
         except Exception as e:
-            return {"error": f"请求失败: {str(e)}"}
+            result = {"error": str(e)}
+        if "error" in result:
+            self.errors += 1
+            logging.warning(f"新闻轮询失败: {result['error']}")
+
+    async def _run(self):
+        # 启动时补齐一次昨日新闻，之后只轮询当日新闻
+        await self._poll(1)
+        while True:
+            await self._poll(0)
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict[str, int]:
+        return {"polls": self.polls, "errors": self.errors}
+
+
+_news_poller: NewsPoller | None = None
+
+
+def start_news_poller(interval: float | None = None) -> NewsPoller:
+    """
+    启动 Odaily 新闻后台轮询。
+    :param interval: 轮询间隔（秒），默认读取 NEWS_POLL_INTERVAL
+    :return: 轮询任务实例
+    """
+    global _news_poller
+    if _news_poller is None:
+        _news_poller = NewsPoller(interval or NEWS_POLL_INTERVAL)
+    _news_poller.start()
+    return _news_poller
+
+
+async def stop_news_poller():
+    """停止 Odaily 新闻后台轮询"""
+    global _news_poller
+    if _news_poller is not None:
+        logging.info(f"新闻轮询统计: {_news_poller.stats()}，新闻库统计: {_news_store.stats()}")
+        await _news_poller.stop()
+        _news_poller = None
+
+
+async def query_news_store(length: int = 0, news_type: str | None = None, since: Any = None,
+                           keyword: str | None = None, limit: int = 50) -> list | dict[str, Any]:
+    """
+    从本地新闻库查询新闻；库中数据过期时先增量拉取一次。
+    :param length: 0表示今天新闻，1表示昨天新闻
+    :param news_type: newsflashes（快讯）或 posts（文章），None 表示全部
+    :param since: 只返回该时间之后发布的新闻
+    :param keyword: 标题或内容包含的关键词
+    :param limit: 最多返回条数
+    :return: 新闻条目列表；若出错返回包含error信息的字典
+    """
+    if length not in (0, 1):
+        return {"error": "无效的length参数，必须为0或1"}
+    if news_type is not None and news_type not in NEWS_TYPES:
+        return {"error": f"无效的新闻类型: {news_type}，可选 {', '.join(NEWS_TYPES)}"}
+    try:
+        since_ms = _parse_time_ms(since)
+    except (ValueError, TypeError):
+        return {"error": f"无法解析时间参数: {since}"}
+    limit = max(1, min(int(limit), NEWS_MAX_ITEMS))
+
+    refresh = await refresh_news(length) if not _news_store.is_fresh(length) else {}
+    start = _local_day_start_ms(length)
+    end = _local_day_start_ms(length - 1)
+    if since_ms is not None:
+        start = max(start, since_ms)
+    items = await asyncio.to_thread(_news_store.query, news_type, start, end, keyword, limit)
+    # 拉取失败时仍返回库中已有的数据，库中没有数据才返回错误
+    if not items and "error" in refresh:
+        return refresh
+    return items
+
+
+def _normalize_news_query(query: str) -> str:
+    """规范化搜索关键词用作缓存键：合并空白并转小写，保留 AND/OR/NOT 运算符的大小写"""
+    return " ".join(w if w in NEWS_SEARCH_OPERATORS else w.lower() for w in query.split())
+
+
+def _compact_news_search(data: dict[str, Any]) -> dict[str, Any]:
+    """只保留 format_news_search 用到的字段，减小缓存占用"""
+    articles = []
+    for article in data.get("articles") or []:
+        if not isinstance(article, dict):
+            continue
+        compact = {field: article[field] for field in NEWS_ARTICLE_FIELDS if article.get(field) is not None}
+        source = article.get("source")
+        if isinstance(source, dict) and source.get("name"):
+            compact["source"] = {"name": source["name"]}
+        articles.append(compact)
+    return {"totalResults": data.get("totalResults", len(articles)), "articles": articles}
+
+
+async def _request_news_search(cache_key: tuple, query: str, api_key: str, language: str, page_size: int,
+                               sort_by: str) -> dict[str, Any]:
+    """请求 NewsAPI，成功时把精简后的结果连同请求数量写入缓存"""
+    params = {
+        "q": query,
+        "apiKey": api_key,
+        "language": language,
+        "pageSize": page_size,
+        "sortBy": sort_by
+    }
+    
+    headers = {
+        "User-Agent": USER_AGENT
+    }
 
+    client = _get_http_client(NEWS_API_URL)
+    try:
+        response = await client.get(NEWS_API_URL, params=params, headers=headers, timeout=30.0)
+        response.raise_for_status()
+        data = _compact_news_search(response.json())
+        logging.info(f"成功搜索到 {len(data['articles'])} 条新闻")
+        _response_cache.set(cache_key, (time.monotonic(), page_size, data), NEWS_SEARCH_STALE_TTL)
+        return data
+    except httpx.HTTPStatusError as e:
+        logging.error(f"新闻搜索失败: HTTP {e.response.status_code}")
+        return {"error": f"HTTP错误: {e.response.status_code}"}
+    except Exception as e:
+        logging.error(f"新闻搜索失败: {str(e)}")
+        return {"error": f"请求失败: {str(e)}"}
+
+
+@single_flight
 async def fetch_news_search(query: str, api_key: str = None, language: str = "zh", page_size: int = 20, sort_by: str = "publishedAt") -> dict[str, Any]:
     """
-    从NewsAPI搜索加密货币相关新闻
+    从NewsAPI搜索加密货币相关新闻。
+    结果按 规范化关键词 + 语言 + 排序 缓存，较大 page_size 的缓存可以直接满足较小的请求；
+    超过 NEWS_SEARCH_TTL 的缓存立即返回，同时在后台刷新。
     :param query: 搜索关键词（如"bitcoin", "加密货币", "区块链"）
     :param api_key: NewsAPI密钥，如果为None则使用从命令行参数解析的默认密钥
     :param language: 语言代码（zh中文, en英文等）
@@ -187,7 +1969,7 @@ async def fetch_news_search(query: str, api_key: str = None, language: str = "zh
         return {"error": "NewsAPI密钥未配置，请在调用时提供api_key参数或在启动时通过--NEWS_API_KEY参数配置"}
     
     # 验证参数
-    if not query or not isinstance(query, str):
+    if not query or not isinstance(query, str) or not query.strip():
         return {"error": "搜索关键词不能为空"}
     
     if page_size < 1 or page_size > 100:
@@ -197,66 +1979,235 @@ async def fetch_news_search(query: str, api_key: str = None, language: str = "zh
     if sort_by not in valid_sort_by:
         sort_by = "publishedAt"
 
+    query = " ".join(query.split())
+    language = (language or "zh").strip().lower()
+    cache_key = ("news_search", _normalize_news_query(query), language, sort_by)
+    cached = _response_cache.get(cache_key, count=False)
+    # 缓存的请求数量不小于本次请求，或缓存结果已经是全部结果时，直接截取返回
+    if cached is not None and (cached[1] >= page_size or len(cached[2]["articles"]) < cached[1]):
+        _response_cache.record(True)
+        fetched_at, cached_size, data = cached
+        if time.monotonic() - fetched_at > NEWS_SEARCH_TTL:
+            logging.info(f"新闻搜索缓存已过期，后台刷新，关键词: {query}")
+            _spawn_background(_single_flight.do(
+                ("news_search_refresh",) + cache_key, _request_news_search,
+                cache_key, query, effective_api_key, language, cached_size, sort_by
+            ))
+        return {"totalResults": data["totalResults"], "articles": data["articles"][:page_size]}
+    _response_cache.record(False)
+
     logging.info(f"开始搜索新闻，关键词: {query}, 语言: {language}, 数量: {page_size}, 排序: {sort_by}")
-    
-    params = {
-        "q": query,
-        "apiKey": effective_api_key,
-        "language": language,
-        "pageSize": page_size,
-        "sortBy": sort_by
-    }
-    
-    headers = {
-        "User-Agent": USER_AGENT
-    }
+    return await _request_news_search(cache_key, query, effective_api_key, language, page_size, sort_by)
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(NEWS_API_URL, params=params, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            logging.info(f"成功搜索到 {page_size} 条新闻")
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            logging.error(f"新闻搜索失败: HTTP {e.response.status_code}")
-            return {"error": f"HTTP错误: {e.response.status_code}"}
-        except Exception as e:
-            logging.error(f"新闻搜索失败: {str(e)}")
-            return {"error": f"请求失败: {str(e)}"}
+@single_flight
+async def fetch_price_snapshot() -> dict[str, Any]:
+    """
+    从币安 API 一次性获取全市场交易对的最新价格，建立 交易对 -> 价格 的字典索引。
+    快照在 PRICE_SNAPSHOT_TTL 秒内复用，期间的批量查询不再访问上游。
+    :return: {交易对: 价格字符串} 字典；若出错返回包含 error 信息的字典
+    """
+    cache_key = ("price_snapshot",)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    logging.info("开始获取全市场价格快照")
+    headers = {"User-Agent": USER_AGENT}
 
+    try:
+        response = await _binance_get(BINANCE_BATCH_PRICE_API, headers=headers, timeout=30.0)
+        response.raise_for_status()
+        snapshot = {item["symbol"]: item["price"] for item in response.json()}
+        logging.info(f"成功获取全市场价格快照，共 {len(snapshot)} 个交易对")
+        _response_cache.set(cache_key, snapshot, CACHE_TTL["price_snapshot"])
+        return snapshot
+    except httpx.HTTPStatusError as e:
+        return {"error": f"HTTP 错误: {e.response.status_code}"}
+    except Exception as e:
+        return {"error": f"请求失败: {str(e)}"}
+
+@single_flight
 async def fetch_batch_crypto_prices(symbols: list) -> list | dict[str, Any]:
     """
-    批量从币安 API 获取多个加密货币价格信息。
+    批量获取多个加密货币价格信息：基于全市场价格快照逐个字典查找，
+    查询任意数量的交易对最多只需一次上游请求。
     :param symbols: 交易对符号列表（如 ["BTCUSDT", "ETHUSDT"]）
-    :return: 价格数据列表；若出错返回包含 error 信息的字典
+    :return: 价格数据列表（顺序与输入一致，重复项去除，不存在的交易对带 error 字段）；若出错返回包含 error 信息的字典
     """
     # 验证交易对格式和数量
     if not isinstance(symbols, list) or len(symbols) == 0:
         return {"error": "请提供有效的交易对列表"}
-    
+
+    normalized = []
     for symbol in symbols:
-        if not re.match(r'^[A-Z0-9]{3,10}$', str(symbol)):
+        symbol = _normalize_symbol(symbol)
+        if not SYMBOL_PATTERN.match(symbol):
             return {"error": f"无效的交易对格式: {symbol}"}
-    logging.info(f"开始批量获取加密货币价格，交易对: {symbols}")
-    params = {"symbols": json.dumps(symbols)}
-    headers = {"User-Agent": USER_AGENT}
+        normalized.append(symbol)
+    symbols = list(dict.fromkeys(normalized))
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(BINANCE_BATCH_PRICE_API, params=params, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            logging.info(f"成功批量获取 {len(symbols)} 个加密货币价格数据")
-            return response.json()  # 返回价格数据列表
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP 错误: {e.response.status_code}"}
-        except Exception as e:
-            return {"error": f"请求失败: {str(e)}"}
+    snapshot = await fetch_price_snapshot()
+    if "error" in snapshot:
+        return snapshot
+    logging.info(f"批量查询 {len(symbols)} 个交易对价格（全市场快照）")
+    return [{"symbol": symbol, "price": snapshot[symbol]} if symbol in snapshot
+            else {"symbol": symbol, "error": "交易对不存在"}
+            for symbol in symbols]
+
+
+class KlineColumns:
+    """
+    K线列式结构：先按列转置，再把价格 / 成交量与时间戳分别一次性转换为连续的 NumPy 数组，
+    K线格式化与各类分析工具共用同一份解析结果。
+    """
+
+    FIELDS = ("open_time", "open", "high", "low", "close", "volume", "close_time")
+
+    def __init__(self, data: list):
+        """
+        :param data: 币安K线数据列表（每行至少包含前7个字段）
+        :raises ValueError / IndexError / TypeError: 数据行格式不正确
+        """
+        # zip 按最短的行截断：任一行不足 7 个字段时下面取 columns[6] 会抛出 IndexError
+        columns = list(zip(*data)) if data else [()] * len(self.FIELDS)
+        prices = np.array(columns[1:6], dtype=np.float64).reshape(5, -1)
+        times = np.array((columns[0], columns[6]), dtype=np.int64).reshape(2, -1)
+        self.open_time, self.close_time = times
+        self.open, self.high, self.low, self.close, self.volume = prices
+
+    def __len__(self):
+        return len(self.open_time)
+
+    def time_strings(self, field: str = "open_time") -> list[str]:
+        """
+        向量化地把毫秒时间戳格式化为本地时间字符串（%Y-%m-%d %H:%M:%S）。
+        :param field: 时间列名（open_time 或 close_time）
+        """
+        return _local_time_strings(getattr(self, field))
+
+
+def _local_time_strings(ms) -> list[str]:
+    """
+    向量化地把毫秒时间戳数组格式化为本地时间字符串（%Y-%m-%d %H:%M:%S）。
+    :param ms: int64 毫秒时间戳数组
+    """
+    ms = np.asarray(ms, dtype=np.int64)
+    if not len(ms):
+        return []
+    first, last = int(ms[0]) // 1000, int(ms[-1]) // 1000
+    offset = time.localtime(first).tm_gmtoff
+    if offset == time.localtime(last).tm_gmtoff and abs(last - first) < 30 * 86400:
+        local = ms + offset * 1000
+    else:
+        # 区间可能跨越夏令时切换，按小时分别取本地时区偏移
+        hours, inverse = np.unique(ms // 3_600_000, return_inverse=True)
+        offsets = np.array([time.localtime(h * 3600).tm_gmtoff for h in hours.tolist()], dtype=np.int64)
+        local = ms + offsets[inverse] * 1000
+    text = np.datetime_as_string(local.astype("datetime64[ms]"), unit="s")
+    return [value.replace("T", " ") for value in text.tolist()]
+
+
+def parse_klines(data: list) -> KlineColumns:
+    """
+    将币安K线数据解析为 KlineColumns。
+    :param data: K线数据列表
+    :return: 列式K线结构
+    """
+    return KlineColumns(data)
+
+
+def _fit_to_budget(header: list[str], rows: list[str], max_chars: int, keep_tail: bool = True) -> str:
+    """
+    在字符预算内拼接输出：始终保留表头，超出预算时省略部分数据行并注明。
+    :param header: 表头行
+    :param rows: 数据行
+    :param max_chars: 最大字符数，<= 0 表示不限制
+    :param keep_tail: True 保留最后的数据行（时间序列最新数据在末尾），False 保留最前面的数据行
+    :return: 拼接后的文本
+    """
+    text = '\n'.join(header + rows)
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    note = f"…（已省略 {{}} 行以满足 {max_chars} 字符限制，可改用 summary / downsampled 模式或减少数量）"
+    budget = max_chars - len('\n'.join(header)) - len(note) - 8
+    kept, used = [], 0
+    for row in (reversed(rows) if keep_tail else rows):
+        if used + len(row) + 1 > budget:
+            break
+        kept.append(row)
+        used += len(row) + 1
+    if keep_tail:
+        kept.reverse()
+    note = note.format(len(rows) - len(kept))
+    lines = header + ([note] + kept if keep_tail else kept + [note])
+    return '\n'.join(lines)[:max_chars]
+
+
+def _invalid_output_mode(output_mode: str, needs_numpy: bool = True) -> str | None:
+    """校验输出模式，K线/资金费率的非 table 模式还需要 numpy；返回错误提示或 None"""
+    if output_mode not in OUTPUT_MODES:
+        return f"❌ 无效的输出模式，请使用: {', '.join(OUTPUT_MODES)}"
+    if needs_numpy and output_mode != "table" and np is None:
+        return "❌ 未安装 numpy，仅支持 table 输出模式"
+    return None
 
 
-def format_crypto_data(data: dict[str, Any] | str) -> str:
+def _lttb(x, y, points: int):
+    """
+    Largest-Triangle-Three-Buckets 降采样，保留折线形状的关键点。
+    :param x: 横坐标（如时间戳）
+    :param y: 纵坐标
+    :param points: 目标点数
+    :return: 保留点的下标数组
+    """
+    length = len(x)
+    if points >= length:
+        return np.arange(length)
+    if points < 3:
+        return np.array([0, length - 1][:max(points, 1)])
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, length - 1, points - 1).astype(np.int64)
+    selected = [0]
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else length
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        ax, ay = x[selected[-1]], y[selected[-1]]
+        area = np.abs((ax - avg_x) * (y[start:end] - ay) - (ax - x[start:end]) * (avg_y - ay))
+        selected.append(start + int(area.argmax()))
+    selected.append(length - 1)
+    return np.array(selected)
+
+
+def _kline_summary_lines(columns: KlineColumns) -> list[str]:
+    """K线区间汇总：OHLC、涨跌幅、振幅、成交量与波动率"""
+    times = columns.time_strings()
+    first_open, last_close = float(columns.open[0]), float(columns.close[-1])
+    high_index, low_index = int(columns.high.argmax()), int(columns.low.argmin())
+    high, low = float(columns.high[high_index]), float(columns.low[low_index])
+    volume = float(columns.volume.sum())
+    n = len(columns)
+    lines = [f"📊 K线区间汇总（{times[0]} ~ {times[-1]}，共 {n} 根）：\n"]
+    lines.append(f"开盘: {first_open:.4f}  收盘: {last_close:.4f}  涨跌幅: {(last_close / first_open - 1) * 100:+.2f}%")
+    lines.append(f"最高: {high:.4f}（{times[high_index]}）  最低: {low:.4f}（{times[low_index]}）")
+    lines.append(f"区间振幅: {(high - low) / first_open * 100:.2f}%  平均单根振幅: "
+                 f"{float(((columns.high - columns.low) / columns.open).mean()) * 100:.2f}%")
+    lines.append(f"成交量合计: {volume:.2f}  平均每根: {volume / n:.2f}")
+    lines.append(f"收盘均价: {float(columns.close.mean()):.4f}  上涨K线占比: "
+                 f"{float((columns.close > columns.open).mean()) * 100:.1f}%")
+    if n > 1:
+        returns = np.diff(np.log(columns.close))
+        lines.append(f"单根对数收益波动率: {float(returns.std()) * 100:.4f}%  "
+                     f"最大单根涨幅: {float(returns.max()) * 100:+.2f}%  最大单根跌幅: {float(returns.min()) * 100:+.2f}%")
+    return lines
+
+
+def format_crypto_data(data: dict[str, Any] | str, venue: str | None = None) -> str:
     """
     将加密货币价格数据格式化为易读文本。
     :param data: 价格数据（可以是字典或 JSON 字符串）
+    :param venue: 数据来源的交易所（可选）
     :return: 格式化后的价格信息字符串
     """
     # 如果传入的是字符串，则先转换为字典
@@ -274,15 +2225,21 @@ def format_crypto_data(data: dict[str, Any] | str) -> str:
     symbol = data.get("symbol", "未知")
     price = data.get("price", "N/A")
 
+    source = f"来源: {venue}\n" if venue else ""
     return (
         f"交易对: {symbol}\n"
         f"价格: {price} USDT\n"
+        f"{source}"
     )
 
-def format_crypto_klines(data: list | dict[str, Any] | str) -> str:
+def format_crypto_klines(data: list | dict[str, Any] | str, output_mode: str = "table",
+                         max_chars: int = 0, points: int = 100) -> str:
     """
     将加密货币K线数据格式化为易读文本。
     :param data: K线数据（可以是列表、字典或 JSON 字符串）
+    :param output_mode: 输出模式：table 表格 / csv / summary 区间汇总 / downsampled 按桶聚合为 points 根K线
+    :param max_chars: 最大输出字符数，<= 0 表示不限制；超出时保留最新的数据行
+    :param points: downsampled 模式的目标K线数量
     :return: 格式化后的K线信息字符串
     """
     # 如果传入的是字符串，则先转换为字典/列表
@@ -300,9 +2257,58 @@ def format_crypto_klines(data: list | dict[str, Any] | str) -> str:
     if not isinstance(data, list) or (len(data) > 0 and not isinstance(data[0], list)):
         return "❌ 无效的K线数据格式"
 
+    invalid = _invalid_output_mode(output_mode)
+    if invalid:
+        return invalid
+
+    if output_mode != "table":
+        if not data:
+            return "🔍 没有K线数据"
+        try:
+            columns = parse_klines(data)
+        except (IndexError, ValueError, TypeError) as e:
+            return f"⚠️ 数据解析错误: {str(e)}"
+        if output_mode == "summary":
+            return _fit_to_budget(_kline_summary_lines(columns), [], max_chars)
+        if output_mode == "downsampled":
+            # 按桶聚合为较粗粒度的K线：开盘取桶首、收盘取桶尾、最高/最低取极值、成交量求和
+            starts = np.unique(np.linspace(0, len(columns), max(1, points) + 1).astype(np.int64)[:-1])
+            ends = np.append(starts[1:], len(columns)) - 1
+            header = [f"🕰️ K线降采样（{len(columns)} 根 -> {len(starts)} 根，时间从旧到新）：\n",
+                      f"{'时间':<20} {'开盘':<10} {'最高':<10} {'最低':<10} {'收盘':<10} {'交易量'}"]
+            row_format = "%-20s %-10.4f %-10.4f %-10.4f %-10.4f %.2f"
+            times = columns.time_strings()
+            rows = [row_format % row for row in zip(
+                [times[i] for i in starts.tolist()], columns.open[starts].tolist(),
+                np.maximum.reduceat(columns.high, starts).tolist(), np.minimum.reduceat(columns.low, starts).tolist(),
+                columns.close[ends].tolist(), np.add.reduceat(columns.volume, starts).tolist()
+            )]
+            return _fit_to_budget(header, rows, max_chars)
+        header = ["open_time,open,high,low,close,volume"]
+        rows = [f"{t},{o},{h},{l},{c},{v}" for t, o, h, l, c, v in zip(
+            columns.time_strings(), columns.open.tolist(), columns.high.tolist(),
+            columns.low.tolist(), columns.close.tolist(), columns.volume.tolist()
+        )]
+        return _fit_to_budget(header, rows, max_chars)
+
     # 格式化K线数据标题
     result = ["🕰️ K线数据列表（时间从旧到新）：\n"]
     result.append(f"{'时间':<20} {'开盘':<10} {'最高':<10} {'最低':<10} {'收盘':<10} {'交易量'}")
+    rows = []
+
+    # 优先使用列式解析一次性转换全部K线；存在异常行时退回逐行解析以标出出错的行
+    if np is not None:
+        try:
+            columns = parse_klines(data)
+        except (IndexError, ValueError, TypeError):
+            columns = None
+        if columns is not None:
+            row_format = "%-20s %-10.4f %-10.4f %-10.4f %-10.4f %.2f"
+            rows.extend(row_format % row for row in zip(
+                columns.time_strings(), columns.open.tolist(), columns.high.tolist(),
+                columns.low.tolist(), columns.close.tolist(), columns.volume.tolist()
+            ))
+            return _fit_to_budget(result, rows, max_chars)
 
     # 格式化每条K线数据
     for kline in data:
@@ -319,19 +2325,41 @@ def format_crypto_klines(data: list | dict[str, Any] | str) -> str:
             time_str = datetime.datetime.fromtimestamp(timestamp / 1000).strftime('%Y-%m-%d %H:%M:%S')
 
             # 添加格式化后的K线数据行
-            result.append(
+            rows.append(
                 f"{time_str:<20} {open_price:<10.4f} {high_price:<10.4f} {low_price:<10.4f} {close_price:<10.4f} {volume:.2f}"
             )
         except (IndexError, ValueError) as e:
-            result.append(f"⚠️ 数据解析错误: {str(e)}")
+            rows.append(f"⚠️ 数据解析错误: {str(e)}")
             continue
 
-    return '\n'.join(result)
+    return _fit_to_budget(result, rows, max_chars)
+
+def _rolling_means(times, rates, windows_days) -> Any:
+    """
+    计算截至最新一条记录、最近若干天窗口内的均值（前缀和 + 二分查找，一次向量化完成）。
+    数据覆盖不到完整窗口时该窗口为 NaN。
+    :param times: 按时间升序的毫秒时间戳数组
+    :param rates: 对应的数值数组
+    :param windows_days: 窗口天数序列
+    """
+    windows = np.asarray(windows_days, dtype=np.int64) * 86_400_000
+    cutoffs = times[-1] - windows
+    starts = np.searchsorted(times, cutoffs, side="right")
+    prefix = np.concatenate(([0.0], np.cumsum(rates)))
+    counts = len(rates) - starts
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = (prefix[-1] - prefix[starts]) / counts
+    return np.where(times[0] <= cutoffs, means, np.nan)
+
 
-def format_funding_rate(data: list | dict[str, Any] | str) -> str:
+def format_funding_rate(data: list | dict[str, Any] | str, output_mode: str = "table",
+                        max_chars: int = 0, points: int = 100) -> str:
     """
     将加密货币资金费率数据格式化为易读文本。
     :param data: 资金费率数据（可以是列表、字典或 JSON 字符串）
+    :param output_mode: 输出模式：table 表格 / csv / summary 统计汇总 / downsampled LTTB 降采样到 points 个点
+    :param max_chars: 最大输出字符数，<= 0 表示不限制；超出时保留最新的数据行
+    :param points: downsampled 模式的目标点数
     :return: 格式化后的资金费率信息字符串
     """
     # 如果传入的是字符串，则先转换为字典/列表
@@ -349,9 +2377,53 @@ def format_funding_rate(data: list | dict[str, Any] | str) -> str:
     if not isinstance(data, list) or (len(data) > 0 and not isinstance(data[0], dict)):
         return "❌ 无效的资金费率数据格式"
 
+    invalid = _invalid_output_mode(output_mode)
+    if invalid:
+        return invalid
+
+    if output_mode != "table":
+        if not data:
+            return "🔍 没有资金费率数据"
+        try:
+            times = np.array([int(f.get("fundingTime", 0)) for f in data], dtype=np.int64)
+            rates = np.array([float(f.get("fundingRate", 0)) for f in data], dtype=np.float64) * 100
+        except (TypeError, ValueError) as e:
+            return f"⚠️ 数据解析错误: {str(e)}"
+        symbol = data[0].get("symbol", "未知")
+        time_strs = _local_time_strings(times)
+        if output_mode == "csv":
+            header = ["funding_time,symbol,funding_rate_pct"]
+            rows = [f"{t},{f.get('symbol', '')},{r:.6f}" for t, f, r in zip(time_strs, data, rates.tolist())]
+            return _fit_to_budget(header, rows, max_chars)
+        if output_mode == "downsampled":
+            keep = _lttb(times, rates, max(1, points))
+            header = [f"{symbol} 资金费率降采样（{len(rates)} 条 -> {len(keep)} 条，时间从旧到新）：\n",
+                      f"{'时间':<20} {'资金费率'}"]
+            rows = [f"{time_strs[i]:<20} {rates[i]:>10.4f}%" for i in keep.tolist()]
+            return _fit_to_budget(header, rows, max_chars)
+        # summary：按相邻两次结算的间隔估算每年结算次数，计算年化费率
+        interval_ms = float(np.median(np.diff(times))) if len(times) > 1 else 8 * 3_600_000
+        periods_per_year = 365 * 86_400_000 / interval_ms if interval_ms > 0 else 3 * 365
+        high_index, low_index = int(rates.argmax()), int(rates.argmin())
+        lines = [f"📊 {symbol} 资金费率汇总（{time_strs[0]} ~ {time_strs[-1]}，共 {len(rates)} 条）：\n"]
+        lines.append(f"最新: {rates[-1]:.4f}%  均值: {rates.mean():.4f}%  中位数: {np.median(rates):.4f}%")
+        lines.append(f"最高: {rates[high_index]:.4f}%（{time_strs[high_index]}）  "
+                     f"最低: {rates[low_index]:.4f}%（{time_strs[low_index]}）")
+        lines.append(f"正费率占比: {(rates > 0).mean() * 100:.1f}%  标准差: {rates.std():.4f}%")
+        lines.append(f"结算间隔: {interval_ms / 3_600_000:.1f} 小时  均值年化: {rates.mean() * periods_per_year:.2f}%")
+        rolling = [
+            f"{days}天 {mean:.4f}%（年化 {mean * periods_per_year:.2f}%）"
+            for days, mean in zip(FUNDING_ROLLING_DAYS, _rolling_means(times, rates, FUNDING_ROLLING_DAYS).tolist())
+            if np.isfinite(mean)
+        ]
+        if rolling:
+            lines.append("近期均值: " + "  ".join(rolling))
+        return _fit_to_budget(lines, [], max_chars)
+
     # 格式化资金费率数据标题
     result = ["资金费率历史数据（时间从旧到新）：\n"]
     result.append(f"{'时间':<20} {'交易对':<10} {'资金费率':<12} {'收取时间'}")
+    rows = []
 
     # 格式化每条资金费率数据
     for funding in data:
@@ -367,43 +2439,36 @@ def format_funding_rate(data: list | dict[str, Any] | str) -> str:
             next_time_str = datetime.datetime.fromtimestamp(next_funding_time / 1000).strftime('%Y-%m-%d %H:%M:%S')
 
             # 添加格式化后的资金费率数据行
-            result.append(
+            rows.append(
                 f"{time_str:<20} {symbol:<10} {funding_rate:>10.4f}%  {next_time_str}"
             )
         except (KeyError, ValueError) as e:
-            result.append(f"⚠️ 数据解析错误: {str(e)}")
+            rows.append(f"⚠️ 数据解析错误: {str(e)}")
             continue
 
-    return '\n'.join(result)
+    return _fit_to_budget(result, rows, max_chars)
 
-def format_crypto_news(data: dict[str, Any] | str) -> str:
+def format_crypto_news(data: list | dict[str, Any] | str) -> str:
     """
     将加密货币新闻数据格式化为易读文本
-    :param data: 新闻数据（字典或JSON字符串）
+    :param data: 新闻库条目列表，或包含error信息的字典
     :return: 格式化后的新闻信息字符串
     """
-    result = ["加密货币新闻摘要：\n"]
-    if not isinstance(data, dict) or "data" not in data or "arr_news" not in data.get("data", {}):
+    if isinstance(data, dict) and "error" in data:
+        return f"⚠️ {data['error']}"
+    if not isinstance(data, list):
         return "❌ 无效的新闻数据格式"
-    arr_news=data["data"]["arr_news"]
-    for i in arr_news:
-        type=i["type"]
-        if type=='newsflashes':
-            title=i["title"]
-            news_url=i["news_url"]
-            description=i["description"]
-            description = description.replace('Odaily星球日报讯', '').strip()
-            published_at=i["published_at"]
+    if not data:
+        return "没有符合条件的新闻"
+    result = [f"加密货币新闻摘要（共 {len(data)} 条）：\n"]
+    for item in data:
+        if item["type"] == 'newsflashes':
             result.append(
-                f"【快讯】标题：{title}\n简介：{description}\n发布时间：{published_at}\n源网址：{news_url}\n"
+                f"【快讯】标题：{item['title']}\n简介：{item['content']}\n发布时间：{item['published_at']}\n源网址：{item['url']}\n"
             )
-        if type=='posts':
-            title=i["title"]
-            summary=i["summary"]
-            published_at=i["published_at"]
-            link=i["link"]
+        else:
             result.append(
-                f"【文章】标题：{title}\n摘要：{summary}\n发布时间：{published_at}\n源网址：{link}\n"
+                f"【文章】标题：{item['title']}\n摘要：{item['content']}\n发布时间：{item['published_at']}\n源网址：{item['url']}\n"
             )
     return '\n'.join(result)
 
@@ -435,6 +2500,9 @@ def format_batch_crypto_data(data: list | dict[str, Any] | str) -> str:
     for item in data:
         try:
             symbol = item.get("symbol", "未知交易对")
+            if "error" in item:
+                result.append(f"交易对: {symbol}\n⚠️ {item['error']}")
+                continue
             price = item.get("price", "N/A")
             # 尝试将价格转换为浮点数以美化显示
             if price != "N/A":
@@ -466,119 +2534,575 @@ def format_news_search(data: dict[str, Any] | str) -> str:
     if not isinstance(data, dict) or "articles" not in data:
         return "❌ 无效的新闻数据格式"
 
-    # 获取新闻总数
-    total_results = data.get("totalResults", 0)
-    articles = data.get("articles", [])
-    
-    if not articles:
-        return "🔍 未找到相关新闻"
+    # 获取新闻总数
+    total_results = data.get("totalResults", 0)
+    articles = data.get("articles", [])
+    
+    if not articles:
+        return "🔍 未找到相关新闻"
+
+    # 格式化新闻数据标题
+    result = [f"📰 新闻搜索结果（共{total_results}条）:\n"]
+
+    # 格式化每条新闻
+    for i, article in enumerate(articles[:20], 1):  # 最多显示20条
+        try:
+            title = article.get("title", "无标题")
+            description = article.get("description", "无描述")
+            url = article.get("url", "")
+            published_at = article.get("publishedAt", "")
+            source = article.get("source", {}).get("name", "未知来源")
+            
+            # 格式化发布时间
+            if published_at:
+                try:
+                    pub_time = datetime.datetime.fromisoformat(published_at.replace('Z', '+00:00'))
+                    pub_str = pub_time.strftime('%Y-%m-%d %H:%M')
+                except:
+                    pub_str = published_at
+            else:
+                pub_str = "未知时间"
+
+            result.append(f"{i}.{title}")
+            result.append(f"来源: {source}")
+            result.append(f"时间: {pub_str}")
+            result.append(f"摘要: {description}")
+            if url:
+                result.append(f"链接: {url}")
+            result.append("")  # 空行分隔
+
+        except Exception as e:
+            result.append(f"⚠️ 新闻解析错误: {str(e)}")
+            continue
+
+    return '\n'.join(result)
+
+
+class ExchangeAdapter:
+    """
+    交易所适配器基类：统一 price / klines / depth / funding 四类行情接口，
+    返回与币安接口相同的数据结构（出错时返回包含 error 信息的字典），并记录每个交易所的延迟与健康状态。
+    新增交易所时继承本类、实现需要的接口，并登记到 EXCHANGE_ADAPTER_TYPES。
+    """
+
+    name = ""
+
+    def __init__(self):
+        self.latency: float | None = None  # 成功请求延迟的 EWMA（秒）
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+
+    async def price(self, symbol: str) -> dict[str, Any]:
+        raise NotImplementedError
+
+    async def klines(self, symbol: str, interval: str, limit: int) -> list | dict[str, Any]:
+        raise NotImplementedError
+
+    async def depth(self, symbol: str, limit: int) -> dict[str, Any]:
+        raise NotImplementedError
+
+    async def funding(self, symbol: str, limit: int) -> list | dict[str, Any]:
+        raise NotImplementedError
+
+    async def call(self, method: str, *args) -> Any:
+        """
+        调用一个行情接口并记录延迟与成败。
+        :param method: price / klines / depth / funding
+        :return: 接口结果；出错时返回包含 error 信息的字典
+        """
+        start = time.monotonic()
+        try:
+            result = await getattr(self, method)(*args)
+        except NotImplementedError:
+            return {"error": f"{self.name} 不支持 {method} 接口"}
+        except asyncio.CancelledError:
+            # 对冲请求中落后而被取消：已等待的时间只是本次延迟的下限，仅在它高于当前 EWMA 时计入（只会调高延迟估计）
+            elapsed = time.monotonic() - start
+            if self.latency is not None and elapsed > self.latency:
+                self._observe_latency(elapsed)
+            raise
+        except Exception as e:
+            result = {"error": f"请求失败: {str(e)}"}
+        if result is None:
+            result = {"error": "没有返回数据"}
+        if isinstance(result, dict) and "error" in result and EXCHANGE_CLIENT_ERROR_PATTERN.search(str(result["error"])):
+            self.requests += 1
+            return result
+        self.record(time.monotonic() - start, not (isinstance(result, dict) and "error" in result))
+        return result
+
+    def record(self, elapsed: float, ok: bool):
+        """记录一次请求：成功时更新延迟 EWMA，连续失败达到阈值时暂时标记为不健康"""
+        self.requests += 1
+        if ok:
+            self.consecutive_failures = 0
+            self._observe_latency(elapsed)
+            return
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= EXCHANGE_FAILURE_THRESHOLD:
+            self.unhealthy_until = time.monotonic() + EXCHANGE_COOLDOWN
+            logging.warning(f"{self.name} 连续失败 {self.consecutive_failures} 次，{EXCHANGE_COOLDOWN:g} 秒内暂停路由")
+
+    def _observe_latency(self, elapsed: float):
+        self.latency = elapsed if self.latency is None else (
+            (1 - EXCHANGE_LATENCY_ALPHA) * self.latency + EXCHANGE_LATENCY_ALPHA * elapsed)
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "healthy": self.healthy,
+        }
+
+
+class BinanceAdapter(ExchangeAdapter):
+    """币安适配器：复用现有的 fetch_* 函数（行情流、缓存、权重限流与本地库均保持不变）"""
+
+    name = "binance"
+
+    async def price(self, symbol: str) -> dict[str, Any]:
+        return await fetch_crypto_price(symbol)
+
+    async def klines(self, symbol: str, interval: str, limit: int) -> list | dict[str, Any]:
+        return await fetch_crypto_klines(symbol, interval, limit)
+
+    async def depth(self, symbol: str, limit: int) -> dict[str, Any]:
+        return await fetch_order_book(symbol, limit)
+
+    async def funding(self, symbol: str, limit: int) -> list | dict[str, Any]:
+        return await fetch_funding_rate(symbol, limit)
+
+
+class OkxAdapter(ExchangeAdapter):
+    """OKX 适配器：调用 OKX v5 公共行情接口，并把结果转换为币安接口的数据结构"""
+
+    name = "okx"
+    # 币安K线周期 -> OKX bar（6h 及以上使用按 UTC 划分的版本，与币安一致；OKX 没有 8h / 3d）
+    KLINE_BARS = {
+        '1m': '1m', '3m': '3m', '5m': '5m', '15m': '15m', '30m': '30m', '1h': '1H', '2h': '2H', '4h': '4H',
+        '6h': '6Hutc', '12h': '12Hutc', '1d': '1Dutc', '1w': '1Wutc', '1M': '1Mutc'
+    }
+
+    def __init__(self, base_url: str = OKX_API_BASE):
+        super().__init__()
+        self.base_url = base_url.rstrip("/")
+
+    @staticmethod
+    def inst_id(symbol: str, swap: bool = False) -> str | None:
+        """
+        把币安交易对转换为 OKX 产品 ID（BTCUSDT -> BTC-USDT，永续合约为 BTC-USDT-SWAP）。
+        :return: 产品 ID；无法识别计价资产时返回 None
+        """
+        symbol = _normalize_symbol(symbol)
+        for asset in sorted(QUOTE_ASSETS, key=len, reverse=True):
+            if symbol.endswith(asset) and len(symbol) > len(asset):
+                inst = f"{symbol[:-len(asset)]}-{asset}"
+                return f"{inst}-SWAP" if swap else inst
+        return None
+
+    async def _get(self, path: str, params: dict) -> list | dict[str, Any]:
+        """请求 OKX 接口，返回 data 列表；出错时返回包含 error 信息的字典"""
+        url = f"{self.base_url}{path}"
+        client = _get_http_client(url)
+        try:
+            response = await client.get(url, params=params, headers={"User-Agent": USER_AGENT}, timeout=10.0)
+            response.raise_for_status()
+            payload = response.json()
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP 错误: {e.response.status_code}"}
+        except Exception as e:
+            return {"error": f"请求失败: {str(e)}"}
+        if payload.get("code") != "0":
+            return {"error": f"OKX 错误: {payload.get('msg') or payload.get('code')}"}
+        return payload.get("data") or []
+
+    async def price(self, symbol: str) -> dict[str, Any]:
+        inst = self.inst_id(symbol)
+        if inst is None:
+            return {"error": f"无法识别交易对: {symbol}"}
+        data = await self._get("/api/v5/market/ticker", {"instId": inst})
+        if isinstance(data, dict):
+            return data
+        if not data:
+            return {"error": "交易对不存在"}
+        return {"symbol": _normalize_symbol(symbol), "price": data[0]["last"]}
+
+    async def klines(self, symbol: str, interval: str, limit: int) -> list | dict[str, Any]:
+        inst = self.inst_id(symbol)
+        if inst is None:
+            return {"error": f"无法识别交易对: {symbol}"}
+        if interval not in self.KLINE_BARS:
+            return {"error": f"OKX 不支持 {interval} 周期"}
+        # OKX 单次最多返回 300 根，按时间从新到旧排列
+        data = await self._get("/api/v5/market/candles",
+                               {"instId": inst, "bar": self.KLINE_BARS[interval], "limit": max(1, min(limit, 300))})
+        if isinstance(data, dict):
+            return data
+        return [
+            [int(row[0]), row[1], row[2], row[3], row[4], row[5], self._close_time(int(row[0]), interval), row[7], 0,
+             "0", "0", "0"]
+            for row in reversed(data)
+        ]
+
+    @staticmethod
+    def _close_time(open_time: int, interval: str) -> int:
+        """按币安的约定计算收盘时间（下一根K线开盘时间 - 1）；1M 按 UTC 自然月计算"""
+        if interval != '1M':
+            return open_time + KLINE_INTERVAL_MS[interval] - 1
+        opened = datetime.datetime.fromtimestamp(open_time / 1000, tz=datetime.timezone.utc)
+        year, month = (opened.year + 1, 1) if opened.month == 12 else (opened.year, opened.month + 1)
+        return int(datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc).timestamp() * 1000) - 1
+
+    async def depth(self, symbol: str, limit: int) -> dict[str, Any]:
+        inst = self.inst_id(symbol)
+        if inst is None:
+            return {"error": f"无法识别交易对: {symbol}"}
+        data = await self._get("/api/v5/market/books", {"instId": inst, "sz": max(1, min(limit, 400))})
+        if isinstance(data, dict):
+            return data
+        if not data:
+            return {"error": "交易对不存在"}
+        book = data[0]
+        return {
+            "symbol": _normalize_symbol(symbol),
+            "lastUpdateId": int(book.get("ts", 0)),
+            "bids": [level[:2] for level in book["bids"]],
+            "asks": [level[:2] for level in book["asks"]],
+        }
+
+    async def funding(self, symbol: str, limit: int) -> list | dict[str, Any]:
+        inst = self.inst_id(symbol, swap=True)
+        if inst is None:
+            return {"error": f"无法识别交易对: {symbol}"}
+        data = await self._get("/api/v5/public/funding-rate-history", {"instId": inst, "limit": max(1, min(limit, 100))})
+        if isinstance(data, dict):
+            return data
+        if not data:
+            return []
+        # OKX 历史记录没有下次结算时间：取后一条记录的结算时间，最新一条按最近的结算间隔（默认 8 小时）推算
+        items = list(reversed(data))
+        times = [int(item["fundingTime"]) for item in items]
+        interval = times[-1] - times[-2] if len(times) >= 2 else 8 * 3_600_000
+        next_times = times[1:] + [times[-1] + interval]
+        return [
+            {"symbol": _normalize_symbol(symbol), "fundingTime": funding_time, "fundingRate": item["fundingRate"],
+             "nextFundingTime": next_time}
+            for item, funding_time, next_time in zip(items, times, next_times)
+        ]
+
+
+EXCHANGE_ADAPTER_TYPES = {
+    "binance": BinanceAdapter,
+    "okx": OkxAdapter,
+}
+
+
+class ExchangeRouter:
+    """
+    多交易所路由：按健康状态与延迟 EWMA 排序交易所。
+    first() 先请求最快的健康交易所，超过对冲延迟未返回或返回错误时并发请求下一个，采用最先成功的结果；
+    gather() 并发请求全部交易所，用于跨交易所比价。
+    """
+
+    def __init__(self, adapters: list[ExchangeAdapter], hedge_delay: float = EXCHANGE_HEDGE_DELAY):
+        self.adapters = adapters
+        self.hedge_delay = hedge_delay
+        self.hedged = 0
+        self.fallbacks = 0
+
+    def ranked(self, exclude: tuple = ()) -> list[ExchangeAdapter]:
+        """健康的交易所在前，已有延迟数据的按延迟从低到高排序，还没有延迟数据的排在其后并保持配置顺序"""
+        candidates = [a for a in self.adapters if a.name not in exclude]
+        return sorted(candidates, key=lambda a: (not a.healthy, a.latency is None, a.latency or 0.0))
 
-    # 格式化新闻数据标题
-    result = [f"📰 新闻搜索结果（共{total_results}条）:\n"]
+    async def first(self, method: str, *args, exclude: tuple = ()) -> tuple[str | None, Any]:
+        """
+        对冲请求：返回最先成功的交易所结果。
+        :param method: price / klines / depth / funding
+        :param exclude: 不参与本次请求的交易所
+        :return: (交易所名称, 结果)；全部失败时为 (None, 包含 error 信息的字典)
+        """
+        candidates = self.ranked(exclude)
+        if not candidates:
+            return None, {"error": "没有可用的交易所"}
+        pending: dict[asyncio.Future, ExchangeAdapter] = {}
+        errors: dict[str, str] = {}
+        launched = 0
 
-    # 格式化每条新闻
-    for i, article in enumerate(articles[:20], 1):  # 最多显示20条
+        def launch():
+            nonlocal launched
+            adapter = candidates[launched]
+            launched += 1
+            pending[asyncio.ensure_future(adapter.call(method, *args))] = adapter
+
+        launch()
         try:
-            title = article.get("title", "无标题")
-            description = article.get("description", "无描述")
-            url = article.get("url", "")
-            published_at = article.get("publishedAt", "")
-            source = article.get("source", {}).get("name", "未知来源")
-            
-            # 格式化发布时间
-            if published_at:
-                try:
-                    pub_time = datetime.datetime.fromisoformat(published_at.replace('Z', '+00:00'))
-                    pub_str = pub_time.strftime('%Y-%m-%d %H:%M')
-                except:
-                    pub_str = published_at
-            else:
-                pub_str = "未知时间"
+            while pending:
+                timeout = self.hedge_delay if launched < len(candidates) else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedged += 1
+                    launch()
+                    continue
+                for task in done:
+                    adapter = pending.pop(task)
+                    result = task.result()
+                    if not (isinstance(result, dict) and "error" in result):
+                        if adapter is not candidates[0]:
+                            self.fallbacks += 1
+                        return adapter.name, result
+                    errors[adapter.name] = result["error"]
+                    if launched < len(candidates):
+                        launch()
+            detail = "；".join(f"{name}: {error}" for name, error in errors.items())
+            return None, {"error": f"所有交易所均请求失败（{detail}）"}
+        finally:
+            for task in pending:
+                task.cancel()
 
-            result.append(f"{i}.{title}")
-            result.append(f"来源: {source}")
-            result.append(f"时间: {pub_str}")
-            result.append(f"摘要: {description}")
-            if url:
-                result.append(f"链接: {url}")
-            result.append("")  # 空行分隔
+    async def gather(self, method: str, *args) -> dict[str, Any]:
+        """
+        并发请求全部交易所。
+        :return: 交易所名称 -> 结果（出错时为包含 error 信息的字典）
+        """
+        results = await asyncio.gather(*(adapter.call(method, *args) for adapter in self.adapters))
+        return {adapter.name: result for adapter, result in zip(self.adapters, results)}
 
-        except Exception as e:
-            result.append(f"⚠️ 新闻解析错误: {str(e)}")
+    def get(self, name: str) -> ExchangeAdapter | None:
+        return next((a for a in self.adapters if a.name == name), None)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "hedged": self.hedged,
+            "fallbacks": self.fallbacks,
+            "venues": {adapter.name: adapter.stats() for adapter in self.adapters},
+        }
+
+
+def _build_exchange_router(venues: list[str] = EXCHANGE_VENUES) -> ExchangeRouter:
+    """按 EXCHANGE_VENUES 创建交易所路由，忽略未知的交易所名称"""
+    adapters = []
+    for name in venues:
+        adapter_type = EXCHANGE_ADAPTER_TYPES.get(name)
+        if adapter_type is None:
+            logging.warning(f"未知的交易所: {name}，可选 {', '.join(EXCHANGE_ADAPTER_TYPES)}")
             continue
+        adapters.append(adapter_type())
+    return ExchangeRouter(adapters or [BinanceAdapter()])
 
-    return '\n'.join(result)
+
+_exchange_router = _build_exchange_router()
+
+
+async def _with_fallback(method: str, data: Any, *args) -> tuple[Any, str | None]:
+    """
+    币安请求失败时改由其它健康的交易所回答（K线 / 深度 / 资金费率仍以币安为准，其本地缓存与数据库只保存币安数据）。
+    :param data: 币安的返回结果
+    :return: (结果, 备用交易所名称)；未回退时名称为 None
+    """
+    if not (isinstance(data, dict) and "error" in data) or len(_exchange_router.adapters) < 2:
+        return data, None
+    venue, fallback = await _exchange_router.first(method, *args, exclude=("binance",))
+    if venue is None:
+        return data, None
+    logging.warning(f"币安 {method} 请求失败（{data['error']}），改用 {venue} 的数据")
+    return fallback, venue
+
+
+def _fallback_note(venue: str | None) -> str:
+    return f"⚠️ 币安接口不可用，以下数据来自 {venue}\n" if venue else ""
 
 
 @mcp.tool()
 async def query_crypto_price(symbol: str) -> str:
     """
     输入加密货币交易对（如 BTCUSDT），返回当前价格信息。
+    按延迟自动选择最快的健康交易所，首选交易所响应慢或出错时自动改用其它交易所。
     :param symbol: 交易对符号（需使用大写，如 BTCUSDT）
     :return: 格式化后的价格信息
     """
     logging.info(f"调用 query_crypto_price 工具，交易对: {symbol}")
-    data = await fetch_crypto_price(symbol)
-    return format_crypto_data(data)
+    venue, data = await _exchange_router.first("price", symbol)
+    return format_crypto_data(data, venue)
+
+
+def format_cross_exchange_prices(symbol: str, results: dict[str, Any], router: ExchangeRouter) -> str:
+    """
+    将跨交易所价格格式化为文本，附带相对中位数的偏离与最大价差。
+    :param results: 交易所名称 -> 价格数据或包含 error 信息的字典
+    """
+    result = [f"🌐 {_normalize_symbol(symbol)} 跨交易所价格：\n"]
+    prices = {}
+    for name, data in results.items():
+        if isinstance(data, dict) and "error" not in data:
+            try:
+                prices[name] = float(data["price"])
+            except (KeyError, TypeError, ValueError):
+                pass
+    median = float(np.median(list(prices.values()))) if prices and np is not None else None
+    for name, data in results.items():
+        adapter = router.get(name)
+        latency = f"{adapter.latency * 1000:.0f}ms" if adapter is not None and adapter.latency is not None else "-"
+        if name in prices:
+            deviation = f"{(prices[name] / median - 1) * 10_000:+.1f} bp" if median else "-"
+            result.append(f"{name}: {data['price']}（相对中位数 {deviation}，平均延迟 {latency}）")
+        else:
+            error = data.get("error", "未知错误") if isinstance(data, dict) else "未知错误"
+            result.append(f"{name}: ⚠️ {error}")
+    if len(prices) >= 2:
+        high_name = max(prices, key=prices.get)
+        low_name = min(prices, key=prices.get)
+        spread = (prices[high_name] / prices[low_name] - 1) * 10_000
+        result.append(f"\n最大价差: {spread:.1f} bp（{high_name} 最高，{low_name} 最低）")
+    return '\n'.join(result)
+
+
+@mcp.tool()
+async def query_cross_exchange_price(symbol: str) -> str:
+    """
+    并发查询所有已启用交易所（EXCHANGE_VENUES，如币安、OKX）的同一交易对价格，返回各交易所价格、延迟与最大价差。
+    :param symbol: 交易对符号（需使用大写，如 BTCUSDT）
+    :return: 格式化后的跨交易所价格
+    """
+    logging.info(f"调用 query_cross_exchange_price 工具，交易对: {symbol}")
+    results = await _exchange_router.gather("price", symbol)
+    return format_cross_exchange_prices(symbol, results, _exchange_router)
 
 @mcp.tool()
-async def query_crypto_klines(symbol: str, interval: str, limit: int = 100) -> str:
+async def query_crypto_klines(symbol: str, interval: str, limit: int = 100, start_time: str = None, end_time: str = None,
+                              output_mode: str = "table", points: int = 100, max_chars: int = OUTPUT_MAX_CHARS) -> str:
     """
     输入加密货币交易对、时间周期和K线数量，返回过往K线数据。
+    指定开始或结束时间时从本地K线库读取任意区间（缺失部分自动从币安补齐）。
+    数据量较大时建议使用 summary 或 downsampled 输出模式。
     :param symbol: 交易对符号（需使用大写，如 BTCUSDT）
     :param interval: 时间周期（如 1m, 5m, 1h, 1d）
-    :param limit: 获取K线数量（1-1000，默认100）
+    :param limit: 获取K线数量（1-1000，默认100；指定时间区间时最多10000）
+    :param start_time: 开始时间（可选，如 "2024-01-01" 或 "2024-01-01 08:00"，也可为毫秒时间戳）
+    :param end_time: 结束时间（可选，格式同上，默认当前时间）
+    :param output_mode: 输出模式（table 表格 / csv / summary 区间汇总 / downsampled 聚合为 points 根K线，默认 table）
+    :param points: downsampled 模式的目标K线数量（默认100）
+    :param max_chars: 最大输出字符数（默认8000，超出时省略较早的数据行）
     :return: 格式化后的K线信息
     """
-    logging.info(f"调用 query_crypto_klines 工具，交易对: {symbol}, 周期: {interval}, 数量: {limit}")
-    data = await fetch_crypto_klines(symbol, interval, limit)
-    return format_crypto_klines(data)
+    logging.info(f"调用 query_crypto_klines 工具，交易对: {symbol}, 周期: {interval}, 数量: {limit}, "
+                 f"开始: {start_time}, 结束: {end_time}, 输出模式: {output_mode}")
+    if start_time or end_time:
+        data = await fetch_kline_range(symbol, interval, start_time, end_time, limit)
+        venue = None
+    else:
+        data = await fetch_crypto_klines(symbol, interval, limit)
+        data, venue = await _with_fallback("klines", data, symbol, interval, limit)
+    return _fallback_note(venue) + format_crypto_klines(data, output_mode, max_chars, points)
 
 @mcp.tool()
-async def query_crypto_news(length: int = 0) -> str:
+async def query_crypto_news(length: int = 0, news_type: str = None, since: str = None, keyword: str = None,
+                            limit: int = 50) -> str:
     """
-    通过Odaily的权威加密货币新闻源查询加密货币相关新闻
+    通过Odaily的权威加密货币新闻源查询加密货币相关新闻（从后台轮询维护的本地新闻库读取）
     :param length: 0 表示今天的新闻，1 表示昨天的新闻，默认 0
+    :param news_type: newsflashes（快讯）或 posts（文章），默认全部
+    :param since: 只返回该时间之后发布的新闻（时间戳或本地时间字符串，如 2024-01-01 08:00）
+    :param keyword: 标题或内容包含的关键词（不区分大小写）
+    :param limit: 最多返回条数，默认 50，最大 200
     :return: 格式化后的新闻信息
     """
-    logging.info(f"调用 query_crypto_news 工具，length: {length}")
-    data = await fetch_crypto_news(length)
+    logging.info(f"调用 query_crypto_news 工具，length: {length}, news_type: {news_type}, since: {since}, keyword: {keyword}")
+    data = await query_news_store(length, news_type, since, keyword, limit)
     return format_crypto_news(data)
 
-async def fetch_order_book(symbol: str, limit: int = 100) -> dict[str, Any] | None:
+@single_flight
+async def fetch_order_book(symbol: str, limit: int = 100, use_local_book: bool = True) -> dict[str, Any] | None:
     """
     从币安 API 获取加密货币市场深度数据。
     :param symbol: 交易对符号（如 BTCUSDT）
     :param limit: 获取订单数量（默认100，最大值5000）
+    :param use_local_book: 行情流开启时优先读取本地订单簿（同步快照时需设为 False）
     :return: 市场深度数据字典；若出错返回包含 error 信息的字典
     """
-    logging.info(f"开始获取 {symbol} 市场深度数据，limit: {limit}")
     # 验证limit参数有效性
     limit = max(1, min(limit, 5000))
+    symbol = _normalize_symbol(symbol)
+    if not SYMBOL_PATTERN.match(symbol):
+        return {"error": f"无效的交易对: {symbol}"}
+    # 本地订单簿已同步时零网络开销返回，否则本次回退到 REST，REST 成功后再开始维护该交易对
+    track = use_local_book and _order_books is not None
+    if track:
+        book = _order_books.get(symbol)
+        if book is not None:
+            return book.to_depth(limit)
+
+    # 请求权重不足时先降级深度档位，避免大档位请求触发限流
+    affordable = _affordable_depth_limit(BINANCE_DEPTH_API, limit)
+    if affordable < limit:
+        logging.warning(f"{symbol} 请求权重不足，市场深度 limit 从 {limit} 降级为 {affordable}")
+        limit = affordable
+
+    cache_key = ("depth", symbol, limit)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        logging.info(f"{symbol} 市场深度命中缓存")
+        if track:
+            _order_books.track(symbol)
+        return cached
+
+    logging.info(f"开始获取 {symbol} 市场深度数据，limit: {limit}")
     params = {
         "symbol": symbol,
         "limit": limit
     }
     headers = {"User-Agent": USER_AGENT}
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(BINANCE_DEPTH_API, params=params, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            logging.info(f"成功获取 {symbol} 市场深度数据")
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            logging.error(f"{symbol} 市场深度获取失败: HTTP {e.response.status_code}")
-            return {"error": f"HTTP 错误: {e.response.status_code}"}
-        except Exception as e:
-            logging.error(f"{symbol} 市场深度获取失败: {str(e)}")
-            return {"error": f"请求失败: {str(e)}"}
+    try:
+        response = await _binance_get(BINANCE_DEPTH_API, params=params, headers=headers, timeout=30.0)
+        response.raise_for_status()
+        logging.info(f"成功获取 {symbol} 市场深度数据")
+        data = response.json()
+        _response_cache.set(cache_key, data, CACHE_TTL["depth"])
+        if track:
+            _order_books.track(symbol)
+        return data
+    except httpx.HTTPStatusError as e:
+        logging.error(f"{symbol} 市场深度获取失败: HTTP {e.response.status_code}")
+        return {"error": f"HTTP 错误: {e.response.status_code}"}
+    except Exception as e:
+        logging.error(f"{symbol} 市场深度获取失败: {str(e)}")
+        return {"error": f"请求失败: {str(e)}"}
+
+
+def _order_book_stats_lines(book: OrderBook, band_pct: float) -> list[str]:
+    """盘口统计：中间价、价差、±band_pct% 累计深度与买卖不平衡度"""
+    mid = book.mid_price()
+    if mid is None:
+        return []
+    spread = book.spread()
+    depth = book.depth_within(band_pct)
+    return [
+        f"\n盘口统计 (中间价 ±{band_pct}%, 基于 {len(book.bids)} 档买单 / {len(book.asks)} 档卖单):\n",
+        f"中间价: {mid:.8f}  价差: {spread:.8f} ({spread / mid * 10000:.2f} bps)",
+        f"买盘累计: {depth['bid_qty']:.8f} ({depth['bid_notional']:.2f} USDT)",
+        f"卖盘累计: {depth['ask_qty']:.8f} ({depth['ask_notional']:.2f} USDT)",
+        f"买卖不平衡度: {book.imbalance(band_pct):+.4f}"
+    ]
 
 
-def format_order_book(data: dict[str, Any] | str) -> str:
+def format_order_book(data: dict[str, Any] | str, band_pct: float = 1.0, output_mode: str = "table",
+                      max_chars: int = 0, points: int = 20) -> str:
     """
     将加密货币市场深度数据格式化为易读文本。
     :param data: 市场深度数据（可以是字典或 JSON 字符串）
+    :param band_pct: 统计累计深度与买卖不平衡度的价格范围（中间价 ±band_pct%）
+    :param output_mode: 输出模式：table 前5档 + 统计 / csv 全部档位 / summary 仅统计 / downsampled 每侧聚合为 points 个价格区间
+    :param max_chars: 最大输出字符数，<= 0 表示不限制；超出时保留最优的档位
+    :param points: downsampled 模式每侧的价格区间数量
     :return: 格式化后的市场深度信息字符串
     """
     # 如果传入的是字符串，则先转换为字典
@@ -596,10 +3120,46 @@ def format_order_book(data: dict[str, Any] | str) -> str:
     if not isinstance(data, dict) or "asks" not in data or "bids" not in data:
         return "❌ 无效的市场深度数据格式"
 
+    invalid = _invalid_output_mode(output_mode, needs_numpy=False)
+    if invalid:
+        return invalid
+
     # 提取基本信息
     symbol = data.get("symbol", "未知")
     last_update_id = data.get("lastUpdateId", "N/A")
     result = [f"{symbol} 市场深度 (lastUpdateId: {last_update_id})\n"]
+
+    if output_mode != "table":
+        try:
+            book = OrderBook.from_depth(data)
+        except (TypeError, ValueError) as e:
+            return f"⚠️ 数据解析错误: {str(e)}"
+        asks, bids = book.asks.top(len(book.asks)), book.bids.top(len(book.bids))
+        if output_mode == "summary":
+            best = [f"买一: {bids[0][0]:.8f} × {bids[0][1]:.8f}" if bids else "买一: 无",
+                    f"卖一: {asks[0][0]:.8f} × {asks[0][1]:.8f}" if asks else "卖一: 无"]
+            return _fit_to_budget(result + best + _order_book_stats_lines(book, band_pct), [], max_chars)
+        if output_mode == "csv":
+            # 卖单与买单按档位交错排列，截断时两侧都保留最优的档位
+            rows = []
+            for level in range(max(len(asks), len(bids))):
+                for side, levels in (("ask", asks), ("bid", bids)):
+                    if level < len(levels):
+                        rows.append(f"{side},{levels[level][0]},{levels[level][1]}")
+            return _fit_to_budget(["side,price,quantity"], rows, max_chars, keep_tail=False)
+        # downsampled：按档位顺序把每侧切分为 points 个区间，汇总数量与金额
+        rows = []
+        for name, levels in (("卖单", asks), ("买单", bids)):
+            rows.append(f"\n{name}（{len(levels)} 档 -> 最多 {max(1, points)} 个区间）:")
+            rows.append(f"{'价格区间(USDT)':<36} {'数量':<20} {'总额(USDT)'}")
+            size = max(1, -(-len(levels) // max(1, points)))
+            for i in range(0, len(levels), size):
+                chunk = levels[i:i + size]
+                qty = sum(q for _, q in chunk)
+                notional = sum(p * q for p, q in chunk)
+                price_range = f"{chunk[0][0]:.8f} ~ {chunk[-1][0]:.8f}"
+                rows.append(f"{price_range:<36} {qty:<20.8f} {notional:.2f}")
+        return _fit_to_budget(result + _order_book_stats_lines(book, band_pct), rows, max_chars, keep_tail=False)
     result.append("\n卖单 (Asks):\n")
     result.append(f"{'价格(USDT)':<15} {'数量':<20} {'总额(USDT)'}\n")
 
@@ -621,28 +3181,43 @@ def format_order_book(data: dict[str, Any] | str) -> str:
         total = price * quantity
         result.append(f"{price:<15.8f} {quantity:<20.8f} {total:.2f}")
 
-    return '\n'.join(result)
+    # 基于返回的全部档位计算盘口统计
+    try:
+        book = OrderBook.from_depth(data)
+    except (TypeError, ValueError) as e:
+        result.append(f"\n⚠️ 盘口统计计算失败: {str(e)}")
+        return _fit_to_budget(result, [], max_chars)
+    result.extend(_order_book_stats_lines(book, band_pct))
+
+    return _fit_to_budget(result, [], max_chars)
 
 
 @mcp.tool()
-async def query_order_book(symbol: str, limit: int = 100) -> str:
+async def query_order_book(symbol: str, limit: int = 100, band_pct: float = 1.0, output_mode: str = "table",
+                           points: int = 20, max_chars: int = OUTPUT_MAX_CHARS) -> str:
     """
-    查询加密货币市场深度数据（订单簿）。
+    查询加密货币市场深度数据（订单簿），附带价差、中间价、累计深度和买卖不平衡度。
     :param symbol: 交易对符号（需使用大写，如 BTCUSDT）
     :param limit: 获取订单数量（1-5000，默认100）
+    :param band_pct: 累计深度统计范围，中间价上下的百分比（默认1.0，即 ±1%）
+    :param output_mode: 输出模式（table 前5档+统计 / csv 全部档位 / summary 仅统计 / downsampled 每侧聚合为 points 个价格区间，默认 table）
+    :param points: downsampled 模式每侧的价格区间数量（默认20）
+    :param max_chars: 最大输出字符数（默认8000，超出时省略较差的档位）
     :return: 格式化后的市场深度信息
     """
-    logging.info(f"调用 query_order_book 工具，交易对: {symbol}, 订单数量: {limit}")
+    logging.info(f"调用 query_order_book 工具，交易对: {symbol}, 订单数量: {limit}, 统计范围: ±{band_pct}%, "
+                 f"输出模式: {output_mode}")
     data = await fetch_order_book(symbol, limit)
-    return format_order_book(data)
+    data, venue = await _with_fallback("depth", data, symbol, limit)
+    return _fallback_note(venue) + format_order_book(data, band_pct, output_mode, max_chars, points)
 
 
 @mcp.tool()
 async def query_batch_crypto_prices(symbols: list) -> str:
     
     """
-    批量查询多个加密货币的当前价格。
-    :param symbols: 交易对符号列表（需使用大写，如 ["BTCUSDT", "ETHUSDT"]）
+    批量查询多个加密货币的当前价格。查询多个币种时请优先使用本工具，而不是多次调用 query_crypto_price。
+    :param symbols: 交易对符号列表（如 ["BTCUSDT", "ETHUSDT"]，数量不限）
     :return: 格式化后的批量价格信息
     """
     logging.info(f"调用 query_batch_crypto_prices 工具，交易对列表: {symbols}")
@@ -650,17 +3225,22 @@ async def query_batch_crypto_prices(symbols: list) -> str:
     return format_batch_crypto_data(data)
 
 @mcp.tool()
-async def query_funding_rate(symbol: str, limit: int = 10) -> str:
+async def query_funding_rate(symbol: str, limit: int = 10, output_mode: str = "table", points: int = 100,
+                             max_chars: int = OUTPUT_MAX_CHARS) -> str:
     
     """
     输入加密货币交易对，返回过往资金费率数据。
     :param symbol: 交易对符号（需使用大写永续合约符号，如 BTCUSDT）
     :param limit: 获取记录数量（1-1000，默认10）
+    :param output_mode: 输出模式（table 表格 / csv / summary 统计汇总 / downsampled 降采样到 points 个点，默认 table）
+    :param points: downsampled 模式的目标点数（默认100）
+    :param max_chars: 最大输出字符数（默认8000，超出时省略较早的数据行）
     :return: 格式化后的资金费率信息
     """
-    logging.info(f"调用 query_funding_rate 工具，交易对: {symbol}, 数量: {limit}")
+    logging.info(f"调用 query_funding_rate 工具，交易对: {symbol}, 数量: {limit}, 输出模式: {output_mode}")
     data = await fetch_funding_rate(symbol, limit)
-    return format_funding_rate(data)
+    data, venue = await _with_fallback("funding", data, symbol, limit)
+    return _fallback_note(venue) + format_funding_rate(data, output_mode, max_chars, points)
 
 @mcp.tool()
 async def query_crypto_news_search(query: str, api_key: str = None, language: str = "zh", page_size: int = 10, sort_by: str = "publishedAt") -> str:
@@ -681,6 +3261,911 @@ async def query_crypto_news_search(query: str, api_key: str = None, language: st
     data = await fetch_news_search(query, api_key, language, page_size, sort_by)
     return format_news_search(data)
 
+
+def _ewm(values, alpha: float, seed: float | None = None):
+    """
+    向量化的指数加权平均：y[i] = (1 - alpha) * y[i-1] + alpha * x[i]。
+    按块使用闭式解计算，块长度保证 (1 - alpha) 的负幂不会溢出。
+    :param values: 输入序列
+    :param alpha: 平滑系数
+    :param seed: y[-1] 的初始值，默认取 values[0]（即 y[0] = x[0]）
+    """
+    out = np.empty_like(values)
+    if len(values) == 0:
+        return out
+    decay = 1.0 - alpha
+    previous = values[0] if seed is None else seed
+    if decay <= 0:
+        out[:] = values
+        return out
+    chunk = max(1, int(600 / -np.log(decay)))
+    for start in range(0, len(values), chunk):
+        x = values[start:start + chunk]
+        steps = np.arange(len(x))
+        weights = decay ** -steps
+        out[start:start + len(x)] = decay ** (steps + 1) * previous + alpha * decay ** steps * np.cumsum(x * weights)
+        previous = out[start + len(x) - 1]
+    return out
+
+
+def _sma(values, period: int):
+    """简单移动平均，返回长度为 len(values) - period + 1 的序列"""
+    sums = np.cumsum(np.insert(values, 0, 0.0))
+    return (sums[period:] - sums[:-period]) / period
+
+
+def _rma(values, period: int):
+    """Wilder 平滑（以前 period 个值的均值为种子），返回从第 period 个值开始的序列"""
+    seed = values[:period].mean()
+    return np.concatenate(([seed], _ewm(values[period:], 1.0 / period, seed)))
+
+
+def compute_indicators(columns: KlineColumns) -> dict[str, Any]:
+    """
+    基于K线列数组计算常用技术指标的最新值。
+    数据不足以计算某项指标时，该项为 None。
+    :param columns: parse_klines 返回的列式K线
+    :return: 指标名到最新值的字典
+    """
+    close, high, low, volume = columns.close, columns.high, columns.low, columns.volume
+    n = len(close)
+    result: dict[str, Any] = {"count": n, "close": float(close[-1]) if n else None}
+
+    for period in (20, 50, 200):
+        result[f"sma{period}"] = float(_sma(close, period)[-1]) if n >= period else None
+    for span in (12, 26):
+        result[f"ema{span}"] = float(_ewm(close, 2.0 / (span + 1))[-1]) if n >= span else None
+
+    # RSI(14)，Wilder 平滑
+    result["rsi14"] = None
+    if n > 14:
+        delta = np.diff(close)
+        avg_gain = _rma(np.clip(delta, 0, None), 14)[-1]
+        avg_loss = _rma(np.clip(-delta, 0, None), 14)[-1]
+        result["rsi14"] = 100.0 if avg_loss == 0 else float(100 - 100 / (1 + avg_gain / avg_loss))
+
+    # MACD(12, 26, 9)
+    result["macd"] = result["macd_signal"] = result["macd_hist"] = None
+    if n >= 26:
+        macd = _ewm(close, 2 / 13) - _ewm(close, 2 / 27)
+        signal = _ewm(macd, 2 / 10)
+        result["macd"], result["macd_signal"] = float(macd[-1]), float(signal[-1])
+        result["macd_hist"] = float(macd[-1] - signal[-1])
+
+    # 布林带(20, 2)
+    result["boll_upper"] = result["boll_mid"] = result["boll_lower"] = None
+    if n >= 20:
+        window = close[-20:]
+        mid, std = float(window.mean()), float(window.std())
+        result["boll_upper"], result["boll_mid"], result["boll_lower"] = mid + 2 * std, mid, mid - 2 * std
+
+    # ATR(14)
+    result["atr14"] = None
+    if n > 14:
+        previous_close = close[:-1]
+        true_range = np.maximum.reduce([
+            high[1:] - low[1:],
+            np.abs(high[1:] - previous_close),
+            np.abs(low[1:] - previous_close)
+        ])
+        result["atr14"] = float(_rma(true_range, 14)[-1])
+
+    # 区间 VWAP（典型价格按成交量加权）
+    total_volume = volume.sum()
+    result["vwap"] = float(((high + low + close) / 3 * volume).sum() / total_volume) if total_volume else None
+    return result
+
+
+def format_indicators(symbol: str, interval: str, data: dict[str, Any]) -> str:
+    """
+    将技术指标结果格式化为简短摘要。
+    :param symbol: 交易对符号
+    :param interval: 时间周期
+    :param data: compute_indicators 的返回值或包含 error 信息的字典
+    :return: 格式化后的指标摘要字符串
+    """
+    if "error" in data:
+        return f"⚠️ {data['error']}"
+
+    def fmt(value, digits: int = 4) -> str:
+        return "数据不足" if value is None else f"{value:.{digits}f}"
+
+    close = data["close"]
+    result = [f"📈 {symbol} {interval} 技术指标（基于 {data['count']} 根K线）：\n"]
+    result.append(f"最新收盘: {fmt(close)}")
+    result.append(f"SMA20/50/200: {fmt(data['sma20'])} / {fmt(data['sma50'])} / {fmt(data['sma200'])}")
+    result.append(f"EMA12/26: {fmt(data['ema12'])} / {fmt(data['ema26'])}")
+
+    rsi = data["rsi14"]
+    rsi_note = "" if rsi is None else ("（超买）" if rsi >= 70 else "（超卖）" if rsi <= 30 else "")
+    result.append(f"RSI14: {fmt(rsi, 2)}{rsi_note}")
+    result.append(f"MACD: {fmt(data['macd'])}  信号线: {fmt(data['macd_signal'])}  柱: {fmt(data['macd_hist'])}")
+
+    upper, lower = data["boll_upper"], data["boll_lower"]
+    result.append(f"布林带(20,2): 上 {fmt(upper)} / 中 {fmt(data['boll_mid'])} / 下 {fmt(lower)}")
+    if upper is not None and upper != lower:
+        result.append(f"布林带位置 %B: {(close - lower) / (upper - lower):.2f}")
+
+    atr = data["atr14"]
+    atr_pct = f"（{atr / close * 100:.2f}%）" if atr is not None and close else ""
+    result.append(f"ATR14: {fmt(atr)}{atr_pct}")
+    result.append(f"VWAP: {fmt(data['vwap'])}")
+    return '\n'.join(result)
+
+
+@mcp.tool()
+async def query_crypto_indicators(symbol: str, interval: str, limit: int = 500, start_time: str = None, end_time: str = None) -> str:
+    """
+    计算加密货币的常用技术指标（SMA/EMA/RSI/MACD/布林带/ATR/VWAP），只返回最新值摘要。
+    :param symbol: 交易对符号（需使用大写，如 BTCUSDT）
+    :param interval: 时间周期（如 1m, 5m, 1h, 1d）
+    :param limit: 参与计算的K线数量（默认500，不指定时间区间时最多1000）
+    :param start_time: 开始时间（可选，如 "2024-01-01"）
+    :param end_time: 结束时间（可选，默认当前时间）
+    :return: 格式化后的技术指标摘要
+    """
+    logging.info(f"调用 query_crypto_indicators 工具，交易对: {symbol}, 周期: {interval}, 数量: {limit}")
+    if np is None:
+        return "❌ 未安装 numpy，无法计算技术指标"
+    if start_time or end_time:
+        data = await fetch_kline_range(symbol, interval, start_time, end_time, limit)
+    else:
+        data = await fetch_crypto_klines(symbol, interval, limit)
+    if isinstance(data, dict):
+        return format_indicators(symbol, interval, data)
+    if not data:
+        return format_indicators(symbol, interval, {"error": "没有可用的K线数据"})
+    try:
+        indicators = compute_indicators(parse_klines(data))
+    except (IndexError, ValueError, TypeError) as e:
+        indicators = {"error": f"K线数据解析错误: {str(e)}"}
+    return format_indicators(_normalize_symbol(symbol), interval, indicators)
+
+def _quote_assets(symbols) -> Any:
+    """按 QUOTE_ASSETS 后缀（较长的优先）向量化识别交易对的计价资产，无法识别时为空字符串"""
+    quote = np.full(len(symbols), "", dtype="<U8")
+    for asset in sorted(QUOTE_ASSETS, key=len, reverse=True):
+        quote[(quote == "") & np.char.endswith(symbols, asset)] = asset
+    return quote
+
+
+def _top_n(values, mask, top_n: int, descending: bool = True) -> tuple[Any, int]:
+    """
+    在满足 mask 的行中按 values 取前 top_n 行：argpartition 选出候选后只对这 top_n 行排序。
+    :return: (排序后的行号数组, 满足条件的行数)
+    """
+    candidates = np.flatnonzero(mask)
+    keys = values[candidates].astype(np.float64)
+    if descending:
+        keys = -keys
+    if top_n < len(candidates):
+        selected = np.argpartition(keys, top_n - 1)[:top_n]
+    else:
+        selected = np.arange(len(candidates))
+    order = selected[np.argsort(keys[selected], kind="stable")]
+    return candidates[order], len(candidates)
+
+
+class MarketSnapshot:
+    """
+    全市场 24 小时行情的列式索引：一次遍历把 /ticker/24hr 结果解析为连续的 NumPy 列数组，
+    筛选用布尔掩码、排序用 argpartition，扫描只需一次向量化运算。
+    """
+
+    FIELDS = ("lastPrice", "priceChangePercent", "highPrice", "lowPrice", "bidPrice", "askPrice",
+              "volume", "quoteVolume", "count")
+
+    def __init__(self, tickers: list):
+        """
+        :param tickers: 币安 /api/v3/ticker/24hr 返回的全部交易对数据
+        :raises ValueError / KeyError / TypeError: 数据格式不正确
+        """
+        width = len(self.FIELDS)
+        table = np.fromiter((float(t[field]) for t in tickers for field in self.FIELDS), dtype=np.float64,
+                            count=len(tickers) * width).reshape(-1, width)
+        self.symbols = np.array([t["symbol"] for t in tickers], dtype=str)
+        self.last_price_text = [t["lastPrice"] for t in tickers]
+        self.price = table[:, 0]
+        self.change_pct = table[:, 1]
+        self.high = table[:, 2]
+        self.low = table[:, 3]
+        self.bid = table[:, 4]
+        self.ask = table[:, 5]
+        self.volume = table[:, 6]
+        self.quote_volume = table[:, 7]
+        self.trades = table[:, 8].astype(np.int64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mid = (self.bid + self.ask) / 2
+            quoted = (self.bid > 0) & (self.ask > 0)
+            self.spread_pct = np.where(quoted, (self.ask - self.bid) / mid * 100, np.nan)
+            self.range_pct = np.where(self.low > 0, (self.high - self.low) / self.low * 100, 0.0)
+        self.quote = _quote_assets(self.symbols)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def scan(self, sort_by: str, top_n: int, quote_asset: str | None = None, min_quote_volume: float = 0.0,
+             max_spread_pct: float | None = None) -> tuple[Any, int]:
+        """
+        筛选并排序交易对。
+        :param sort_by: SCAN_SORTS 中的排序方式
+        :param top_n: 返回的交易对数量
+        :param quote_asset: 计价资产，None 表示不过滤
+        :param min_quote_volume: 最低 24 小时成交额
+        :param max_spread_pct: 最大买卖价差（%），None 表示不过滤；没有报价的交易对会被排除
+        :return: (排序后的行号数组, 满足条件的交易对数量)
+        """
+        mask = self.trades > 0  # 排除已下架 / 暂停交易的交易对
+        if quote_asset:
+            mask &= self.quote == quote_asset
+        if min_quote_volume:
+            mask &= self.quote_volume >= min_quote_volume
+        if max_spread_pct is not None:
+            mask &= self.spread_pct <= max_spread_pct
+        column, descending = SCAN_SORTS[sort_by]
+        return _top_n(getattr(self, column), mask, top_n, descending)
+
+
+@single_flight
+async def fetch_market_snapshot() -> MarketSnapshot | dict[str, Any]:
+    """
+    从币安 API 一次性获取全市场交易对的 24 小时行情并建立列式索引。
+    快照在 MARKET_SNAPSHOT_TTL 秒内复用，期间的扫描不再访问上游。
+    :return: MarketSnapshot；若出错返回包含 error 信息的字典
+    """
+    cache_key = ("market_snapshot",)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    logging.info("开始获取全市场 24 小时行情快照")
+    headers = {"User-Agent": USER_AGENT}
+
+    try:
+        response = await _binance_get(BINANCE_TICKER_24HR_API, headers=headers, timeout=30.0)
+        response.raise_for_status()
+        snapshot = await asyncio.to_thread(MarketSnapshot, response.json())
+        logging.info(f"成功获取全市场 24 小时行情快照，共 {len(snapshot)} 个交易对")
+        _response_cache.set(cache_key, snapshot, CACHE_TTL["market_snapshot"])
+        return snapshot
+    except httpx.HTTPStatusError as e:
+        return {"error": f"HTTP 错误: {e.response.status_code}"}
+    except (KeyError, ValueError, TypeError) as e:
+        return {"error": f"24 小时行情数据解析错误: {str(e)}"}
+    except Exception as e:
+        return {"error": f"请求失败: {str(e)}"}
+
+
+def format_market_scan(data: MarketSnapshot | dict[str, Any], sort_by: str, top_n: int,
+                       quote_asset: str | None = None, min_quote_volume: float = 0.0,
+                       max_spread_pct: float | None = None) -> str:
+    """
+    将市场扫描结果格式化为表格。
+    :param data: 全市场行情快照，或包含 error 信息的字典
+    :return: 格式化后的扫描结果
+    """
+    if isinstance(data, dict) and "error" in data:
+        return f"⚠️ {data['error']}"
+    rows, matched = data.scan(sort_by, top_n, quote_asset, min_quote_volume, max_spread_pct)
+    titles = {"gainers": "涨幅榜", "losers": "跌幅榜", "volume": "成交额榜", "trades": "成交笔数榜", "volatility": "振幅榜"}
+    conditions = [f"{quote_asset} 计价" if quote_asset else "全部计价资产"]
+    if min_quote_volume:
+        conditions.append(f"成交额 ≥ {min_quote_volume:,.0f}")
+    if max_spread_pct is not None:
+        conditions.append(f"价差 ≤ {max_spread_pct}%")
+    result = [f"📊 市场扫描 - {titles[sort_by]}（{'，'.join(conditions)}，{matched}/{len(data)} 个交易对满足条件）\n"]
+    if not len(rows):
+        result.append("没有满足条件的交易对")
+        return '\n'.join(result)
+    result.append("排名 | 交易对 | 最新价 | 24h涨跌幅 | 24h成交额 | 振幅 | 价差 | 成交笔数")
+    for rank, i in enumerate(rows.tolist(), 1):
+        spread = data.spread_pct[i]
+        spread_text = "-" if np.isnan(spread) else f"{spread:.3f}%"
+        result.append(
+            f"{rank} | {data.symbols[i]} | {float(data.last_price_text[i]):.8g} | {data.change_pct[i]:+.2f}% | "
+            f"{data.quote_volume[i]:,.0f} {data.quote[i]} | {data.range_pct[i]:.2f}% | {spread_text} | {data.trades[i]}"
+        )
+    return '\n'.join(result)
+
+
+@mcp.tool()
+async def query_market_scanner(sort_by: str = "gainers", top_n: int = 20, quote_asset: str = "USDT",
+                               min_quote_volume: float = 0, max_spread_pct: float = None) -> str:
+    """
+    全市场扫描：一次请求获取币安全部交易对的 24 小时行情并筛选排序。
+    回答「今天涨得最多 / 成交最活跃的币」等问题时请使用本工具，而不是多次调用 query_crypto_price。
+    :param sort_by: gainers（涨幅榜）、losers（跌幅榜）、volume（成交额）、trades（成交笔数）、volatility（振幅），默认 gainers
+    :param top_n: 返回前 N 个交易对，默认 20，最大 100
+    :param quote_asset: 计价资产过滤（如 USDT、BTC、FDUSD），传空字符串表示不过滤，默认 USDT
+    :param min_quote_volume: 最低 24 小时成交额（以计价资产计），用于排除流动性差的交易对
+    :param max_spread_pct: 最大买卖价差（%），不传表示不过滤
+    :return: 格式化后的扫描结果
+    """
+    logging.info(f"调用 query_market_scanner 工具，排序: {sort_by}, 数量: {top_n}, 计价资产: {quote_asset}")
+    if np is None:
+        return "❌ 未安装 numpy，无法使用市场扫描"
+    if sort_by not in SCAN_SORTS:
+        return f"❌ 无效的排序方式，请使用: {', '.join(SCAN_SORTS)}"
+    top_n = max(1, min(int(top_n), SCAN_MAX_TOP_N))
+    quote_asset = (quote_asset or "").strip().upper() or None
+    data = await fetch_market_snapshot()
+    return format_market_scan(data, sort_by, top_n, quote_asset, min_quote_volume or 0.0, max_spread_pct)
+
+def align_closes(columns: list[KlineColumns]) -> tuple[Any, Any]:
+    """
+    按开盘时间把多个交易对的收盘价对齐为一个矩阵。
+    :param columns: 各交易对的列式K线
+    :return: (开盘时间数组, 收盘价矩阵[时间, 交易对])，某交易对缺少的K线为 NaN
+    """
+    times = np.unique(np.concatenate([c.open_time for c in columns]))
+    closes = np.full((len(times), len(columns)), np.nan)
+    for j, c in enumerate(columns):
+        closes[np.searchsorted(times, c.open_time), j] = c.close
+    return times, closes
+
+
+def compute_correlation(closes, step_ms: int, benchmark: int | None = 0) -> dict[str, Any]:
+    """
+    基于对齐后的收盘价矩阵计算对数收益率的相关矩阵、年化波动率、区间收益率与相对基准的 beta。
+    交易对之间按两者都有数据的K线计算（pairwise complete），全部用矩阵运算完成。
+    :param closes: align_closes 返回的收盘价矩阵
+    :param step_ms: K线周期毫秒数，用于年化波动率
+    :param benchmark: 基准交易对的列号，None 表示不计算 beta
+    :return: 指标数组字典
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.diff(np.log(closes), axis=0)
+        mask = np.isfinite(returns)
+        valid = mask.astype(np.float64)
+        filled = np.where(mask, returns, 0.0)
+
+        # 两两共同样本数与各项和：n[i, j] 为 i、j 同时有收益率的K线数
+        n = valid.T @ valid
+        sum_x = filled.T @ valid
+        sum_xx = (filled * filled).T @ valid
+        sum_xy = filled.T @ filled
+        mean_x = sum_x / n
+        mean_y = mean_x.T
+        cov = sum_xy / n - mean_x * mean_y
+        var_x = sum_xx / n - mean_x ** 2
+        var_y = var_x.T
+        corr = np.clip(cov / np.sqrt(var_x * var_y), -1.0, 1.0)
+        corr[n < 3] = np.nan
+
+        counts = np.diag(n)
+        means = np.diag(sum_x) / counts
+        std = np.sqrt(np.maximum(np.diag(sum_xx) / counts - means ** 2, 0.0) * counts / (counts - 1))
+        volatility = std * np.sqrt(365 * 86_400_000 / step_ms)
+
+        present = np.isfinite(closes)
+        first = closes[present.argmax(axis=0), np.arange(closes.shape[1])]
+        last = closes[len(closes) - 1 - present[::-1].argmax(axis=0), np.arange(closes.shape[1])]
+        total_return = last / first - 1
+
+        beta = None
+        if benchmark is not None:
+            beta = cov[:, benchmark] / var_y[:, benchmark]
+            beta[n[:, benchmark] < 3] = np.nan
+    return {
+        "corr": corr,
+        "samples": counts.astype(np.int64),
+        "volatility": volatility,
+        "total_return": total_return,
+        "beta": beta,
+    }
+
+
+async def fetch_klines_for_symbols(symbols: list[str], interval: str, limit: int) -> dict[str, list | dict[str, Any]]:
+    """
+    以有限并发拉取多个交易对的K线（复用K线缓存，只补拉新K线）。
+    :param symbols: 交易对列表
+    :param interval: 时间周期
+    :param limit: 每个交易对的K线数量
+    :return: 交易对 -> K线数据列表或包含 error 信息的字典
+    """
+    semaphore = asyncio.Semaphore(CORRELATION_CONCURRENCY)
+
+    async def fetch(symbol: str):
+        async with semaphore:
+            return await fetch_crypto_klines(symbol, interval, limit)
+
+    results = await asyncio.gather(*(fetch(symbol) for symbol in symbols))
+    return dict(zip(symbols, results))
+
+
+def format_correlation(symbols: list[str], interval: str, data: dict[str, Any], errors: dict[str, str]) -> str:
+    """
+    将相关性结果格式化为文本：每个交易对的收益 / 波动率 / beta，以及相关矩阵（交易对较多时只列出相关性最高与最低的组合）。
+    :param symbols: 成功获取数据的交易对（与结果数组的列一一对应）
+    :param interval: 时间周期
+    :param data: compute_correlation 的结果
+    :param errors: 获取失败的交易对 -> 错误信息
+    """
+    if "error" in data:
+        return f"⚠️ {data['error']}"
+
+    def fmt(value, spec: str) -> str:
+        return "-" if value is None or not np.isfinite(value) else format(value, spec)
+
+    result = [f"📈 多交易对收益与相关性（{interval}，对数收益率）\n"]
+    result.append(f"交易对 | 样本数 | 区间收益 | 年化波动率 | 对 {CORRELATION_BENCHMARK} beta | 对 {CORRELATION_BENCHMARK} 相关性")
+    benchmark = symbols.index(CORRELATION_BENCHMARK) if CORRELATION_BENCHMARK in symbols else None
+    for i, symbol in enumerate(symbols):
+        beta = data["beta"][i] if data["beta"] is not None else None
+        corr = data["corr"][i, benchmark] if benchmark is not None else None
+        result.append(
+            f"{symbol} | {data['samples'][i]} | {fmt(data['total_return'][i] * 100, '+.2f')}% | "
+            f"{fmt(data['volatility'][i] * 100, '.1f')}% | {fmt(beta, '.2f')} | {fmt(corr, '.2f')}"
+        )
+
+    corr = data["corr"]
+    if len(symbols) <= CORRELATION_MATRIX_MAX_SYMBOLS:
+        result.append("\n相关矩阵：")
+        result.append("交易对 | " + " | ".join(symbols))
+        for i, symbol in enumerate(symbols):
+            result.append(f"{symbol} | " + " | ".join(fmt(v, '.2f') for v in corr[i]))
+    else:
+        upper_i, upper_j = np.triu_indices(len(symbols), k=1)
+        values = corr[upper_i, upper_j]
+        # 只对有效的相关系数排序，无法计算（NaN）的组合不参与排名
+        finite = np.flatnonzero(np.isfinite(values))
+        order = finite[np.argsort(values[finite])]
+        for title, picks in (("相关性最高的组合", order[::-1][:10]), ("相关性最低的组合", order[:10])):
+            result.append(f"\n{title}：")
+            result.extend(f"{symbols[upper_i[k]]} / {symbols[upper_j[k]]}: {fmt(values[k], '.2f')}" for k in picks)
+        if len(finite) < len(values):
+            result.append(f"\n另有 {len(values) - len(finite)} 个组合的相关系数无法计算（收益率无波动或重叠样本不足）")
+
+    if errors:
+        result.append("\n以下交易对获取失败：")
+        result.extend(f"{symbol}: {error}" for symbol, error in errors.items())
+    return '\n'.join(result)
+
+
+@mcp.tool()
+async def query_crypto_correlation(symbols: list, interval: str = "1d", limit: int = 200) -> str:
+    """
+    比较多个交易对：并发拉取K线、按开盘时间对齐，计算对数收益率的相关矩阵、年化波动率、区间收益率与相对 BTC 的 beta。
+    比较多个币种的走势时请使用本工具，而不是多次调用 query_crypto_klines。
+    :param symbols: 交易对符号列表（如 ["BTCUSDT", "ETHUSDT", "SOLUSDT"]，最多 50 个；BTCUSDT 会自动加入作为基准）
+    :param interval: 时间周期（如 1h, 4h, 1d），默认 1d
+    :param limit: 每个交易对参与计算的K线数量（最多1000），默认 200
+    :return: 格式化后的相关性分析结果
+    """
+    logging.info(f"调用 query_crypto_correlation 工具，交易对: {symbols}, 周期: {interval}, 数量: {limit}")
+    if np is None:
+        return "❌ 未安装 numpy，无法计算相关性"
+    if interval not in KLINE_INTERVAL_MS:
+        return f"❌ 无效的时间周期，请使用: {', '.join(KLINE_INTERVAL_MS)}"
+    if not isinstance(symbols, list) or not symbols:
+        return "❌ 交易对列表不能为空"
+    unique = list(dict.fromkeys(_normalize_symbol(s) for s in symbols if isinstance(s, str) and s.strip()))
+    if CORRELATION_BENCHMARK not in unique:
+        unique.insert(0, CORRELATION_BENCHMARK)
+    if len(unique) > CORRELATION_MAX_SYMBOLS:
+        return f"❌ 交易对数量不能超过 {CORRELATION_MAX_SYMBOLS} 个"
+    errors = {s: "无效的交易对" for s in unique if not SYMBOL_PATTERN.match(s)}
+    unique = [s for s in unique if s not in errors]
+
+    fetched = await fetch_klines_for_symbols(unique, interval, limit)
+    names, columns = [], []
+    for symbol, data in fetched.items():
+        if isinstance(data, dict):
+            errors[symbol] = data.get("error", "未知错误")
+            continue
+        if len(data) < 2:
+            errors[symbol] = "K线数量不足"
+            continue
+        try:
+            columns.append(parse_klines(data))
+            names.append(symbol)
+        except (IndexError, ValueError, TypeError) as e:
+            errors[symbol] = f"K线数据解析错误: {str(e)}"
+    if len(names) < 2:
+        detail = "；".join(f"{s}: {e}" for s, e in errors.items())
+        return format_correlation(names, interval, {"error": f"可用的交易对少于 2 个 {detail}".strip()}, {})
+
+    _, closes = align_closes(columns)
+    benchmark = names.index(CORRELATION_BENCHMARK) if CORRELATION_BENCHMARK in names else None
+    data = compute_correlation(closes, KLINE_INTERVAL_MS[interval], benchmark)
+    return format_correlation(names, interval, data, errors)
+
+class FundingStore:
+    """
+    基于 SQLite 的资金费率历史库。
+    funding 表按 (symbol, funding_time) 存储每次结算；
+    funding_coverage 表记录已经从币安完整拉取过的时间区间，用于计算需要补齐的缺口。
+    """
+
+    def __init__(self, path: str = FUNDING_STORE_PATH):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS funding ("
+                "symbol TEXT, funding_time INTEGER, rate REAL, mark_price TEXT, "
+                "PRIMARY KEY (symbol, funding_time)) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS funding_coverage (symbol TEXT, start_time INTEGER, end_time INTEGER)"
+            )
+            self._conn = conn
+            logging.info(f"本地资金费率库已打开: {self.path}")
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _coverage(self, symbol: str) -> list[tuple[int, int]]:
+        rows = self._connection().execute(
+            "SELECT start_time, end_time FROM funding_coverage WHERE symbol = ? ORDER BY start_time", (symbol,)
+        ).fetchall()
+        return [(int(a), int(b)) for a, b in rows]
+
+    def missing_spans(self, symbol: str, start: int, end: int) -> list[tuple[int, int]]:
+        """
+        计算 [start, end] 内尚未拉取过的时间区间。
+        :return: 缺口区间列表（毫秒，闭区间）
+        """
+        with self._lock:
+            coverage = self._coverage(symbol)
+        spans = []
+        cursor = start
+        for covered_start, covered_end in coverage:
+            if covered_end < cursor:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > cursor:
+                spans.append((cursor, covered_start - 1))
+            cursor = max(cursor, covered_end + 1)
+        if cursor <= end:
+            spans.append((cursor, end))
+        return spans
+
+    def save(self, symbol: str, rows: list, span: tuple[int, int]):
+        """
+        写入一页资金费率记录并把该页时间区间记为已拉取。
+        :param rows: 币安 /fapi/v1/fundingRate 返回的记录
+        :param span: 本页覆盖的时间区间
+        """
+        records = [
+            (symbol, int(r["fundingTime"]), float(r["fundingRate"]), str(r.get("markPrice") or ""))
+            for r in rows
+        ]
+        with self._lock:
+            conn = self._connection()
+            spans = sorted(self._coverage(symbol) + [span])
+            merged = [spans[0]]
+            for span_start, span_end in spans[1:]:
+                last_start, last_end = merged[-1]
+                if span_start <= last_end + 1:
+                    merged[-1] = (last_start, max(last_end, span_end))
+                else:
+                    merged.append((span_start, span_end))
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO funding VALUES (?,?,?,?)", records)
+                conn.execute("DELETE FROM funding_coverage WHERE symbol = ?", (symbol,))
+                conn.executemany(
+                    "INSERT INTO funding_coverage VALUES (?,?,?)", [(symbol, a, b) for a, b in merged]
+                )
+
+    def read(self, symbol: str, start: int, end: int, limit: int, latest: bool = False) -> list[dict[str, Any]]:
+        """
+        读取区间内的资金费率记录，返回与币安接口相同的字典结构（时间从旧到新）。
+        :param latest: True 时返回区间内最新的 limit 条，否则返回最早的 limit 条
+        """
+        order = "DESC" if latest else "ASC"
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT funding_time, rate, mark_price FROM funding "
+                f"WHERE symbol = ? AND funding_time BETWEEN ? AND ? ORDER BY funding_time {order} LIMIT ?",
+                (symbol, start, end, limit)
+            ).fetchall()
+        if latest:
+            rows.reverse()
+        return [
+            {"symbol": symbol, "fundingTime": t, "fundingRate": f"{rate:.8f}", "markPrice": mark}
+            for t, rate, mark in rows
+        ]
+
+
+_funding_store = FundingStore()
+
+
+async def _backfill_funding(symbol: str, span: tuple[int, int]) -> str | None:
+    """
+    按 startTime 向后翻页拉取一个缺口区间内的资金费率（每页最多1000条）并落盘。
+    :return: 错误信息；成功时返回 None
+    """
+    cursor, span_end = span
+    headers = {"User-Agent": USER_AGENT}
+    while cursor <= span_end:
+        params = {"symbol": symbol, "startTime": cursor, "endTime": span_end, "limit": 1000}
+        try:
+            # 由工具调用直接等待，按交互优先级排队
+            response = await _binance_get(BINANCE_FUNDING_RATE_API, params=params, headers=headers, timeout=30.0)
+            response.raise_for_status()
+            rows = response.json()
+        except httpx.HTTPStatusError as e:
+            return f"HTTP 错误: {e.response.status_code}"
+        except Exception as e:
+            return f"请求失败: {str(e)}"
+        # 不足一页说明已到区间末尾（但不把最近 FUNDING_SETTLE_GRACE_MS 内记为已拉取）；满页时下一页从最后一条之后开始
+        if len(rows) < 1000:
+            page_end = max(cursor, min(span_end, int(time.time() * 1000) - FUNDING_SETTLE_GRACE_MS))
+        else:
+            page_end = int(rows[-1]["fundingTime"])
+        await asyncio.to_thread(_funding_store.save, symbol, rows, (cursor, page_end))
+        if len(rows) < 1000:
+            break
+        cursor = page_end + 1
+    return None
+
+
+@single_flight
+async def fetch_funding_history(symbol: str, start_time: Any = None, end_time: Any = None,
+                                limit: int = 1000) -> list | dict[str, Any]:
+    """
+    从本地资金费率库读取任意时间区间的结算记录，缺失部分按页从币安补齐后落盘（之后只拉取新结算）。
+    :param symbol: 永续合约交易对（如 BTCUSDT）
+    :param start_time: 开始时间（时间戳或本地时间字符串），为空时按 limit 从结束时间向前推算
+    :param end_time: 结束时间，为空时表示当前时间
+    :param limit: 最多返回的记录数；只给出结束时间时返回最新的 limit 条
+    :return: 资金费率记录列表（时间从旧到新）；若出错返回包含 error 信息的字典
+    """
+    try:
+        start = _parse_time_ms(start_time)
+        end = _parse_time_ms(end_time)
+    except ValueError as e:
+        return {"error": f"无法解析时间参数: {str(e)}"}
+
+    symbol = _normalize_symbol(symbol)
+    if not SYMBOL_PATTERN.match(symbol):
+        return {"error": f"无效的交易对: {symbol}"}
+    limit = max(1, min(int(limit), FUNDING_RANGE_MAX_ROWS))
+    now_ms = int(time.time() * 1000)
+    end = min(end if end is not None else now_ms, now_ms)
+    latest = start is None
+    if start is None:
+        # 按最长的结算间隔估算，保证区间内至少有 limit 条记录
+        start = end - limit * FUNDING_DEFAULT_INTERVAL_HOURS * 3_600_000
+    if start > end:
+        return {"error": "开始时间必须早于结束时间"}
+
+    spans = await asyncio.to_thread(_funding_store.missing_spans, symbol, start, end)
+    # 缺口只是上次补拉时留出的发布宽限期、且补拉不足 FUNDING_REFRESH_MS 时不再请求上游
+    spans = [span for span in spans if span[0] < now_ms - FUNDING_SETTLE_GRACE_MS - FUNDING_REFRESH_MS]
+    if spans:
+        logging.info(f"{symbol} 资金费率库缺少 {len(spans)} 个区间，开始补齐")
+    for span in spans:
+        error = await _backfill_funding(symbol, span)
+        if error:
+            logging.error(f"{symbol} 资金费率补齐失败: {error}")
+            return {"error": f"资金费率补齐失败: {error}"}
+
+    rows = await asyncio.to_thread(_funding_store.read, symbol, start, end, limit, latest)
+    logging.info(f"从本地资金费率库读取 {symbol} 记录 {len(rows)} 条")
+    return rows
+
+
+class FundingSnapshot:
+    """
+    全市场永续合约资金费率的列式索引：premiumIndex 一次返回全部合约的当期费率、标记价格与指数价格，
+    结合 fundingInfo 中各合约的结算间隔计算年化费率，排名用 argpartition 向量化完成。
+    """
+
+    def __init__(self, items: list, interval_hours: dict[str, float]):
+        """
+        :param items: 币安 /fapi/v1/premiumIndex 返回的全部合约数据（已排除交割合约）
+        :param interval_hours: 交易对 -> 结算间隔（小时），未列出的按 FUNDING_DEFAULT_INTERVAL_HOURS 计算
+        :raises ValueError / KeyError / TypeError: 数据格式不正确
+        """
+        fields = ("lastFundingRate", "markPrice", "indexPrice", "nextFundingTime")
+        table = np.fromiter((float(item[f]) for item in items for f in fields), dtype=np.float64,
+                            count=len(items) * len(fields)).reshape(-1, len(fields))
+        self.symbols = np.array([item["symbol"] for item in items], dtype=str)
+        self.rate = table[:, 0] * 100
+        self.mark_price = table[:, 1]
+        self.index_price = table[:, 2]
+        self.next_funding_time = table[:, 3].astype(np.int64)
+        self.interval_hours = np.array(
+            [interval_hours.get(item["symbol"], FUNDING_DEFAULT_INTERVAL_HOURS) for item in items], dtype=np.float64
+        )
+        self.annualized = self.rate * (365 * 24 / self.interval_hours)
+        self.annualized_abs = np.abs(self.annualized)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.basis_pct = np.where(self.index_price > 0,
+                                      (self.mark_price - self.index_price) / self.index_price * 100, 0.0)
+        self.basis_abs = np.abs(self.basis_pct)
+        self.quote = _quote_assets(self.symbols)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def rank(self, sort_by: str, top_n: int, quote_asset: str | None = None) -> tuple[Any, int]:
+        """
+        按 FUNDING_SORTS 中的方式排序。
+        :return: (排序后的行号数组, 满足条件的合约数量)
+        """
+        mask = self.mark_price > 0
+        if quote_asset:
+            mask &= self.quote == quote_asset
+        column, descending = FUNDING_SORTS[sort_by]
+        return _top_n(getattr(self, column), mask, top_n, descending)
+
+
+@single_flight
+async def fetch_funding_intervals() -> dict[str, float]:
+    """
+    获取结算间隔被调整过的合约（/fapi/v1/fundingInfo），失败时返回空字典（全部按默认间隔计算）。
+    :return: 交易对 -> 结算间隔（小时）
+    """
+    cache_key = ("funding_info",)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    try:
+        response = await _binance_get(BINANCE_FUNDING_INFO_API, headers={"User-Agent": USER_AGENT}, timeout=30.0)
+        response.raise_for_status()
+        intervals = {item["symbol"]: float(item["fundingIntervalHours"]) for item in response.json()
+                     if item.get("fundingIntervalHours")}
+    except Exception as e:
+        logging.warning(f"获取合约结算间隔失败，按 {FUNDING_DEFAULT_INTERVAL_HOURS} 小时计算: {str(e)}")
+        return {}
+    _response_cache.set(cache_key, intervals, CACHE_TTL["funding_info"])
+    return intervals
+
+
+@single_flight
+async def fetch_funding_snapshot() -> FundingSnapshot | dict[str, Any]:
+    """
+    从币安 API 一次性获取全部永续合约的当期资金费率并建立列式索引。
+    快照在 FUNDING_SNAPSHOT_TTL 秒内复用，期间的扫描不再访问上游。
+    :return: FundingSnapshot；若出错返回包含 error 信息的字典
+    """
+    cache_key = ("funding_snapshot",)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    logging.info("开始获取全市场资金费率快照")
+    headers = {"User-Agent": USER_AGENT}
+
+    try:
+        response, intervals = await asyncio.gather(
+            _binance_get(BINANCE_PREMIUM_INDEX_API, headers=headers, timeout=30.0),
+            fetch_funding_intervals()
+        )
+        response.raise_for_status()
+        # 交割合约没有资金费率（lastFundingRate 为空）
+        items = [item for item in response.json() if item.get("lastFundingRate") not in (None, "")]
+        snapshot = await asyncio.to_thread(FundingSnapshot, items, intervals)
+        logging.info(f"成功获取全市场资金费率快照，共 {len(snapshot)} 个永续合约")
+        _response_cache.set(cache_key, snapshot, CACHE_TTL["funding_snapshot"])
+        return snapshot
+    except httpx.HTTPStatusError as e:
+        return {"error": f"HTTP 错误: {e.response.status_code}"}
+    except (KeyError, ValueError, TypeError) as e:
+        return {"error": f"资金费率数据解析错误: {str(e)}"}
+    except Exception as e:
+        return {"error": f"请求失败: {str(e)}"}
+
+
+async def fetch_funding_means(symbols: list[str], days: int) -> dict[str, float | None]:
+    """
+    以有限并发读取多个合约最近 days 天的资金费率历史（走本地库，只补拉新结算），计算每次结算的平均费率。
+    :return: 交易对 -> 平均费率（%）；获取失败或没有记录时为 None
+    """
+    semaphore = asyncio.Semaphore(FUNDING_BACKFILL_CONCURRENCY)
+    start = int(time.time() * 1000) - days * 86_400_000
+
+    async def mean(symbol: str) -> float | None:
+        async with semaphore:
+            rows = await fetch_funding_history(symbol, start, None, FUNDING_RANGE_MAX_ROWS)
+        if isinstance(rows, dict) or not rows:
+            return None
+        return float(np.fromiter((float(r["fundingRate"]) for r in rows), dtype=np.float64).mean() * 100)
+
+    results = await asyncio.gather(*(mean(symbol) for symbol in symbols))
+    return dict(zip(symbols, results))
+
+
+def format_funding_scan(data: FundingSnapshot | dict[str, Any], rows, matched: int, sort_by: str,
+                        quote_asset: str | None = None, history_days: int = 0,
+                        means: dict[str, float | None] | None = None) -> str:
+    """
+    将资金费率扫描结果格式化为表格。
+    :param data: 全市场资金费率快照，或包含 error 信息的字典
+    :param rows: FundingSnapshot.rank 返回的行号
+    :param matched: 满足条件的合约数量
+    :param means: 交易对 -> 最近 history_days 天的平均费率（%）
+    :return: 格式化后的扫描结果
+    """
+    if isinstance(data, dict) and "error" in data:
+        return f"⚠️ {data['error']}"
+    titles = {"highest": "年化费率最高", "lowest": "年化费率最低", "extreme": "费率绝对值最大", "basis": "基差绝对值最大"}
+    scope = f"{quote_asset} 保证金" if quote_asset else "全部合约"
+    result = [f"📊 资金费率扫描 - {titles[sort_by]}（{scope}，{matched}/{len(data)} 个永续合约）\n"]
+    if not len(rows):
+        result.append("没有满足条件的合约")
+        return '\n'.join(result)
+    header = "排名 | 合约 | 当期费率 | 结算间隔 | 年化 | 基差 | 下次结算"
+    if means is not None:
+        header += f" | 近{history_days}天均值（年化）"
+    result.append(header)
+    next_times = _local_time_strings(data.next_funding_time[rows])
+    for rank, (i, next_time) in enumerate(zip(rows.tolist(), next_times), 1):
+        line = (f"{rank} | {data.symbols[i]} | {data.rate[i]:+.4f}% | {data.interval_hours[i]:g}h | "
+                f"{data.annualized[i]:+.2f}% | {data.basis_pct[i]:+.3f}% | {next_time}")
+        if means is not None:
+            mean = means.get(str(data.symbols[i]))
+            line += " | -" if mean is None else f" | {mean:+.4f}%（{mean * 365 * 24 / data.interval_hours[i]:+.2f}%）"
+        result.append(line)
+    return '\n'.join(result)
+
+
+@mcp.tool()
+async def query_funding_history(symbol: str, start_time: str = None, end_time: str = None, limit: int = 1000,
+                                output_mode: str = "summary", points: int = 100,
+                                max_chars: int = OUTPUT_MAX_CHARS) -> str:
+    """
+    查询永续合约任意时间区间的资金费率历史（本地库缓存，突破单次 1000 条限制），默认返回统计汇总（含近 3/7/30 天均值与年化）。
+    :param symbol: 永续合约交易对（如 BTCUSDT）
+    :param start_time: 开始时间（可选，如 "2024-01-01"）
+    :param end_time: 结束时间（可选，默认当前时间）
+    :param limit: 最多返回的记录数（默认1000，最多10000）；不指定开始时间时返回最新的 limit 条
+    :param output_mode: 输出模式（table / csv / summary / downsampled，默认 summary）
+    :param points: downsampled 模式的目标点数（默认100）
+    :param max_chars: 最大输出字符数（默认8000）
+    :return: 格式化后的资金费率历史
+    """
+    logging.info(f"调用 query_funding_history 工具，交易对: {symbol}, 区间: {start_time} ~ {end_time}, 数量: {limit}")
+    invalid = _invalid_output_mode(output_mode)
+    if invalid:
+        return invalid
+    data = await fetch_funding_history(symbol, start_time, end_time, limit)
+    return format_funding_rate(data, output_mode, max_chars, points)
+
+
+@mcp.tool()
+async def query_funding_scanner(sort_by: str = "extreme", top_n: int = 20, quote_asset: str = "USDT",
+                                history_days: int = 0) -> str:
+    """
+    全市场资金费率扫描：一次请求获取全部永续合约的当期资金费率，按年化费率或基差排名。
+    回答「哪些合约的资金费率最极端」等问题时请使用本工具，而不是多次调用 query_funding_rate。
+    :param sort_by: highest（年化最高）、lowest（年化最低）、extreme（绝对值最大）、basis（标记价格相对指数价格偏离最大），默认 extreme
+    :param top_n: 返回前 N 个合约，默认 20，最大 100
+    :param quote_asset: 保证金资产过滤（如 USDT、USDC），传空字符串表示不过滤，默认 USDT
+    :param history_days: 大于 0 时为排名结果附加最近 N 天的平均费率（读取本地资金费率库，最多 90 天）
+    :return: 格式化后的扫描结果
+    """
+    logging.info(f"调用 query_funding_scanner 工具，排序: {sort_by}, 数量: {top_n}, 保证金资产: {quote_asset}")
+    if np is None:
+        return "❌ 未安装 numpy，无法使用资金费率扫描"
+    if sort_by not in FUNDING_SORTS:
+        return f"❌ 无效的排序方式，请使用: {', '.join(FUNDING_SORTS)}"
+    top_n = max(1, min(int(top_n), SCAN_MAX_TOP_N))
+    history_days = max(0, min(int(history_days or 0), 90))
+    quote_asset = (quote_asset or "").strip().upper() or None
+    data = await fetch_funding_snapshot()
+    if isinstance(data, dict):
+        return format_funding_scan(data, [], 0, sort_by, quote_asset)
+    rows, matched = data.rank(sort_by, top_n, quote_asset)
+    means = None
+    if history_days:
+        means = await fetch_funding_means([str(data.symbols[i]) for i in rows.tolist()], history_days)
+    return format_funding_scan(data, rows, matched, sort_by, quote_asset, history_days, means)
+
 if __name__ == "__main__":
 
 
@@ -1,11 +1,20 @@
+import asyncio
+import hashlib
+import inspect
 import logging
 import json
 import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
 from typing import Any, Dict
 
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
-from tavily import TavilyClient
+from openai import AsyncOpenAI
+from tavily import AsyncTavilyClient
 
 load_dotenv()
 
@@ -19,31 +28,188 @@ logging.basicConfig(
     ]
 )
 
+# API 地址（可通过环境变量指向代理或本地替身服务）
+TAVILY_API_BASE_URL = os.environ.get("TAVILY_API_BASE_URL", "https://api.tavily.com")
+OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
+# 调研总结配置
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", "google/gemini-2.0-flash-exp:free")
+SUMMARY_SYSTEM_PROMPT = "根据用户的资料进行深度调研 生成一份md格式的调研报告 并且引用到资料的时候需要在那个位置标注出处URL"
+SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", "5"))  # 逐条总结时的最大并发数
+SUMMARY_TIMEOUT = float(os.environ.get("SUMMARY_TIMEOUT", "60"))  # 单次总结请求的超时时间（秒）
+SUMMARY_ONE_SHOT_MAX_TOKENS = int(os.environ.get("SUMMARY_ONE_SHOT_MAX_TOKENS", "6000"))  # 合并为一次请求的资料 token 上限
+SUMMARY_MODES = ("auto", "one_shot", "per_item")
+
+# 本地缓存配置：搜索结果按 规范化查询 + 数量 缓存，总结按资料内容哈希缓存（TTL 为 0 表示不缓存）
+DEEPSEARCH_CACHE_DIR = os.environ.get("DEEPSEARCH_CACHE_DIR", "data")
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", "3600"))
+SUMMARY_CACHE_TTL = float(os.environ.get("SUMMARY_CACHE_TTL", str(7 * 24 * 3600)))
+
+# 共享的 Tavily / OpenRouter 异步客户端（首次调用时创建）
+_tavily_client: AsyncTavilyClient | None = None
+_openai_client: AsyncOpenAI | None = None
+
+
+@asynccontextmanager
+async def server_lifespan(server: FastMCP):
+    """
+    MCP 服务器生命周期：退出时关闭共享的 Tavily / OpenRouter 客户端。
+    :param server: FastMCP 服务器实例
+    """
+    try:
+        yield {}
+    finally:
+        await close_clients()
+        logging.info(f"调研缓存统计: {_search_cache.stats()}")
+        _search_cache.close()
+
+
 # 初始化 MCP 服务器
-mcp = FastMCP("DeepSearchServer")
+mcp = FastMCP("DeepSearchServer", lifespan=server_lifespan)
+
+class SearchCache:
+    """
+    基于 SQLite 的调研缓存，MCP 工具与 --cli 模式共用。
+    searches 表按 规范化查询 + max_results 保存 Tavily 搜索结果；
+    summaries 表按 模型 + 提示词 + 资料内容 的哈希保存 LLM 总结，相同资料不会重复总结。
+    """
+
+    def __init__(self, directory: str = DEEPSEARCH_CACHE_DIR):
+        self.path = os.path.join(directory, "deepsearch_cache.sqlite3")
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS searches (key TEXT PRIMARY KEY, results TEXT, created REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT, created REAL)")
+            self._conn = conn
+            logging.info(f"调研缓存已打开: {self.path}")
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @staticmethod
+    def search_key(query: str, max_results: int) -> str:
+        """规范化查询（合并空白、忽略大小写）+ 结果数量"""
+        return f"{' '.join(query.split()).lower()}\x00{max_results}"
+
+    @staticmethod
+    def summary_key(content: str) -> str:
+        """模型、提示词与资料内容共同决定总结结果"""
+        text = f"{SUMMARY_MODEL}\x00{SUMMARY_SYSTEM_PROMPT}\x00{content}"
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _get(self, table: str, column: str, key: str, ttl: float) -> str | None:
+        if ttl <= 0:
+            return None
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT {column} FROM {table} WHERE key = ? AND created >= ?", (key, time.time() - ttl)
+            ).fetchone()
+            # 在 asyncio.to_thread 的工作线程中调用，计数也需在锁内更新
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return row[0] if row is not None else None
+
+    def _set(self, table: str, key: str, value: str, ttl: float):
+        if ttl <= 0:
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.execute(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)", (key, value, time.time()))
+            conn.commit()
+
+    def get_search(self, query: str, max_results: int) -> list | None:
+        results = self._get("searches", "results", self.search_key(query, max_results), SEARCH_CACHE_TTL)
+        return json.loads(results) if results is not None else None
+
+    def save_search(self, query: str, max_results: int, results: list):
+        self._set("searches", self.search_key(query, max_results), json.dumps(results, ensure_ascii=False),
+                  SEARCH_CACHE_TTL)
+
+    def get_summary(self, content: str) -> str | None:
+        return self._get("summaries", "summary", self.summary_key(content), SUMMARY_CACHE_TTL)
+
+    def save_summary(self, content: str, summary: str):
+        self._set("summaries", self.summary_key(content), summary, SUMMARY_CACHE_TTL)
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+
+_search_cache = SearchCache()
 
-def _get_tavily_client() -> TavilyClient:
-    """创建 Tavily 客户端，未配置密钥时给出明确错误"""
+
+def _get_tavily_client() -> AsyncTavilyClient:
+    """获取共享的 Tavily 异步客户端，未配置密钥时给出明确错误"""
+    global _tavily_client
     api_key = os.environ.get("TAVILY_API_KEY", "")
     if not api_key:
         raise ValueError("TAVILY_API_KEY 未配置，请在 .env 文件中设置")
-    return TavilyClient(api_key=api_key)
+    if _tavily_client is None:
+        _tavily_client = AsyncTavilyClient(api_key=api_key, api_base_url=TAVILY_API_BASE_URL)
+    return _tavily_client
+
+
+def _get_openai_client(api_key: str) -> AsyncOpenAI:
+    """获取共享的 OpenRouter（OpenAI 兼容）异步客户端，复用连接池"""
+    global _openai_client
+    if _openai_client is None or _openai_client.api_key != api_key:
+        _openai_client = AsyncOpenAI(base_url=OPENROUTER_BASE_URL, api_key=api_key)
+    return _openai_client
+
+
+async def close_clients():
+    """关闭共享的 Tavily / OpenRouter 客户端"""
+    global _tavily_client, _openai_client
+    clients = [("Tavily", _tavily_client), ("OpenRouter", _openai_client)]
+    _tavily_client = _openai_client = None
+    for name, client in clients:
+        if client is None:
+            continue
+        try:
+            result = client.close()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logging.error(f"关闭 {name} 客户端失败: {str(e)}")
 
 
-def search(query: str, max_results: int = 5) -> list:
+async def search(query: str, max_results: int = 5) -> list:
     """
-    执行深度调研并返回结构化结果，使用 Tavily 进行网页搜索获取资料
+    执行深度调研并返回结构化结果，使用 Tavily 进行网页搜索获取资料（异步请求，不阻塞事件循环），
+    相同查询在 SEARCH_CACHE_TTL 秒内直接读取本地缓存
     :param query: 调研查询关键词或问题
     :param max_results: 最大返回结果数量 (1-20，默认 5)
     :return: 搜索结果列表
     """
+    cached = await asyncio.to_thread(_search_cache.get_search, query, max_results)
+    if cached is not None:
+        logging.info(f"调研搜索命中缓存: {query}")
+        return cached
+
     client = _get_tavily_client()
-    response = client.search(
+    response = await client.search(
         query=query,
         search_depth="advanced",
         max_results=max_results,
     )
-    return response.get("results", [])
+    results = response.get("results", [])
+    await asyncio.to_thread(_search_cache.save_search, query, max_results, results)
+    return results
 
 
 def format_search(data: list) -> str:
@@ -76,7 +242,7 @@ async def deep_search(query: str, max_results: int = 5) -> str:
     logging.info(f"调用 deep_search 工具，关键词: {query}, 数量: {max_results}")
     try:
         max_results = max(1, min(max_results, 20))
-        data = search(query, max_results)
+        data = await search(query, max_results)
         return format_search(data)
     except Exception as e:
         logging.error(f"深度搜索失败: {str(e)}")
@@ -84,28 +250,88 @@ async def deep_search(query: str, max_results: int = 5) -> str:
 
 
 @mcp.tool()
-async def deep_search_and_summarize(query: str, max_results: int = 5) -> str:
+async def deep_search_and_summarize(query: str, max_results: int = 5, mode: str = "auto") -> str:
     """
     执行深度搜索，并将搜索结果汇总为 MD 格式调研报告（标注来源 URL）。
     :param query: 调研查询关键词或问题
     :param max_results: 最大返回结果数量 (1-20，默认 5)
+    :param mode: 总结方式（auto 资料较少时合并为一次总结，否则逐条并发总结 / one_shot 合并总结 / per_item 逐条总结，默认 auto）
     :return: MD 格式的调研总结
     """
-    logging.info(f"调用 deep_search_and_summarize 工具，关键词: {query}")
+    logging.info(f"调用 deep_search_and_summarize 工具，关键词: {query}, 总结方式: {mode}")
     try:
         max_results = max(1, min(max_results, 20))
-        data = search(query, max_results)
-        return summarize_search_results(data)
+        data = await search(query, max_results)
+        return await summarize_search_results(data, mode)
     except Exception as e:
         logging.error(f"深度调研总结失败: {str(e)}")
         return f"❌ 深度调研总结失败: {str(e)}"
 
 
-def summarize_search_results(data: list) -> str:
+def _estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数：中日韩字符按 1 个 token，其余按 4 个字符 1 个 token"""
+    cjk = len(re.findall(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]", text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+async def _complete(client: AsyncOpenAI, content: str) -> str:
+    """调用 LLM 总结一段资料（相同内容读取缓存），超过 SUMMARY_TIMEOUT 秒视为失败"""
+    cached = await asyncio.to_thread(_search_cache.get_summary, content)
+    if cached is not None:
+        return cached
+    response = await asyncio.wait_for(
+        client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": content}
+            ]
+        ),
+        timeout=SUMMARY_TIMEOUT
+    )
+    summary = response.choices[0].message.content
+    # 模型返回空内容视为失败：合并总结改为逐条总结，逐条总结使用原文
+    if not summary or not summary.strip():
+        raise ValueError("模型返回了空内容")
+    await asyncio.to_thread(_search_cache.save_summary, content, summary)
+    return summary
+
+
+async def _summarize_one_shot(client: AsyncOpenAI, items: list) -> str:
+    """把全部资料合并为一次请求，生成一份整体调研报告"""
+    sources = ''.join(
+        f"[{index}] {item['title']}\nURL: {item['url']}\n{item['content']}\n\n"
+        for index, item in enumerate(items, start=1)
+    )
+    report = await _complete(client, f"以下是 {len(items)} 条调研资料：\n\n{sources}")
+    references = ''.join(f"{index}. [{item['title']}]({item['url']})\n" for index, item in enumerate(items, start=1))
+    return f"{report}\n\n**出处**：\n\n{references}"
+
+
+async def _summarize_per_item(client: AsyncOpenAI, items: list) -> list[str]:
+    """逐条并发总结（受 SUMMARY_CONCURRENCY 限制），结果顺序与输入一致；失败或超时的条目使用原文"""
+    semaphore = asyncio.Semaphore(max(1, SUMMARY_CONCURRENCY))
+
+    async def summarize(item: dict) -> str:
+        async with semaphore:
+            try:
+                return await _complete(client, item['content'])
+            except asyncio.TimeoutError:
+                logging.error(f"调用 OpenRouter API 超时（{SUMMARY_TIMEOUT} 秒）: {item['url']}")
+            except Exception as e:
+                logging.error(f"调用 OpenRouter API 失败: {e}")
+            return item['content']
+
+    return await asyncio.gather(*(summarize(item) for item in items))
+
+
+async def summarize_search_results(data: list, mode: str = "auto") -> str:
     """
     总结深度调研搜索的资料，生成 MD 格式的返回结果，并且标注出处 URL。
-    使用 OpenRouter / OpenAI 兼容 API 对内容进行智能总结。
+    使用 OpenRouter / OpenAI 兼容 API 对内容进行智能总结：资料总量不超过 SUMMARY_ONE_SHOT_MAX_TOKENS 时
+    合并为一次请求，否则逐条并发总结。
     :param data: 调研结果数据（列表）
+    :param mode: 总结方式（auto / one_shot / per_item）
     :return: MD 格式的总结字符串
     """
     if isinstance(data, str):
@@ -113,55 +339,38 @@ def summarize_search_results(data: list) -> str:
             data = json.loads(data)
         except json.JSONDecodeError:
             return "无法解析输入的 JSON 字符串"
+    if mode not in SUMMARY_MODES:
+        return f"❌ 无效的总结方式，请使用: {', '.join(SUMMARY_MODES)}"
 
     api_key = os.environ.get("OPENROUTER_API_KEY", "")
     if not api_key:
         return "❌ OPENROUTER_API_KEY 未配置，请在 .env 文件中设置"
 
-    from openai import OpenAI
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key,
-    )
-
     summary = ["# 深度调研搜索资料总结\n"]
-    processed = False
+    items = [item for item in data if all(k in item for k in ('title', 'content', 'url'))]
+    if not items:
+        summary.append("未找到相关搜索结果。\n")
+        return ''.join(summary)
 
-    for index, item in enumerate(data, start=1):
-        if not all(k in item for k in ('title', 'content', 'url')):
-            continue
-        title = item['title']
-        content = item['content']
-        url = item['url']
+    client = _get_openai_client(api_key)
+    if mode == "auto":
+        tokens = sum(_estimate_tokens(item['content']) for item in items)
+        mode = "one_shot" if tokens <= SUMMARY_ONE_SHOT_MAX_TOKENS else "per_item"
+    if mode == "one_shot":
         try:
-            response = client.chat.completions.create(
-                model="google/gemini-2.0-flash-exp:free",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "根据用户的资料进行深度调研 生成一份md格式的调研报告 并且引用到资料的时候需要在那个位置标注出处URL"
-                    },
-                    {
-                        "role": "user",
-                        "content": content
-                    }
-                ]
-            )
-            summarized_content = response.choices[0].message.content
+            summary.append(await _summarize_one_shot(client, items))
+            return ''.join(summary)
         except Exception as e:
-            logging.error(f"调用 OpenRouter API 失败: {e}")
-            summarized_content = content
+            logging.error(f"合并总结失败，改为逐条总结: {e}")
 
-        processed = True
+    summaries = await _summarize_per_item(client, items)
+    for index, (item, summarized_content) in enumerate(zip(items, summaries), start=1):
         summary.append(
-            f"## {index}. {title}\n\n"
+            f"## {index}. {item['title']}\n\n"
             f"{summarized_content}\n\n"
-            f"**出处**：[{url}]({url})\n\n"
+            f"**出处**：[{item['url']}]({item['url']})\n\n"
         )
 
-    if not processed:
-        summary.append("未找到相关搜索结果。\n")
-
     return ''.join(summary)
 
 
@@ -187,7 +396,13 @@ if __name__ == "__main__":
     # 2. `python deepsearch_mcp_server.py --cli "关键词"` 作为命令行工具运行
     if len(sys.argv) > 1 and sys.argv[1] == "--cli":
         query = sys.argv[2] if len(sys.argv) > 2 else "今日加密市场新闻"
-        save_summary_to_md(summarize_search_results(search(query)))
+        async def run_cli():
+            try:
+                return await summarize_search_results(await search(query))
+            finally:
+                await close_clients()
+                _search_cache.close()
+        save_summary_to_md(asyncio.run(run_cli()))
     else:
         logging.info("DeepSearch MCP 服务器启动成功，开始监听请求...")
         mcp.run(transport='stdio')
@@ -5,14 +5,155 @@ import time
 from typing import Optional
 from contextlib import AsyncExitStack
 import logging
+import re
 
 from openai import AsyncOpenAI, RateLimitError
 import random
 
-from mcp import ClientSession, StdioServerParameters
+from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
 
 
+# Markers of upstream rate limiting in tool results (HTTP 429/418 or the server's own load shedding)
+RATE_LIMIT_PATTERN = re.compile(r"HTTP\s*错误:\s*4(29|18)|HTTP\s*4(29|18)|rate limit|请求权重不足|限流", re.IGNORECASE)
+
+
+class AdaptiveLimiter:
+    """
+    Per-server concurrency limiter for tool calls (AIMD).
+    The limit grows by one after each normal result and halves, with an exponential
+    cooldown, when a result indicates rate limiting.
+    """
+
+    def __init__(self, max_concurrency: int, base_delay: float = 0.5, max_delay: float = 30.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.active = 0
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cooldown = 0.0
+        self.cooldown_until = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        """Wait for a free slot, then for any active cooldown to pass."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        delay = self.cooldown_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def release(self, rate_limited: bool = False):
+        """Free a slot and adapt the limit to the outcome of the call."""
+        async with self._condition:
+            self.active -= 1
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self.cooldown = min(max(self.cooldown * 2, self.base_delay), self.max_delay)
+                self.cooldown_until = time.monotonic() + self.cooldown
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1)
+                self.cooldown /= 2
+            self._condition.notify_all()
+
+
+# CJK characters count as roughly one token each; other text as roughly four characters per token
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a text without a model-specific tokenizer."""
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class ConversationHistory(list):
+    """Message list that also remembers how many tokens compaction has removed from it."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.compacted_tokens = 0
+
+    def clear(self):
+        super().clear()
+        self.compacted_tokens = 0
+
+
+class HistoryManager:
+    """
+    Keeps the prompt sent to the model within a token budget:
+    - tool results are clipped to tool_result_max_chars when added;
+    - tool results outside the last recent_turns turns are cut to old_tool_result_max_chars;
+    - if still over max_tokens, whole old turns are dropped (system messages are always kept).
+    """
+
+    def __init__(self, max_tokens: int = 32000, recent_turns: int = 4, tool_result_max_chars: int = 12000,
+                 old_tool_result_max_chars: int = 500):
+        self.max_tokens = max_tokens
+        self.recent_turns = max(1, recent_turns)
+        self.tool_result_max_chars = tool_result_max_chars
+        self.old_tool_result_max_chars = old_tool_result_max_chars
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def message_tokens(message: dict) -> int:
+        """Estimated tokens of one message (content, tool-call arguments and per-message overhead)."""
+        tokens = 4 + estimate_tokens(message.get("content") or "")
+        for tool_call in message.get("tool_calls") or []:
+            function = tool_call.get("function") or {}
+            tokens += estimate_tokens(function.get("name") or "") + estimate_tokens(function.get("arguments") or "")
+        return tokens
+
+    def count_tokens(self, history: list) -> int:
+        return sum(self.message_tokens(message) for message in history)
+
+    @staticmethod
+    def _clip(text: str, max_chars: int) -> str:
+        if max_chars <= 0 or len(text) <= max_chars:
+            return text
+        return f"{text[:max_chars]}\n…[truncated {len(text) - max_chars} chars of tool output]"
+
+    def _record(self, history: list, removed: int):
+        if isinstance(history, ConversationHistory):
+            history.compacted_tokens += removed
+
+    def clip_tool_result(self, history: list, text: str) -> str:
+        """Clip a new tool result before it is added to the history."""
+        clipped = self._clip(text, self.tool_result_max_chars)
+        self._record(history, estimate_tokens(text) - estimate_tokens(clipped))
+        return clipped
+
+    def compact(self, history: list) -> int:
+        """
+        Compact the history in place before a model call.
+        :return: Estimated tokens removed by this call
+        """
+        before = self.count_tokens(history)
+        turn_starts = [i for i, message in enumerate(history) if message.get("role") == "user"]
+
+        # Cut old tool outputs, keeping the recent turns intact
+        recent_start = turn_starts[-self.recent_turns] if len(turn_starts) > self.recent_turns else 0
+        for message in history[:recent_start]:
+            if message.get("role") == "tool" and isinstance(message.get("content"), str):
+                message["content"] = self._clip(message["content"], self.old_tool_result_max_chars)
+
+        # Drop whole old turns (a turn starts at a user message) until within budget
+        dropped = 0
+        while len(turn_starts) > 1 and self.count_tokens(history) > self.max_tokens:
+            start, end = turn_starts[0], turn_starts[1]
+            history[start:end] = [m for m in history[start:end] if m.get("role") == "system"]
+            turn_starts = [i for i, message in enumerate(history) if message.get("role") == "user"]
+            dropped += 1
+
+        removed = before - self.count_tokens(history)
+        self._record(history, removed)
+        if removed:
+            self.logger.info(f"History compacted: ~{removed} tokens removed, {dropped} old turns dropped")
+        return removed
+
 
 class MCPClient:
     def __init__(self):
@@ -43,6 +184,14 @@ class MCPClient:
         self.max_retries = config.get('max_retries', 3)  # Max retry attempts
         self.retry_delay = config.get('retry_delay', 1)  # Base retry delay (seconds)
         self.max_delay = config.get('max_delay', 60)  # Max retry delay (seconds)
+        self.tool_concurrency = config.get('tool_concurrency', 4)  # Default concurrent tool calls per server
+        self.history_manager = HistoryManager(
+            max_tokens=config.get('history_max_tokens', 32000),  # Prompt token budget per model call
+            recent_turns=config.get('history_recent_turns', 4),  # Turns whose tool outputs are kept in full
+            tool_result_max_chars=config.get('tool_result_max_chars', 12000),  # Cap for a single new tool result
+            old_tool_result_max_chars=config.get('old_tool_result_max_chars', 500)  # Cap for tool results of older turns
+        )
+        self.last_query_metrics = {}  # Prompt token metrics of the most recent query
         
         if not self.openai_api_key:
             raise ValueError("OpenAI API key not found. Set openai_api_key in config.json or OPENAI_API_KEY in .env")
@@ -52,8 +201,12 @@ class MCPClient:
         self.client = AsyncOpenAI(api_key=self.openai_api_key, base_url=self.base_url) # Create OpenAI async client
         self.session: Optional[ClientSession] = None
         self.servers = {}
+        self.tool_limiters = {}  # Per-server adaptive concurrency limiters
+        self.server_tools = {}  # Tool registry: server name -> list of MCP tool schemas
+        self._stale_tools = set()  # Servers whose tool list changed since it was cached
+        self._openai_tools = None  # Prebuilt OpenAI `tools` payload, rebuilt when the registry changes
         self.exit_stack = AsyncExitStack()
-        self.conversation_history = []  # Conversation history storage        
+        self.conversation_history = ConversationHistory()  # Conversation history storage        
 
     async def connect_to_server(self, server_name: str):
         """Connect to an MCP server by name and list available tools."""
@@ -73,14 +226,59 @@ class MCPClient:
         stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
         stdio, write = stdio_transport
         # Create and store session
-        session = await self.exit_stack.enter_async_context(ClientSession(stdio, write))
+        session = await self.exit_stack.enter_async_context(
+            ClientSession(stdio, write, message_handler=self._make_message_handler(server_name))
+        )
         self.servers[server_name] = session
+        self.tool_limiters[server_name] = AdaptiveLimiter(server_config.get('max_concurrency', self.tool_concurrency))
         
-        # Initialize and list tools
+        # Initialize and register tools (a reconnect replaces the cached schemas)
         await session.initialize()
-        response = await session.list_tools()
-        tools = response.tools
-        print(f"\n{server_name} tools:", [tool.name for tool in tools])
+        await self._refresh_tools(server_name)
+        print(f"\n{server_name} tools:", [tool.name for tool in self.server_tools[server_name]])
+
+    def _make_message_handler(self, server_name: str):
+        """Build a session message handler that invalidates cached tools on tools/list_changed."""
+        async def handle_message(message):
+            if isinstance(message, types.ServerNotification) and \
+                    isinstance(message.root, types.ToolListChangedNotification):
+                self.logger.info(f"{server_name} tool list changed, will re-list on next use")
+                self._stale_tools.add(server_name)
+                self._openai_tools = None
+        return handle_message
+
+    async def _refresh_tools(self, server_name: str):
+        """List tools of one server and store them in the registry."""
+        response = await self.servers[server_name].list_tools()
+        self.server_tools[server_name] = response.tools
+        self._stale_tools.discard(server_name)
+        self._openai_tools = None
+
+    async def get_server_tools(self) -> dict:
+        """Return the tool registry (server name -> tool schemas), re-listing only servers marked stale."""
+        for server_name in list(self._stale_tools):
+            if server_name not in self.servers:
+                self._stale_tools.discard(server_name)
+                continue
+            try:
+                await self._refresh_tools(server_name)
+            except Exception as e:
+                print(f"Failed to get tools from {server_name}: {str(e)}")
+        return {name: tools for name, tools in self.server_tools.items() if name in self.servers}
+
+    async def get_available_tools(self) -> list:
+        """Return the OpenAI `tools` payload for all connected servers, built once per registry change."""
+        server_tools = await self.get_server_tools()
+        if self._openai_tools is None:
+            self._openai_tools = [{
+                  "type": "function",
+                  "function": {
+                      "name": f"{server_name}_{tool.name}",  # Add server name prefix
+                      "description": f"[{server_name}] {tool.description}",  # Note server source
+                      "input_schema": tool.inputSchema
+                  }
+              } for server_name, tools in server_tools.items() for tool in tools]
+        return self._openai_tools
 
 
         
@@ -120,97 +318,226 @@ class MCPClient:
         
         raise last_exception
 
-    async def process_query(self, query: str) -> str:
+    async def _execute_tool_call(self, full_tool_name: str, arguments: str) -> str:
+        """Execute one tool call under its server's concurrency limiter and return the result text."""
+        tool_args = json.loads(arguments)
+
+        # Parse server and tool name
+        if '_' in full_tool_name:
+            server_name, tool_name = full_tool_name.split('_', 1)
+            session = self.servers.get(server_name)
+            if not session:
+                raise ValueError(f"No session found for server '{server_name}'")
+        else:
+            raise ValueError(f"Invalid tool name format, expected 'server_name_tool_name': {full_tool_name}")
+
+        # Execute tool and log result
+        limiter = self.tool_limiters[server_name]
+        await limiter.acquire()
+        rate_limited = False
+        try:
+            print(f"\nExecuting tool: {tool_name} (args: {tool_args})")
+            result = await session.call_tool(tool_name, tool_args)
+            tool_response = result.content[0].text
+            rate_limited = bool(RATE_LIMIT_PATTERN.search(tool_response))
+            print(f"Tool result: {tool_response}")  # Show abbreviated result
+            return tool_response
+        finally:
+            await limiter.release(rate_limited)
+
+    def _prepare_history(self, history: list, metrics: dict):
+        """
+        Compact the history before a model call and record prompt token metrics.
+        Savings are counted once: only what was clipped or compacted since the previous model call of this query.
+        """
+        mark = metrics.pop("_compacted_mark", getattr(history, "compacted_tokens", 0))
+        self.history_manager.compact(history)
+        compacted = getattr(history, "compacted_tokens", 0)
+        metrics["model_calls"] += 1
+        metrics["prompt_tokens"] += self.history_manager.count_tokens(history)
+        metrics["saved_tokens"] += max(0, compacted - mark)
+        metrics["_compacted_mark"] = compacted
+
+    def _finish_metrics(self, metrics: dict):
+        metrics.pop("_compacted_mark", None)
+        self.last_query_metrics = metrics
+        self.logger.info(f"Prompt metrics: {metrics['model_calls']} model calls, "
+                         f"~{metrics['prompt_tokens']} prompt tokens sent, ~{metrics['saved_tokens']} saved by compaction")
+
+    async def process_query(self, query: str, history: Optional[list] = None) -> str:
         """
         Process a query through the LLM with MCP tool calling (Function Calling).
         Includes rate-limit handling, retry mechanism, and conversation memory.
+        :param history: Conversation history to use and extend (defaults to the client's own history);
+                        callers serving several users pass one list per session
         """
+        if history is None:
+            history = self.conversation_history
         # Append user query to history
-        self.conversation_history.append({"role": "user", "content": query})
-        
-        # List all connected server tools
-        all_tools = []
-        for server_name, session in self.servers.items():
-            try:
-                response = await session.list_tools()
-                server_tools = [{
-                    **tool.model_dump(),
-                    "server_name": server_name  # Tag with server name
-                } for tool in response.tools]
-                all_tools.extend(server_tools)
-                print(f"\n{server_name} tools:", [t['name'] for t in server_tools])
-            except Exception as e:
-                print(f"Failed to get tools from {server_name}: {str(e)}")
+        history.append({"role": "user", "content": query})
         
-        if not all_tools:
+        # Tool schemas come from the registry (listed once per connection or tools/list_changed)
+        available_tools = await self.get_available_tools()
+        if not available_tools:
             raise ValueError("No tools available from any MCP server")
         
-        available_tools = [{
-              "type": "function",
-              "function": {
-                  "name": f"{tool['server_name']}_{tool['name']}",  # Add server name prefix
-                  "description": f"[{tool['server_name']}] {tool['description']}",  # Note server source
-                  "input_schema": tool['inputSchema']
-              }
-          } for tool in all_tools]
-        
         # Multi-turn tool call loop
+        metrics = {"model_calls": 0, "prompt_tokens": 0, "saved_tokens": 0}
         while True:
             try:
-                # Call API with retry and full conversation history
+                # Call API with retry and the compacted conversation history
+                self._prepare_history(history, metrics)
                 response = await self._call_with_retry(
                     self.client.chat.completions.create,
                     model=self.model,            
-                    messages=self.conversation_history,  # Full conversation history
+                    messages=history,  # Full conversation history
                     tools=available_tools,
                     max_tokens=4000  # Limit tokens to avoid extra cost
                 )
                 
                 content = response.choices[0]
                 # Append model response to history
-                self.conversation_history.append(content.message.model_dump())
+                history.append(content.message.model_dump())
                 
                 if content.finish_reason == "tool_calls":
-                    # Handle all tool calls
-                    for tool_call in content.message.tool_calls:
-                        full_tool_name = tool_call.function.name
-                        tool_args = json.loads(tool_call.function.arguments)
-                        
-                        # Parse server and tool name
-                        if '_' in full_tool_name:
-                            server_name, tool_name = full_tool_name.split('_', 1)
-                            session = self.servers.get(server_name)
-                            if not session:
-                                raise ValueError(f"No session found for server '{server_name}'")
-                        else:
-                            raise ValueError(f"Invalid tool name format, expected 'server_name_tool_name': {full_tool_name}")
-                        
-                        # Execute tool and log result
-                        print(f"\nExecuting tool: {tool_name} (args: {tool_args})")
-                        result = await session.call_tool(tool_name, tool_args)
-                        tool_response = result.content[0].text
-                        print(f"Tool result: {tool_response}")  # Show abbreviated result
-                        
-                        # Append tool result to history
-                        self.conversation_history.append({
+                    # Execute all tool calls of this message concurrently (limited per server)
+                    tool_calls = content.message.tool_calls
+                    results = await asyncio.gather(
+                        *(self._execute_tool_call(tool_call.function.name, tool_call.function.arguments)
+                          for tool_call in tool_calls),
+                        return_exceptions=True
+                    )
+                    for result in results:
+                        if isinstance(result, BaseException):
+                            raise result
+
+                    # Append tool results to history in the original order
+                    for tool_call, tool_response in zip(tool_calls, results):
+                        history.append({
                             "role": "tool",
-                            "content": tool_response,
+                            "content": self.history_manager.clip_tool_result(history, tool_response),
                             "tool_call_id": tool_call.id,
                         })
-                        
-                        # Brief delay between tool calls to avoid rate limits
-                        await asyncio.sleep(0.5)
                 else:
                     # Task complete, return final result
+                    self._finish_metrics(metrics)
                     return content.message.content
                     
             except RateLimitError as e:
                 self.logger.error(f"Rate limit error: {str(e)}")
+                self._finish_metrics(metrics)
                 return "Request failed due to API rate limiting. Please try again later."
             except Exception as e:
                 self.logger.error(f"Query processing error: {str(e)}")
+                self._finish_metrics(metrics)
                 return f"Query processing error: {str(e)}"
     
+    async def stream_query(self, query: str, history: Optional[list] = None):
+        """
+        Streaming variant of process_query: the same multi-turn tool loop, with the model called
+        using stream=True. Yields event dicts as they happen:
+          {"type": "token", "content": ...}                       model output delta
+          {"type": "tool_start", "id", "name", "arguments"}       a tool call begins
+          {"type": "tool_end", "id", "name", "result"}            a tool call finished
+          {"type": "final", "content": ..., "metrics": {...}}     the final answer and prompt token metrics
+          {"type": "error", "message": ...}                       processing failed
+        """
+        if history is None:
+            history = self.conversation_history
+        history.append({"role": "user", "content": query})
+
+        pending = set()
+        metrics = {"model_calls": 0, "prompt_tokens": 0, "saved_tokens": 0}
+        try:
+            available_tools = await self.get_available_tools()
+            if not available_tools:
+                raise ValueError("No tools available from any MCP server")
+
+            while True:
+                self._prepare_history(history, metrics)
+                stream = await self._call_with_retry(
+                    self.client.chat.completions.create,
+                    model=self.model,
+                    messages=history,
+                    tools=available_tools,
+                    max_tokens=4000,
+                    stream=True
+                )
+
+                # Accumulate content and tool-call fragments from the stream
+                content_parts = []
+                tool_calls = {}  # index -> {"id", "name", "arguments"}
+                finish_reason = None
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    delta = choice.delta
+                    if delta.content:
+                        content_parts.append(delta.content)
+                        yield {"type": "token", "content": delta.content}
+                    for fragment in delta.tool_calls or []:
+                        call = tool_calls.setdefault(fragment.index, {"id": "", "name": "", "arguments": ""})
+                        if fragment.id:
+                            call["id"] = fragment.id
+                        if fragment.function and fragment.function.name:
+                            call["name"] += fragment.function.name
+                        if fragment.function and fragment.function.arguments:
+                            call["arguments"] += fragment.function.arguments
+                    finish_reason = choice.finish_reason or finish_reason
+
+                content = ''.join(content_parts)
+                message = {"role": "assistant", "content": content or None}
+                calls = [tool_calls[index] for index in sorted(tool_calls)]
+                if calls:
+                    message["tool_calls"] = [{
+                        "id": call["id"],
+                        "type": "function",
+                        "function": {"name": call["name"], "arguments": call["arguments"]}
+                    } for call in calls]
+                history.append(message)
+
+                if finish_reason != "tool_calls" or not calls:
+                    self._finish_metrics(metrics)
+                    yield {"type": "final", "content": content, "metrics": metrics}
+                    return
+
+                # Run the tool calls concurrently, reporting each as it finishes
+                tasks = {}
+                for index, call in enumerate(calls):
+                    yield {"type": "tool_start", "id": call["id"], "name": call["name"], "arguments": call["arguments"]}
+                    tasks[asyncio.ensure_future(self._execute_tool_call(call["name"], call["arguments"]))] = index
+                pending = set(tasks)
+                results = [None] * len(calls)
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        index = tasks[task]
+                        results[index] = task.result()
+                        yield {"type": "tool_end", "id": calls[index]["id"], "name": calls[index]["name"],
+                               "result": results[index]}
+
+                # Append tool results to history in the original order
+                for call, tool_response in zip(calls, results):
+                    history.append({
+                        "role": "tool",
+                        "content": self.history_manager.clip_tool_result(history, tool_response),
+                        "tool_call_id": call["id"],
+                    })
+
+        except RateLimitError as e:
+            self.logger.error(f"Rate limit error: {str(e)}")
+            self._finish_metrics(metrics)
+            yield {"type": "error", "message": "Request failed due to API rate limiting. Please try again later."}
+        except Exception as e:
+            self.logger.error(f"Query processing error: {str(e)}")
+            self._finish_metrics(metrics)
+            yield {"type": "error", "message": f"Query processing error: {str(e)}"}
+        finally:
+            # The consumer went away (or a tool failed): do not leave tool calls running
+            for task in pending:
+                task.cancel()
+
     async def chat_loop(self):
         """Run the interactive chat loop."""
         print("\nMCP Client started. Type 'quit' to exit, 'reset' to clear history")
@@ -5,6 +5,10 @@ const resetBtn = document.getElementById('reset-btn');
 const loading = document.getElementById('loading');
 
 function addMessage(text, isUser) {
+    return createMessage(text, isUser).content;
+}
+
+function createMessage(text, isUser) {
     const messageDiv = document.createElement('div');
     const label = isUser ? 'You' : 'Assistant';
     messageDiv.className = `message ${isUser ? 'user-message' : 'bot-message'}`;
@@ -26,6 +30,35 @@ function addMessage(text, isUser) {
     messageDiv.appendChild(content);
     chatBox.appendChild(messageDiv);
     chatBox.scrollTop = chatBox.scrollHeight;
+    return { messageDiv, content };
+}
+
+function scrollToBottom() {
+    chatBox.scrollTop = chatBox.scrollHeight;
+}
+
+// Read a Server-Sent Events response body and call onEvent for each JSON event
+async function readEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const raw = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            const data = raw.split('\n')
+                .filter(line => line.startsWith('data: '))
+                .map(line => line.slice(6))
+                .join('\n');
+            if (data) onEvent(JSON.parse(data));
+        }
+    }
 }
 
 async function sendMessage() {
@@ -40,16 +73,50 @@ async function sendMessage() {
         const response = await fetch('/chat', {
             method: 'POST',
             headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
-            body: `query=${encodeURIComponent(message)}`
+            body: `query=${encodeURIComponent(message)}&stream=true`
         });
 
-        const data = await response.json();
-
-        if (data.error) {
-            addMessage('Error: ' + data.error);
-        } else {
-            addMessage(data.response);
+        if (!response.headers.get('Content-Type')?.startsWith('text/event-stream')) {
+            const data = await response.json();
+            addMessage(data.error ? 'Error: ' + data.error : data.response);
+            return;
         }
+
+        // Render the answer incrementally as events arrive
+        const { messageDiv, content } = createMessage('', false);
+        const toolList = document.createElement('div');
+        toolList.className = 'tool-status';
+        messageDiv.insertBefore(toolList, content);
+        const toolItems = {};
+        let text = '';
+
+        await readEvents(response, (event) => {
+            if (event.type === 'token') {
+                text += event.content;
+                content.innerHTML = renderMarkdown(text);
+            } else if (event.type === 'tool_start') {
+                // Text before a tool call is only a preamble; the next turn replaces it
+                text = '';
+                content.innerHTML = '';
+                const item = document.createElement('div');
+                item.className = 'tool-item tool-item--running';
+                item.textContent = `⚙ ${event.name}`;
+                toolList.appendChild(item);
+                toolItems[event.id] = item;
+            } else if (event.type === 'tool_end') {
+                const item = toolItems[event.id];
+                if (item) {
+                    item.className = 'tool-item tool-item--done';
+                    item.textContent = `✓ ${event.name}`;
+                }
+            } else if (event.type === 'final') {
+                content.innerHTML = renderMarkdown(event.content || text);
+            } else if (event.type === 'error') {
+                content.textContent = 'Error: ' + event.message;
+            }
+            loading.style.display = 'none';
+            scrollToBottom();
+        });
     } catch (error) {
         addMessage('Request failed: ' + error.message);
     } finally {
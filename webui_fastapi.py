@@ -3,14 +3,17 @@ FastAPI-based Web UI for MCP Client
 """
 import asyncio
 import json
-from typing import Dict, Any, List
-from fastapi import FastAPI, Request, Form, BackgroundTasks
-from fastapi.responses import HTMLResponse
+import os
+import secrets
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+from fastapi import FastAPI, Request, Response, Form, BackgroundTasks
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import uvicorn
 
-from mcp_client import MCPClient
+from mcp_client import MCPClient, ConversationHistory
 
 # Initialize FastAPI app
 app = FastAPI(title="MCP Client Web UI", description="Web interface for MCP Client")
@@ -18,9 +21,57 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Initialize templates
 templates = Jinja2Templates(directory="templates")
 
-# Global MCP client instance
+# Global MCP client instance (MCP server sessions are shared by all web sessions)
 mcp_client = None
 
+# Session settings: conversations are keyed by the X-Session-ID header or the session cookie
+SESSION_COOKIE = "mcp_session"
+SESSION_HEADER = "X-Session-ID"
+MAX_SESSIONS = int(os.environ.get("WEBUI_MAX_SESSIONS", "1000"))
+
+
+class Conversation:
+    """Conversation history of one web session, with a lock serializing its queries"""
+
+    def __init__(self):
+        self.history: List[Dict[str, Any]] = ConversationHistory()
+        self.lock = asyncio.Lock()
+
+
+class SessionStore:
+    """Bounded session store; the least recently used conversation is evicted when full"""
+
+    def __init__(self, max_sessions: int):
+        self.max_sessions = max(1, max_sessions)
+        self._sessions: "OrderedDict[str, Conversation]" = OrderedDict()
+
+    def get(self, session_id: str) -> Conversation:
+        """Get (or create) the conversation of a session and mark it as recently used"""
+        conversation = self._sessions.get(session_id)
+        if conversation is None:
+            conversation = self._sessions[session_id] = Conversation()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+        return conversation
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+sessions = SessionStore(MAX_SESSIONS)
+
+
+def get_session_id(request: Request, response: Response) -> str:
+    """Read the session id from the header or cookie; issue a new cookie if there is none"""
+    session_id: Optional[str] = request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE)
+    if not session_id:
+        session_id = secrets.token_urlsafe(16)
+    if request.cookies.get(SESSION_COOKIE) != session_id:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+    return session_id
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize MCP client on startup"""
@@ -57,66 +108,70 @@ async def shutdown_event():
     if mcp_client:
         await mcp_client.cleanup()
 
+async def get_servers_info() -> List[Dict[str, Any]]:
+    """Get connected servers and their tool names from the client's tool registry"""
+    if not mcp_client:
+        return []
+    server_tools = await mcp_client.get_server_tools()
+    return [{"name": name, "tools": [tool.name for tool in tools]} for name, tools in server_tools.items()]
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """Serve the main chat interface"""
     # Get available servers and tools
-    servers_info = []
-    if mcp_client:
-        for server_name in mcp_client.servers.keys():
-            try:
-                session = mcp_client.servers[server_name]
-                response = await session.list_tools()
-                tools = [tool.name for tool in response.tools]
-                servers_info.append({
-                    "name": server_name,
-                    "tools": tools
-                })
-            except Exception as e:
-                print(f"Failed to get tools from {server_name}: {str(e)}")
-    
+    servers_info = await get_servers_info()
+
     return templates.TemplateResponse("index.html", {
         "request": request,
         "servers": servers_info
     })
 
+async def stream_events(query: str, conversation: Conversation):
+    """Run a streaming query and encode its events as Server-Sent Events"""
+    async with conversation.lock:
+        async for event in mcp_client.stream_query(query, conversation.history):
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
 @app.post("/chat")
-async def chat(query: str = Form(...)):
-    """Process chat messages"""
+async def chat(request: Request, response: Response, query: str = Form(...), stream: bool = Form(False)):
+    """Process chat messages within the caller's session (stream=true returns Server-Sent Events)"""
     if not mcp_client:
         return {"error": "MCP client not initialized"}
     
+    conversation = sessions.get(get_session_id(request, response))
+    if stream:
+        streaming = StreamingResponse(
+            stream_events(query, conversation),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+        # A returned Response bypasses the injected one, so carry over the session cookie
+        for cookie in response.headers.getlist("set-cookie"):
+            streaming.headers.append("set-cookie", cookie)
+        return streaming
+
     try:
-        # Process the query using MCP client
-        response = await mcp_client.process_query(query)
-        return {"response": response}
+        # Process the query using MCP client; queries of one session run one at a time
+        async with conversation.lock:
+            answer = await mcp_client.process_query(query, conversation.history)
+        return {"response": answer}
     except Exception as e:
         return {"error": f"Query processing error: {str(e)}"}
 
 @app.post("/reset")
-async def reset_conversation():
-    """Reset conversation history"""
+async def reset_conversation(request: Request, response: Response):
+    """Reset the caller's conversation history"""
     if mcp_client:
-        mcp_client.reset_conversation()
+        conversation = sessions.get(get_session_id(request, response))
+        async with conversation.lock:
+            conversation.history.clear()
         return {"status": "Conversation history cleared"}
     return {"error": "MCP client not initialized"}
  
 @app.get("/servers")
 async def list_servers():
     """List available servers and their tools"""
-    servers_info = []
-    if mcp_client:
-        for server_name in mcp_client.servers.keys():
-            try:
-                session = mcp_client.servers[server_name]
-                response = await session.list_tools()
-                tools = [tool.name for tool in response.tools]
-                servers_info.append({
-                    "name": server_name,
-                    "tools": tools
-                })
-            except Exception as e:
-                print(f"Failed to get tools from {server_name}: {str(e)}")
+    servers_info = await get_servers_info()
     return {"servers": servers_info}
 
 if __name__ == "__main__":